@@ -0,0 +1,63 @@
+"""
+Benchmark encoding a large synthetic DVI document, with the direct bytes
+encoder and with the instruction-object encoder.
+
+Usage: python benchmarks/bench_dvi_encoding.py [--pages N]
+"""
+import argparse
+import io
+import random
+import time
+
+from nex.dampf.dvi_document import DVIDocument
+
+
+def make_lines(nr_lines, seed=0):
+    """Make lines of words, as lists of character codes, and the spaces
+    between them."""
+    rng = random.Random(seed)
+    space = 218453
+    return [[([rng.randint(33, 126) for _ in range(rng.randint(1, 10))],
+              space + rng.choice((0, 0, 0, 1000, -1000)))
+             for _ in range(12)]
+            for _ in range(nr_lines)]
+
+
+def write_document(nr_pages, keep_instructions, lines):
+    """Write a document, with the same lines on each page."""
+    # Each character has a fixed width, as in a font.
+    widths = {code: 100000 + 3000 * code for code in range(128)}
+    stream = io.BytesIO()
+    doc = DVIDocument(magnification=1000, stream=stream,
+                      keep_instructions=keep_instructions)
+    for _ in range(nr_pages):
+        doc.begin_new_page()
+        doc.select_font(1)
+        for line in lines:
+            doc.push()
+            for word, space in line:
+                for code in word:
+                    doc.typeset_char(code, widths[code])
+                doc.right(space)
+            doc.pop()
+            doc.down(786432)
+    doc.write()
+    return len(stream.getvalue())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--pages', type=int, default=200)
+    args = parser.parse_args()
+
+    lines = make_lines(45)
+    for name, keep_instructions in (('bytes', False), ('instructions', True)):
+        start = time.perf_counter()
+        nr_bytes = write_document(args.pages, keep_instructions, lines)
+        duration = time.perf_counter() - start
+        print(f'{name:>12}: {nr_bytes} bytes in {duration:.2f} s, '
+              f'{nr_bytes / duration / 1e6:.2f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -10,7 +10,8 @@ from .constants.codes import (CatCode, WeirdChar, MathClass, MathCode,
                               not_a_delimiter_code, ignored_delimiter_code)
 from .tokens import InstructionToken
 from .box import AbstractBox
-from .utils import ascii_characters, enums_to_values
+from .utils import ascii_characters, enums_to_values, GlueSpec, zero_glue
+from .pmap import pmap
 from . import evaluator as evaler
 
 
@@ -32,7 +33,7 @@ def check_type(type_, value):
                    Instructions.mu_skip.value,
                    Instructions.glue_parameter.value,
                    Instructions.mu_glue_parameter.value):
-        expected_type = dict
+        expected_type = GlueSpec
     elif type_ in (Instructions.toks.value,
                    Instructions.token_parameter.value):
         expected_type = list
@@ -50,10 +51,12 @@ class TexNamedValues:
     Accessor for either parameters or special values.
     names_to_values: A container mapping names to values.
     names_to_types: A container mapping these names to their types.
+    The values are kept in a persistent map, so that a snapshot of them is
+    just a reference to the map.
     """
 
     def __init__(self, names_to_values, names_to_types):
-        self.names_to_values = names_to_values
+        self.names_to_values = pmap(names_to_values)
         self.names_to_types = names_to_types
 
     def _check_and_get_value(self, name):
@@ -71,12 +74,26 @@ class TexNamedValues:
         self._check_and_get_value(name)
         value_type = self.names_to_types[name]
         check_type(value_type, value)
-        self.names_to_values[name] = value
+        self.names_to_values = self.names_to_values.set(name, value)
 
 
 # Start of parameters.
 
-glue_keys = ('dimen', 'stretch', 'shrink')
+glue_keys = GlueSpec._fields
+
+
+def get_date_and_time_values():
+    """Get the values of the date and time parameters at the moment."""
+    now = datetime.now()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    seconds_since_midnight = (now - midnight).total_seconds()
+    minutes_since_midnight = int(seconds_since_midnight // 60)
+    return {
+        Parameters.time: minutes_since_midnight,
+        Parameters.day: now.day,
+        Parameters.month: now.month,
+        Parameters.year: now.year,
+    }
 
 
 class ParametersAccessor(TexNamedValues):
@@ -94,11 +111,6 @@ class ParametersAccessor(TexNamedValues):
         mu_glue_parameters = param_instr_subset(Instructions.mu_glue_parameter)
         token_parameters = param_instr_subset(Instructions.token_parameter)
 
-        now = datetime.now()
-        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        seconds_since_midnight = (now - midnight).total_seconds()
-        minutes_since_midnight = int(seconds_since_midnight // 60)
-
         parameter_values = {}
 
         for p in integer_parameters:
@@ -109,21 +121,17 @@ class ParametersAccessor(TexNamedValues):
         parameter_values[Parameters.mag] = 1000
         parameter_values[Parameters.escape_char] = ord('\\')
         parameter_values[Parameters.end_line_char] = ord('\r')
-        parameter_values[Parameters.time] = minutes_since_midnight
-        parameter_values[Parameters.day] = now.day
-        parameter_values[Parameters.month] = now.month
-        parameter_values[Parameters.year] = now.year
+        parameter_values.update(get_date_and_time_values())
 
         for p in dimen_parameters:
             parameter_values[p] = 0
 
-        def get_zero_glue():
-            return {k: 0 for k in glue_keys}
+        # Glue specs are immutable, so all can share one zero value.
         for p in glue_parameters:
-            parameter_values[p] = get_zero_glue()
+            parameter_values[p] = zero_glue
 
         for p in mu_glue_parameters:
-            parameter_values[p] = get_zero_glue()
+            parameter_values[p] = zero_glue
 
         def get_empty_token_list():
             return InstructionToken(
@@ -138,8 +146,11 @@ class ParametersAccessor(TexNamedValues):
 
     @classmethod
     def default_local(cls, enclosing_scope):
-        parameter_values = {p: None for p in Parameters}
-        return cls(parameter_values, param_to_type)
+        return cls(_unset_parameter_values, param_to_type)
+
+
+# Persistent maps can be shared freely, so all local scopes start from one.
+_unset_parameter_values = pmap({p: None for p in Parameters})
 
 
 # End of parameters.
@@ -185,21 +196,19 @@ class Registers:
 
     def __init__(self, register_map):
         # Map of strings representing register types, to a map of keys to
-        # values.
-        self.register_map = register_map
+        # values. Both levels are persistent maps.
+        self.register_map = pmap({type_: pmap(register)
+                                  for type_, register in register_map.items()})
 
     @classmethod
     def default_initial(cls):
-        def init_register():
-            return {i: None for i in range(256)}
-        register_map = {
-            Instructions.count.value: init_register(),
-            Instructions.dimen.value: init_register(),
-            Instructions.skip.value: init_register(),
-            Instructions.mu_skip.value: init_register(),
-            Instructions.toks.value: init_register(),
-            Instructions.set_box.value: init_register(),
-        }
+        register_map = {type_: _unset_register
+                        for type_ in (Instructions.count.value,
+                                      Instructions.dimen.value,
+                                      Instructions.skip.value,
+                                      Instructions.mu_skip.value,
+                                      Instructions.toks.value,
+                                      Instructions.set_box.value)}
         return cls(register_map)
 
     @classmethod
@@ -237,7 +246,8 @@ class Registers:
 
     def _set(self, type_, i, value):
         register = self._check_and_get_register(type_)
-        register[i] = value
+        self.register_map = self.register_map.set(type_,
+                                                  register.set(i, value))
 
     def set(self, type_, i, value):
         # Check value matches what register is meant to hold.
@@ -247,6 +257,9 @@ class Registers:
         self._set(type_, i, value)
 
 
+_unset_register = pmap({i: None for i in range(256)})
+
+
 # End of registers.
 
 # Start of codes.
@@ -264,14 +277,16 @@ class Codes:
                  space_factor_code,
                  delimiter_code,
                  ):
-        self.code_type_to_char_map = {
-            Instructions.cat_code.value: char_to_cat,
-            Instructions.math_code.value: char_to_math_code,
-            Instructions.upper_case_code.value: upper_case_code,
-            Instructions.lower_case_code.value: lower_case_code,
-            Instructions.space_factor_code.value: space_factor_code,
-            Instructions.delimiter_code.value: delimiter_code,
-        }
+        # Persistent maps, both of code types to character maps, and of
+        # characters to codes.
+        self.code_type_to_char_map = pmap({
+            Instructions.cat_code.value: pmap(char_to_cat),
+            Instructions.math_code.value: pmap(char_to_math_code),
+            Instructions.upper_case_code.value: pmap(upper_case_code),
+            Instructions.lower_case_code.value: pmap(lower_case_code),
+            Instructions.space_factor_code.value: pmap(space_factor_code),
+            Instructions.delimiter_code.value: pmap(delimiter_code),
+        })
 
     @staticmethod
     def default_initial_cat_codes():
@@ -351,18 +366,7 @@ class Codes:
 
     @classmethod
     def default_local(cls, enclosing_scope):
-        char_to_cat = get_unset_ascii_char_dict()
-        char_to_math_code = get_unset_ascii_char_dict()
-        lower_case_code = get_unset_ascii_char_dict()
-        upper_case_code = get_unset_ascii_char_dict()
-        space_factor_code = get_unset_ascii_char_dict()
-        delimiter_code = get_unset_ascii_char_dict()
-        return cls(char_to_cat,
-                   char_to_math_code,
-                   lower_case_code,
-                   upper_case_code,
-                   space_factor_code,
-                   delimiter_code)
+        return cls(*(_unset_ascii_char_map,) * 6)
 
     def get(self, code_type, char):
         value = self._check_and_get_char_map_value(code_type, char)
@@ -375,7 +379,8 @@ class Codes:
         self._check_and_get_char_map_value(code_type, char)
         char_map = self._check_and_get_char_map(code_type)
         # TODO: Check code type
-        char_map[char] = code
+        self.code_type_to_char_map = self.code_type_to_char_map.set(
+            code_type, char_map.set(char, code))
 
     def get_cat_code(self, char):
         return self.get(Instructions.cat_code.value, char)
@@ -437,4 +442,7 @@ class Codes:
             raise ValueError(f'Character {char} not in codes {code_type}')
         return char_map[char]
 
+
+_unset_ascii_char_map = pmap(get_unset_ascii_char_dict())
+
 # End of codes.
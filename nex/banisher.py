@@ -1,5 +1,6 @@
 from contextlib import contextmanager
 import logging
+import re
 from enum import Enum
 
 from .pydvi.TeXUnit import sp2pt
@@ -54,6 +55,11 @@ the_quantity_parser = parsing.get_parser(start='the_quantity')
 general_text_parser = parsing.get_parser(start='general_text')
 file_name_parser = parsing.get_parser(start='file_name')
 
+# How a font definition like '\font\tenrm=cmr10' usually continues after
+# the control sequence.
+font_file_name_pattern = re.compile(r'\s*=?\s*([\w./-]+)')
+font_file_name_max_length = 128
+
 
 def stringify_instrs(ts):
     """Represent a sequence of instructions as a sequence of strings. The bit
@@ -674,6 +680,19 @@ class Banisher:
         # along with any spare tokens from the expansion
         return [cs_token] + list(out_queue.queue), []
 
+    def _prefetch_font(self):
+        """Guess the file name of a font being defined, from the text that
+        follows, and start loading it in the background. The guess can be
+        wrong, for instance if the text is made by a macro, in which case the
+        font is just loaded when it is defined."""
+        try:
+            text = self.reader.peek_text(font_file_name_max_length)
+        except IndexError:
+            return
+        match = font_file_name_pattern.match(text)
+        if match is not None:
+            self.state.global_font_state.prefetch(match.group(1))
+
     def _expand_next_input_token(self):
         first_token = self.instructions.next_expanded()
         instr = first_token.instruction
@@ -774,7 +793,10 @@ class Banisher:
             # Add an unexpanded control sequence as an instruction token to the
             # output.
             logger.debug(f'Grabbing {instr} argument')
-            return [], [first_token, self.instructions.next_unexpanded()]
+            target_token = self.instructions.next_unexpanded()
+            if instr == Instructions.font:
+                self._prefetch_font()
+            return [], [first_token, target_token]
         # \afterassignment, or \aftergroup.
         elif instr in (Instructions.after_assignment,
                        Instructions.after_group):
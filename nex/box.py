@@ -123,7 +123,7 @@ def get_penalty(pre_break_conts, break_item):
     # the pre-break text is nonempty, or the current value of
     # \exhyphenpenalty if the pre-break text is empty."
     elif isinstance(break_item, DiscretionaryBreak):
-        raise NotImplementedError
+        return break_item.penalty
     else:
         raise ValueError(f"Item is not a break-point: {break_item}")
 
@@ -169,6 +169,9 @@ def is_break_point(h_list, i):
 
 class ListElement:
 
+    # Let subclasses opt in to slots.
+    __slots__ = ()
+
     def __repr__(self):
         return f'{self.__class__.__name__}({self.__dict__.__repr__()})'
 
@@ -204,10 +207,16 @@ class AbstractBox(ListElement):
         self.spread = spread
         if to is not None and spread is not None:
             raise Exception('Cannot specify both to and spread')
-        self.contents = list(contents)
+        self._contents = list(contents)
+        # Whether the contents list is shared with copies of the box, so must
+        # be copied before it is changed.
+        self._shares_contents = False
+        # Whether the box has its final size, so that the glue inside it is
+        # fixed. The lengths the glue takes are only worked out when they
+        # are needed, and are kept by the box, rather than the glue. See
+        # `glue_length`.
         self.set_glue = set_glue
-        if set_glue:
-            self.scale_and_set()
+        self._glue_setting = None
         self.offset = offset
 
     def __repr__(self):
@@ -224,10 +233,35 @@ class AbstractBox(ListElement):
             cls_name = f'|{cls_name}|'
         return drep(cls_name, a)
 
+    @property
+    def contents(self):
+        """The items in the box. This list may be shared with copies of the
+        box, so should not be changed directly, but by `append` and
+        `extend`."""
+        return self._contents
+
+    @contents.setter
+    def contents(self, contents):
+        self._contents = list(contents)
+        self._shares_contents = False
+        self._glue_setting = None
+
+    def _own_contents(self):
+        """Get a contents list that can be changed without affecting
+        copies."""
+        if self._shares_contents:
+            self._contents = self._contents[:]
+            self._shares_contents = False
+        self._glue_setting = None
+        return self._contents
+
+    @property
+    def glues(self):
+        return [e for e in self.contents if isinstance(e, Glue)]
+
     @property
     def un_set_glues(self):
-        return [e for e in self.contents
-                if isinstance(e, Glue) and not e.is_set]
+        return [] if self.set_glue else self.glues
 
     @property
     def stretch(self):
@@ -284,32 +318,50 @@ class AbstractBox(ListElement):
         return w
 
     def append(self, *args, **kwargs):
-        self.contents.append(*args, **kwargs)
+        self._own_contents().append(*args, **kwargs)
 
     def extend(self, *args, **kwargs):
-        self.contents.extend(*args, **kwargs)
+        self._own_contents().extend(*args, **kwargs)
 
     def copy(self, *args, **kwargs):
-        # If glue is set, need to tell the constructor that set_glue should be
-        # True, but that the glue is already set.
-        if self.set_glue:
-            raise NotImplementedError('Can only copy un-set boxes at the '
-                                      'moment, because that is all that is '
-                                      'needed')
-        return self.__class__(contents=self.contents[:],
-                              to=self.to, spread=self.spread, set_glue=False)
+        """Copy the box, sharing its contents until either box's contents are
+        changed. Items in the contents are not copied: boxes within are
+        shared in turn, and are only copied when they are changed."""
+        new_box = self.__class__(contents=(),
+                                 to=self.to, spread=self.spread,
+                                 set_glue=self.set_glue, offset=self.offset)
+        new_box._contents = self._contents
+        new_box._shares_contents = self._shares_contents = True
+        # The same contents are set the same way.
+        new_box._glue_setting = self._glue_setting
+        return new_box
 
     def glue_set_ratio(self):
+        glues = self.glues
         return glue_set_ratio(self.natural_length, self.desired_length,
-                              tuple(self.stretch), tuple(self.shrink))
+                              tuple(sum_infinities(g.stretch for g in glues)),
+                              tuple(sum_infinities(g.shrink for g in glues)))
 
-    def scale_and_set(self):
-        line_state, glue_ratio, glue_set_order = self.glue_set_ratio()
-        # I undo the disobeyance I did in the glue set ratio logic, to align
-        # with the TeXbook from now on.
-        if glue_ratio in (GlueRatio.no_shrinkability,
-                          GlueRatio.no_stretchability):
-            glue_ratio = 0.0
+    @property
+    def glue_setting(self):
+        """The line state, glue set ratio and glue set order with which the
+        glue in the box is set, worked out on first request."""
+        if not self.set_glue:
+            raise AttributeError('Box is not set yet, so its glue has no '
+                                 'setting')
+        if self._glue_setting is None:
+            line_state, glue_ratio, glue_set_order = self.glue_set_ratio()
+            # I undo the disobeyance I did in the glue set ratio logic, to
+            # align with the TeXbook from now on.
+            if glue_ratio in (GlueRatio.no_shrinkability,
+                              GlueRatio.no_stretchability):
+                glue_ratio = 0.0
+            self._glue_setting = line_state, glue_ratio, glue_set_order
+        return self._glue_setting
+
+    def glue_length(self, g):
+        """The length a glob of glue in the box takes, when the box is set."""
+        line_state, glue_ratio, glue_set_order = self.glue_setting
 
         # Note I've quoted this from the TeXbook, talking about setting glue in
         # an H Box. But it later says that this all applies to V Boxes, so I've
@@ -318,34 +370,29 @@ class AbstractBox(ListElement):
         # Every glob of glue in the list being boxed is modified. Suppose the
         # glue has natural length u, stretchability y, and shrinkability z,
         # where y is a jth order infinity and z is a kth order infinity.
-        for i, item in enumerate(self.contents):
-            if (not isinstance(item, Glue)) or item.is_set:
-                continue
-            g = item
-            if line_state == LineState.naturally_good:
+        if line_state == LineState.naturally_good:
+            glue_diff = 0
+        elif line_state == LineState.should_stretch:
+            glue_order, glue_factor = extract_dimen(g.stretch)
+            # [Each] glue takes the new length u + ry if j=i;
+            # it keeps its natural length u if j != i.
+            if glue_order == glue_set_order:
+                glue_diff = glue_ratio * glue_factor
+            else:
                 glue_diff = 0
-            elif line_state == LineState.should_stretch:
-                glue_order, glue_factor = extract_dimen(g.stretch)
-                # [Each] glue takes the new length u + ry if j=i;
-                # it keeps its natural length u if j != i.
-                if glue_order == glue_set_order:
-                    glue_diff = glue_ratio * glue_factor
-                else:
-                    glue_diff = 0
-            elif line_state == LineState.should_shrink:
-                glue_order, glue_factor = extract_dimen(g.shrink)
-                # [Each] glue takes the new length u-rz if k = i; it
-                # keeps its natural length u if k != i.
-                if glue_order == glue_set_order:
-                    glue_diff = -glue_ratio * glue_factor
-                else:
-                    glue_diff = 0
+        elif line_state == LineState.should_shrink:
+            glue_order, glue_factor = extract_dimen(g.shrink)
+            # [Each] glue takes the new length u-rz if k = i; it
+            # keeps its natural length u if k != i.
+            if glue_order == glue_set_order:
+                glue_diff = -glue_ratio * glue_factor
             else:
-                raise ValueError(f'Unknown line state: {line_state}')
-            # Notice that stretching or shrinking occurs only when the glue
-            # has the highest order of infinity that doesn't cancel out.
-            self.contents[i].set(round(g.natural_length + glue_diff))
-        self.set_glue = True
+                glue_diff = 0
+        else:
+            raise ValueError(f'Unknown line state: {line_state}')
+        # Notice that stretching or shrinking occurs only when the glue
+        # has the highest order of infinity that doesn't cancel out.
+        return round(g.natural_length + glue_diff)
 
     def badness(self):
         """
@@ -387,7 +434,9 @@ class AbstractBox(ListElement):
 class HBox(AbstractBox):
 
     def get_length(self, item):
-        if isinstance(item, (Glue, Kern)):
+        if isinstance(item, Glue):
+            return self.glue_length(item)
+        elif isinstance(item, Kern):
             return item.length
         else:
             return item.width
@@ -446,7 +495,9 @@ class HBox(AbstractBox):
 class VBox(AbstractBox):
 
     def get_length(self, item):
-        if isinstance(item, (Glue, Kern)):
+        if isinstance(item, Glue):
+            return self.glue_length(item)
+        elif isinstance(item, Kern):
             return item.length
         else:
             return item.height
@@ -535,19 +586,10 @@ class Glue(ListElement):
         self.stretch = stretch
         self.shrink = shrink
 
-        self.set_dimen = None
-
     def __repr__(self):
-        if self.set_dimen is None:
-            return 'G({} +{} -{})'.format(dimrep(self.natural_length),
-                                          dimrep(self.stretch),
-                                          dimrep(self.shrink))
-        else:
-            return f'|G|({dimrep(self.set_dimen)})'
-
-    @property
-    def is_set(self):
-        return self.set_dimen is not None
+        return 'G({} +{} -{})'.format(dimrep(self.natural_length),
+                                      dimrep(self.stretch),
+                                      dimrep(self.shrink))
 
     @property
     def min_length(self):
@@ -556,22 +598,6 @@ class Glue(ListElement):
         else:
             return self.natural_length - self.shrink
 
-    def set_naturally(self):
-        self.set_dimen = self.natural_length
-
-    def set(self, dimen):
-        self.set_dimen = dimen
-
-    def unset(self):
-        self.set_dimen = None
-
-    @property
-    def length(self):
-        if self.set_dimen is not None:
-            return self.set_dimen
-        else:
-            raise AttributeError('Glue is not set, so has no length')
-
 
 class Kern(ListElement):
     discardable = True
@@ -623,13 +649,18 @@ class Insertion(ListElement):
 #     Boxes.
 
 class Character(ListElement):
+    """Characters are not modified once made, so one instance is shared for
+    each character of each font. See `GlobalFontState.get_character`."""
+    __slots__ = ('code', 'width', 'height', 'depth', 'font_id')
+
     discardable = False
 
-    def __init__(self, code, width, height, depth):
+    def __init__(self, code, width, height, depth, font_id=None):
         self.code = code
         self.width = width
         self.height = height
         self.depth = depth
+        self.font_id = font_id
 
     def __repr__(self):
         if self.code in printable_ascii_codes:
@@ -647,9 +678,46 @@ class Ligature(ListElement):
 #     Miscellanea.
 
 
+def _h_list_width(h_list):
+    return sum(e.natural_length if isinstance(e, Glue)
+               else e.length if isinstance(e, Kern)
+               else e.width
+               for e in h_list)
+
+
 class DiscretionaryBreak(ListElement):
+    """A place where a line may be broken, with material to put before and
+    after the break if it is taken, and material to put there if not."""
     discardable = False
 
+    def __init__(self, pre_break, post_break, no_break, penalty):
+        self.pre_break = pre_break
+        self.post_break = post_break
+        self.no_break = no_break
+        # The penalty depends on parameters when the break is made, so is
+        # decided then.
+        self.penalty = penalty
+
+    def __repr__(self):
+        return (f'D({contsrep(self.pre_break)}, {contsrep(self.post_break)},'
+                f' {contsrep(self.no_break)})')
+
+    @property
+    def width(self):
+        return _h_list_width(self.no_break)
+
+    @property
+    def pre_break_width(self):
+        return _h_list_width(self.pre_break)
+
+    @property
+    def height(self):
+        return max((e.height for e in self.no_break), default=0)
+
+    @property
+    def depth(self):
+        return max((e.depth for e in self.no_break), default=0)
+
 
 class MathOn(ListElement):
     discardable = True
@@ -1,18 +1,37 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import functools
 import subprocess
 
 from .constants.parameters import Parameters
-from .dampf.dvi_document import DVIDocument
+from .dampf.dvi_document import DVIDocument, PageWriter, get_char_widths
+from .display_list import flatten_page, get_display_list
+from .state import TidyEnd
 from .utils import LogicError
 from . import box
 
 
+def write_box_contents_to_doc(doc, a_box):
+    """Write the items in a set box. The box decides the lengths of the glue
+    inside it."""
+    horizontal = isinstance(a_box, box.HBox)
+    for item in a_box.contents:
+        if isinstance(item, box.Glue):
+            amount = a_box.get_length(item)
+            if horizontal:
+                doc.right(amount)
+            else:
+                doc.down(amount)
+        else:
+            write_box_to_doc(doc, item, horizontal=horizontal)
+
+
 def write_box_to_doc(doc, item, horizontal=False):
     if isinstance(item, box.VBox):
         doc.push()
         doc.right(item.offset)
 
-        for sub_item in item.contents:
-            write_box_to_doc(doc, sub_item, horizontal=False)
+        write_box_contents_to_doc(doc, item)
 
         doc.pop()
         if horizontal:
@@ -23,8 +42,7 @@ def write_box_to_doc(doc, item, horizontal=False):
         doc.push()
         doc.down(-item.offset)
 
-        for sub_item in item.contents:
-            write_box_to_doc(doc, sub_item, horizontal=True)
+        write_box_contents_to_doc(doc, item)
 
         doc.pop()
         if horizontal:
@@ -36,29 +54,20 @@ def write_box_to_doc(doc, item, horizontal=False):
     elif isinstance(item, box.FontSelection):
         doc.select_font(item.font_nr)
     elif isinstance(item, box.Character):
-        doc.put_char(item.code)
-        doc.right(item.width)
-    elif isinstance(item, box.Glue) and not item.is_set:
-        raise LogicError('Found un-set glue while writing to DVI')
-        # if not horizontal:
-        #     item.set_naturally()
-        # amount = item.length
-        # if horizontal:
-        #     doc.right(amount)
-        # else:
-        #     doc.down(amount)
-    elif (isinstance(item, box.Kern) or
-          (isinstance(item, box.Glue) and item.is_set)):
+        doc.typeset_char(item.code, item.width)
+    elif isinstance(item, box.Glue):
+        raise LogicError('Found glue outside a box while writing to DVI')
+    elif isinstance(item, box.Kern):
         amount = item.length
         if horizontal:
             doc.right(amount)
         else:
             doc.down(amount)
     elif isinstance(item, box.Rule):
-        doc.put_rule(item.height, item.width)
         if horizontal:
-            doc.right(item.width)
+            doc.set_rule(item.height, item.width)
         else:
+            doc.put_rule(item.height, item.width)
             doc.down(item.height)
     # TODO: Should such items even get this far?
     elif isinstance(item, box.Penalty):
@@ -67,16 +76,271 @@ def write_box_to_doc(doc, item, horizontal=False):
         raise NotImplementedError
 
 
-def write_to_dvi_file(state, out_stream, write_pdf=False):
+class _BaselineMover:
+    """Moves a document to absolute positions on a page. The marks on each
+    baseline are written inside a push and pop, so that the next baseline
+    can be reached from the start of the last one, which is usually directly
+    above it."""
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.h, self.v = 0, 0
+        # The position saved by the last push, if any.
+        self.saved = None
+
+    def move_to(self, h, v):
+        doc = self.doc
+        if v != self.v:
+            if self.saved is not None:
+                doc.pop()
+                self.h, self.v = self.saved
+            doc.right(h - self.h)
+            doc.down(v - self.v)
+            doc.push()
+            self.saved = h, v
+        else:
+            doc.right(h - self.h)
+        self.h, self.v = h, v
+
+    def finish(self):
+        if self.saved is not None:
+            self.doc.pop()
+
+
+def write_display_list_to_doc(doc, display_list):
+    """Write the marks of a page's display list."""
+    for font_nr, font_name, file_name in display_list.font_definitions:
+        doc.define_font(font_nr, font_name, font_path=file_name)
+    mover = _BaselineMover(doc)
+    for font_nr, code, h, v in display_list.glyphs.tolist():
+        doc.select_font(font_nr)
+        mover.move_to(h, v)
+        mover.h += doc.place_char(code)
+    for h, v, width, height in display_list.rules.tolist():
+        mover.move_to(h, v)
+        doc.put_rule(height, width)
+    mover.finish()
+
+
+def _scan_font_selections(item, font_nr, font_nrs):
+    """Add the fonts an item selects to a set, and get the font selected
+    after it, given the one selected before."""
+    if isinstance(item, box.FontSelection):
+        font_nrs.add(item.font_nr)
+        return item.font_nr
+    elif isinstance(item, box.AbstractBox):
+        for sub_item in item.contents:
+            font_nr = _scan_font_selections(sub_item, font_nr, font_nrs)
+    return font_nr
+
+
+def get_page_fonts(pages):
+    """Get the font selected at the start of each page, and the set of all
+    fonts selected."""
+    font_nrs = set()
+    font_nr = None
+    initial_font_nrs = []
+    for main_v_box in pages:
+        initial_font_nrs.append(font_nr)
+        font_nr = _scan_font_selections(main_v_box, font_nr, font_nrs)
+    return initial_font_nrs, font_nrs
+
+
+def encode_page(main_v_box, font_nr, char_widths):
+    """Encode a page on its own, starting with a given font selected, for
+    adding to a document with `DVIDocument.add_encoded_page`."""
+    writer = PageWriter(char_widths=char_widths)
+    write_display_list_to_doc(writer, flatten_page(main_v_box, font_nr))
+    return writer.end_page()
+
+
+def _write_pages_in_parallel(doc, pages, nr_workers, use_threads):
+    # A page only depends on earlier pages through the font selected at its
+    # start, which is quick to find. Font definitions and page pointers are
+    # dealt with as the encoded pages are added to the document, in order.
+    initial_font_nrs, font_nrs = get_page_fonts(pages)
+    char_widths = {font_nr: get_char_widths(doc.font_registry, font_nr)
+                   for font_nr in font_nrs}
+    encode = functools.partial(encode_page, char_widths=char_widths)
+    if use_threads:
+        executor = ThreadPoolExecutor(max_workers=nr_workers)
+        chunk_size = 1
+    else:
+        executor = ProcessPoolExecutor(max_workers=nr_workers)
+        # Send pages in batches, to spread the cost of talking to the
+        # worker processes.
+        chunk_size = max(1, len(pages) // (4 * nr_workers))
+    with executor:
+        for page in executor.map(encode, pages, initial_font_nrs,
+                                 chunksize=chunk_size):
+            doc.add_encoded_page(page)
+
+
+class DVIPageSink:
+    """Writes pages to a DVI file as they are shipped out, so that they need
+    not be kept until the end of the job. Give it to a `GlobalState` as its
+    page sink.
+
+    The document is begun when the first page is shipped out, using the
+    value of \\mag at that time, as TeX does, and finished when the sink is
+    closed. With more than one worker, pages are encoded in parallel, by
+    worker processes, or threads if `use_threads` is true; a few pages are
+    kept waiting for workers at a time, and each is added to the document in
+    order, as soon as it and the pages before it are done.
+    """
+
+    def __init__(self, out_stream, font_registry=None, nr_workers=1,
+                 use_threads=False):
+        self.out_stream = out_stream
+        self.font_registry = font_registry
+        self.nr_workers = nr_workers
+        self.use_threads = use_threads
+        self.doc = None
+        # The font selected at the end of the last page shipped out.
+        self.font_nr = None
+
+        self._executor = None
+        self._pending = deque()
+        self._char_widths = {}
+
+    @property
+    def nr_pages(self):
+        return 0 if self.doc is None else self.doc.nr_begin_page_pointers
+
+    def _begin_document(self, state):
+        # Fonts are defined using the metrics already loaded while
+        # typesetting.
+        if self.font_registry is None:
+            self.font_registry = state.global_font_state
+        magnification = state.parameters.get(Parameters.mag)
+        self.doc = DVIDocument(magnification, font_registry=self.font_registry,
+                               stream=self.out_stream)
+        if self.nr_workers > 1:
+            if self.use_threads:
+                self._executor = ThreadPoolExecutor(max_workers=self.nr_workers)
+            else:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.nr_workers)
+
+    def ship_out(self, state, page):
+        if self.doc is None:
+            self._begin_document(state)
+        if self._executor is None:
+            self.doc.begin_new_page()
+            display_list = flatten_page(page, self.font_nr)
+            write_display_list_to_doc(self.doc, display_list)
+            self.font_nr = display_list.end_font_nr
+        else:
+            self._submit_page(page)
+
+    def _load_char_widths(self, font_nrs):
+        for font_nr in font_nrs - self._char_widths.keys():
+            self._char_widths[font_nr] = get_char_widths(self.font_registry,
+                                                         font_nr)
+
+    def _submit_page(self, page):
+        # A page only depends on earlier pages through the font selected at
+        # its start, which is quick to find.
+        font_nrs = set()
+        initial_font_nr = self.font_nr
+        self.font_nr = _scan_font_selections(page, initial_font_nr, font_nrs)
+        self._load_char_widths(font_nrs)
+        # Send only the widths the page needs, so that they can be sent
+        # while more fonts are added here.
+        char_widths = {font_nr: self._char_widths[font_nr]
+                       for font_nr in font_nrs | {initial_font_nr}
+                       if font_nr is not None}
+        self._pending.append(self._executor.submit(
+            encode_page, page, initial_font_nr, char_widths))
+        # Add pages that are done, and wait for the oldest page if too many
+        # are waiting, to bound the pages held in memory.
+        max_nr_pending = 2 * self.nr_workers
+        while self._pending and (len(self._pending) > max_nr_pending
+                                 or self._pending[0].done()):
+            self.doc.add_encoded_page(self._pending.popleft().result())
+
+    def skip_page(self, state, page):
+        """Pass over a page without writing it, noting the font selected at
+        its end, which later pages depend on. Fonts defined on the page are
+        defined when a written page first selects them."""
+        if self.doc is None:
+            self._begin_document(state)
+        font_nrs = set()
+        self.font_nr = _scan_font_selections(page, self.font_nr, font_nrs)
+        # Pages encoded by workers need the widths of the font they start
+        # with.
+        if self._executor is not None:
+            self._load_char_widths(font_nrs)
+
+    def close(self, state):
+        if self.doc is None:
+            self._begin_document(state)
+        if self._executor is not None:
+            while self._pending:
+                self.doc.add_encoded_page(self._pending.popleft().result())
+            self._executor.shutdown()
+        self.doc.write()
+
+
+class PageRangeSink:
+    """Passes on only the pages in a range, numbered from one in the order
+    they are shipped out, to another page sink, which must be able to skip
+    pages, as `DVIPageSink` can. Pages before the range are still made, as
+    they affect the state in which later pages are made, but are not
+    written. Once the last page in the range is shipped out, the job is
+    ended."""
+
+    def __init__(self, sink, first_page, last_page):
+        if not 1 <= first_page <= last_page:
+            raise ValueError(f'Invalid page range: {first_page} to '
+                             f'{last_page}')
+        self.sink = sink
+        self.first_page = first_page
+        self.last_page = last_page
+        self.nr_pages_shipped = 0
+
+    def ship_out(self, state, page):
+        self.nr_pages_shipped += 1
+        if self.nr_pages_shipped < self.first_page:
+            self.sink.skip_page(state, page)
+        else:
+            self.sink.ship_out(state, page)
+        if self.nr_pages_shipped >= self.last_page:
+            raise TidyEnd
+
+    def close(self, state):
+        self.sink.close(state)
+
+
+def convert_to_pdf(dvi_path):
+    subprocess.run(['dvipdf', dvi_path], check=True)
+
+
+def write_to_dvi_file(state, out_stream, write_pdf=False, font_registry=None,
+                      nr_workers=1, use_threads=False):
+    """Write the completed pages to a DVI file. With more than one worker,
+    pages are encoded in parallel, by worker processes, or threads if
+    `use_threads` is true."""
+    # Fonts are defined using the metrics already loaded while typesetting.
+    if font_registry is None:
+        font_registry = state.global_font_state
     magnification = state.parameters.get(Parameters.mag)
-    doc = DVIDocument(magnification)
-    for main_v_box in state.completed_pages:
-        doc.begin_new_page()
-        for item in main_v_box.contents:
-            write_box_to_doc(doc, item, horizontal=False)
+    # Each page is written out as soon as it is done.
+    doc = DVIDocument(magnification, font_registry=font_registry,
+                      stream=out_stream)
+    if nr_workers > 1:
+        _write_pages_in_parallel(doc, state.completed_pages, nr_workers,
+                                 use_threads)
+    else:
+        font_nr = None
+        for main_v_box in state.completed_pages:
+            doc.begin_new_page()
+            display_list = get_display_list(main_v_box, font_nr)
+            write_display_list_to_doc(doc, display_list)
+            font_nr = display_list.end_font_nr
 
-    doc.write(out_stream)
+    doc.write()
     if write_pdf:
         if not isinstance(out_stream, str):
             raise ValueError('Cannot convert non-file-name to PDF')
-        subprocess.run(['dvipdf', out_stream], check=True)
+        convert_to_pdf(out_stream)
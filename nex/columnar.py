@@ -0,0 +1,227 @@
+"""
+A columnar view of horizontal lists.
+
+Line-breaking asks the same questions of a horizontal list over and over:
+what is the natural width of the material between two break-points, how much
+can it stretch and shrink, and is a given item a legal break-point. Asking
+these of a list of Python objects means walking the objects each time. Here
+the relevant metrics of each item are stored once, in parallel NumPy arrays,
+so that sums over any run of items reduce to differences of prefix sums.
+"""
+from enum import IntEnum
+
+import numpy as np
+
+from . import box
+from .utils import InfiniteDimension, LogicError
+
+# Finite, fil, fill and filll.
+nr_glue_orders = 4
+
+
+class ItemKind(IntEnum):
+    character = 1
+    box = 2
+    rule = 3
+    glue = 4
+    kern = 5
+    penalty = 6
+    math_on = 7
+    math_off = 8
+    discretionary = 9
+    other = 10
+
+
+def get_item_kind(item):
+    if isinstance(item, box.Character):
+        return ItemKind.character
+    elif isinstance(item, box.AbstractBox):
+        return ItemKind.box
+    elif isinstance(item, box.Rule):
+        return ItemKind.rule
+    elif isinstance(item, box.Glue):
+        return ItemKind.glue
+    elif isinstance(item, box.Kern):
+        return ItemKind.kern
+    elif isinstance(item, box.Penalty):
+        return ItemKind.penalty
+    elif isinstance(item, box.MathOn):
+        return ItemKind.math_on
+    elif isinstance(item, box.MathOff):
+        return ItemKind.math_off
+    elif isinstance(item, box.DiscretionaryBreak):
+        return ItemKind.discretionary
+    else:
+        return ItemKind.other
+
+
+def _set_flex(flex_row, d):
+    if d is None:
+        return
+    elif isinstance(d, InfiniteDimension):
+        flex_row[d.nr_fils] = d.factor
+    else:
+        flex_row[0] = d
+
+
+def _prefix_sum(a):
+    """Cumulative sum with a leading zero row, so that the sum over items
+    [i, j) is `s[j] - s[i]`."""
+    s = np.zeros((a.shape[0] + 1,) + a.shape[1:], dtype=a.dtype)
+    np.cumsum(a, axis=0, out=s[1:])
+    return s
+
+
+class ColumnarHList:
+    """A horizontal list stored as parallel arrays, one entry per item.
+
+    The original items are kept alongside the arrays, so converting to and
+    from the object representation is lossless.
+    """
+
+    def __init__(self, items):
+        self.items = list(items)
+        n = len(self.items)
+        self.kinds = np.empty(n, dtype=np.int8)
+        self.discardable = np.empty(n, dtype=bool)
+        self.widths = np.zeros(n, dtype=np.int64)
+        self.min_widths = np.zeros(n, dtype=np.int64)
+        self.heights = np.zeros(n, dtype=np.int64)
+        self.depths = np.zeros(n, dtype=np.int64)
+        # Stretch and shrink of un-set glue, with one column per order of
+        # infinity.
+        self.stretch = np.zeros((n, nr_glue_orders), dtype=np.float64)
+        self.shrink = np.zeros((n, nr_glue_orders), dtype=np.float64)
+        self.penalties = np.zeros(n, dtype=np.int64)
+        # Width added to a line when breaking at the item.
+        self.break_widths = np.zeros(n, dtype=np.int64)
+
+        for i, item in enumerate(self.items):
+            kind = get_item_kind(item)
+            self.kinds[i] = kind
+            self.discardable[i] = item.discardable
+            if kind == ItemKind.glue:
+                self.widths[i] = item.natural_length
+                self.min_widths[i] = item.min_length
+                _set_flex(self.stretch[i], item.stretch)
+                _set_flex(self.shrink[i], item.shrink)
+            elif kind == ItemKind.kern:
+                self.widths[i] = self.min_widths[i] = item.length
+            else:
+                self.widths[i] = self.min_widths[i] = item.width
+                self.heights[i] = item.height
+                self.depths[i] = item.depth
+                if kind == ItemKind.penalty:
+                    self.penalties[i] = item.size
+                elif kind == ItemKind.discretionary:
+                    self.penalties[i] = item.penalty
+                    self.break_widths[i] = item.pre_break_width
+        self._prefix_sums = None
+
+    @classmethod
+    def from_items(cls, items):
+        return cls(items)
+
+    def to_items(self):
+        return list(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return f'ColumnarHList({box.contsrep(self.items)})'
+
+    @property
+    def prefix_sums(self):
+        """Prefix sums of natural width, minimum width, stretch and shrink."""
+        if self._prefix_sums is None:
+            self._prefix_sums = (_prefix_sum(self.widths),
+                                 _prefix_sum(self.min_widths),
+                                 _prefix_sum(self.stretch),
+                                 _prefix_sum(self.shrink))
+        return self._prefix_sums
+
+    def break_point_mask(self):
+        """Vectorized equivalent of calling `box.is_break_point` on each
+        item."""
+        n = len(self)
+        is_glue = self.kinds == ItemKind.glue
+        next_is_glue = np.zeros(n, dtype=bool)
+        next_is_glue[:-1] = is_glue[1:]
+        prev_not_discardable = np.zeros(n, dtype=bool)
+        prev_not_discardable[1:] = ~self.discardable[:-1]
+        return ((is_glue & prev_not_discardable)
+                | ((self.kinds == ItemKind.kern) & next_is_glue)
+                | ((self.kinds == ItemKind.math_off) & next_is_glue)
+                | (self.kinds == ItemKind.penalty)
+                | (self.kinds == ItemKind.discretionary))
+
+    def segment_badness(self, start, stops, desired_length,
+                        extra_widths=0):
+        """Badness of boxing each run of items [start, stop) to the desired
+        length, following the same rules as `box.AbstractBox.badness`.
+
+        Extra widths of fixed material at the end of each run may be given.
+        """
+        widths, min_widths, stretch, shrink = self.prefix_sums
+        stops = np.asarray(stops)
+        excess = (widths[stops] - widths[start] + extra_widths
+                  - desired_length)
+        over_full = ((min_widths[stops] - min_widths[start] + extra_widths)
+                     > desired_length)
+        badness = np.zeros(len(stops), dtype=np.float64)
+
+        should_stretch = excess < 0
+        should_shrink = excess > 0
+        for mask, flex, sign in ((should_stretch, stretch, -1),
+                                 (should_shrink, shrink, 1)):
+            if not mask.any():
+                continue
+            flex = flex[stops[mask]] - flex[start]
+            positive = flex > 0
+            nr_positive = positive.sum(axis=1)
+            # As in `box.glue_set_ratio`, the relevant flex is the highest
+            # order that is positive, and the glue order is the number of
+            # positive orders, minus one.
+            highest = (nr_glue_orders - 1
+                       - np.argmax(positive[:, ::-1], axis=1))
+            relevant = flex[np.arange(len(flex)), highest]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio = sign * excess[mask] / relevant
+            if sign > 0:
+                ratio = np.minimum(ratio, 1.0)
+            b = np.minimum(np.round(100 * np.power(ratio, 3)), 10000)
+            b[nr_positive > 1] = 0
+            b[nr_positive == 0] = 10000
+            badness[mask] = b
+        badness[over_full] = np.inf
+        return badness
+
+    def set_glue_lengths(self, desired_length):
+        """Lengths of each item if the list were boxed to the desired length,
+        following the same rules as `box.AbstractBox.glue_length`."""
+        widths, _, stretch, shrink = self.prefix_sums
+        line_state, glue_ratio, glue_set_order = box.glue_set_ratio(
+            int(widths[-1]), desired_length,
+            tuple(stretch[-1].tolist()), tuple(shrink[-1].tolist()))
+        if glue_ratio in (box.GlueRatio.no_shrinkability,
+                          box.GlueRatio.no_stretchability):
+            glue_ratio = 0.0
+
+        if line_state == box.LineState.naturally_good:
+            lengths = self.widths.copy()
+        elif line_state == box.LineState.should_stretch:
+            flex = self.stretch
+        elif line_state == box.LineState.should_shrink:
+            flex = self.shrink
+            glue_ratio = -glue_ratio
+        else:
+            raise LogicError(f'Unknown line state: {line_state}')
+        if line_state != box.LineState.naturally_good:
+            # Glue only changes if its flex is of the glue set order. Other
+            # items have no flex, so they are left alone.
+            order = np.argmax(flex != 0, axis=1)
+            factor = flex[np.arange(len(self)), order]
+            diff = np.where(order == glue_set_order, glue_ratio * factor, 0)
+            lengths = np.rint(self.widths + diff).astype(np.int64)
+        return lengths
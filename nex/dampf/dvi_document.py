@@ -1,137 +1,401 @@
+import io
+from collections import namedtuple
+
 from ..pydvi.Font.TfmParser import TfmParser
 from ..pydvi.TeXUnit import pt2sp
 
-from .dvi_spec import (get_set_char_instruction,
-                       get_set_rule_instruction,
-                       get_put_char_instruction,
-                       get_put_rule_instruction,
+from .dvi_spec import (get_define_font_nr_instruction,
+                       get_preamble_instruction,
+                       get_postamble_instruction,
+                       get_post_postamble_instruction,
+                       )
+from .dvi_spec import EncodedInteger, EncodedString, OpCode
+from .dvi_encoder import BytesEncoder, InstructionEncoder
+
+numerator = int(254e5)
+denominator = int(7227 * 2 ** 16)
+dvi_format = 2
+nr_char_codes = 256
+
+
+class MovementRegisters:
+    """The registers DVI has for movements along one axis: w and x for
+    horizontal movements, and y and z for vertical ones.
+
+    Moving by the amount in a register takes one byte, and setting a register
+    while moving costs no more than a plain movement. So every movement goes
+    through a register: a new amount is put in the least recently used one.
+    """
+
+    def __init__(self, *names):
+        # Names of the registers, which are also the names of the encoder
+        # methods to move by them.
+        self.names = names
+        self.reset()
+
+    def reset(self):
+        # DVI sets all registers to zero at the start of each page.
+        self.values = [0] * len(self.names)
+        # Indices of the registers, least recently used first.
+        self.usage = list(range(len(self.names)))
+
+    def get_state(self):
+        return list(self.values), list(self.usage)
+
+    def set_state(self, state):
+        self.values, self.usage = state
+
+    def choose(self, amount):
+        """Choose a register to move by an amount. Return its name, and
+        whether it must be set to the amount first."""
+        try:
+            i = self.values.index(amount)
+        except ValueError:
+            i = self.usage[0]
+            self.values[i] = amount
+            is_new = True
+        else:
+            is_new = False
+        self.usage.remove(i)
+        self.usage.append(i)
+        return self.names[i], is_new
+
+
+# The result of writing a page on its own: its instructions encoded as
+# bytes, from just after its begin_page instruction to its end_page
+# instruction, the numbers of the fonts it selects, and how deep its stack
+# gets.
+EncodedPage = namedtuple('EncodedPage', ('data', 'font_nrs',
+                                         'max_stack_depth'))
+
+
+class PageWriter:
+    """Writes the instructions within DVI pages.
+
+    The instructions are chosen to keep the output small, as TeX does:
+    consecutive movements are merged into one, and only made when something
+    is put at the new position; movements use the w, x, y and z registers;
+    characters are set, implying their advance, where possible; and fonts are
+    only selected when a character needs them.
+
+    A page writer on its own encodes pages independently of any document, so
+    that they can be encoded in parallel and put together with
+    `DVIDocument.add_encoded_page`. Fonts are not defined within such pages,
+    but when they are added to a document.
+    """
+
+    def __init__(self, encoder=None, char_widths=None):
+        self.encoder = BytesEncoder() if encoder is None else encoder
+        # Widths of the characters of each font, by font number; see
+        # `get_char_widths`.
+        self.char_widths = {} if char_widths is None else char_widths
+        self.stack_depth = 0
+        self.max_stack_depth = self.stack_depth
+        # The font requested, and the font the DVI reader has selected.
+        self.current_font_nr = None
+        self.selected_font_nr = None
+        # Fonts selected on the current page, in order of first selection.
+        self.page_font_nrs = []
+
+        # Movements not yet made.
+        self.pending_right = 0
+        self.pending_down = 0
+        self.h_registers = MovementRegisters('w', 'x')
+        self.v_registers = MovementRegisters('y', 'z')
+        # Register states saved by each push, to restore on pop.
+        self.register_stack = []
+
+    def _reset_page(self):
+        # A DVI reader starts each page at the origin, with no font selected.
+        self._drop_movements()
+        self.h_registers.reset()
+        self.v_registers.reset()
+        self.register_stack = []
+        self.selected_font_nr = None
+        self.page_font_nrs = []
+
+    def end_page(self):
+        """End the current page, and get it encoded."""
+        # Movements at the end of the page have no effect.
+        self._drop_movements()
+        self.encoder.end_page()
+        page = EncodedPage(data=self.encoder.take(),
+                           font_nrs=self.page_font_nrs,
+                           max_stack_depth=self.max_stack_depth)
+        self._reset_page()
+        return page
+
+    def define_font(self, font_nr, font_name, font_path,
+                    scale_factor_ratio=1.0):
+        # Fonts are defined when pages are added to a document.
+        pass
+
+    def select_font(self, font_nr):
+        # The font is selected when a character is next put.
+        self.current_font_nr = font_nr
+
+    def _select_current_font(self):
+        if self.selected_font_nr != self.current_font_nr:
+            self.encoder.select_font(self.current_font_nr)
+            self.selected_font_nr = self.current_font_nr
+            if self.current_font_nr not in self.page_font_nrs:
+                self.page_font_nrs.append(self.current_font_nr)
+
+    def push(self):
+        self._move()
+        # House-keeping to track maximum stack depth for postamble.
+        self.stack_depth += 1
+        self.max_stack_depth = max(self.stack_depth, self.max_stack_depth)
+        self.encoder.push()
+        self.register_stack.append((self.h_registers.get_state(),
+                                    self.v_registers.get_state()))
+
+    def pop(self):
+        # Popping restores the position, so movements since the last
+        # instruction can be forgotten.
+        self._drop_movements()
+        self.stack_depth -= 1
+        self.encoder.pop()
+        h_state, v_state = self.register_stack.pop()
+        self.h_registers.set_state(h_state)
+        self.v_registers.set_state(v_state)
 
-                       get_no_op_instruction,
+    def down(self, a):
+        self.pending_down += a
 
-                       get_begin_page_instruction,
-                       get_end_page_instruction,
+    def right(self, a):
+        self.pending_right += a
 
-                       get_push_instruction,
-                       get_pop_instruction,
+    def _move(self):
+        """Make any pending movements."""
+        for amount, registers in ((self.pending_right, self.h_registers),
+                                  (self.pending_down, self.v_registers)):
+            if amount:
+                name, is_new = registers.choose(amount)
+                getattr(self.encoder, name)(amount if is_new else None)
+        self._drop_movements()
 
-                       get_right_instruction,
-                       get_right_w_instruction,
-                       get_set_w_then_right_w_instruction,
-                       get_right_x_instruction,
-                       get_set_x_then_right_x_instruction,
+    def _drop_movements(self):
+        self.pending_right = 0
+        self.pending_down = 0
 
-                       get_down_instruction,
-                       get_down_y_instruction,
-                       get_set_y_then_down_y_instruction,
-                       get_down_z_instruction,
-                       get_set_z_then_down_z_instruction,
+    def set_char(self, char):
+        self._move()
+        self._select_current_font()
+        self.encoder.set_char(char)
 
-                       get_define_font_nr_instruction,
-                       get_select_font_nr_instruction,
+    def put_char(self, char):
+        self._move()
+        self._select_current_font()
+        self.encoder.put_char(char)
+
+    def _get_char_widths(self, font_nr):
+        return self.char_widths.get(font_nr)
+
+    def _char_width(self, char):
+        if self.current_font_nr is None:
+            return None
+        widths = self._get_char_widths(self.current_font_nr)
+        if widths is None or not 0 <= char < len(widths):
+            return None
+        return widths[char]
+
+    def typeset_char(self, char, width):
+        """Put a character and move right by its width. If the width is the
+        one the DVI reader will get from the font, setting the character does
+        both in one."""
+        if self._char_width(char) == width:
+            self.set_char(char)
+        else:
+            self.put_char(char)
+            self.right(width)
+
+    def place_char(self, char):
+        """Put a character, and return how far right that moves: if its
+        width is known, it is set, implying its advance."""
+        width = self._char_width(char)
+        if width is None:
+            self.put_char(char)
+            return 0
+        self.set_char(char)
+        return width
 
-                       get_do_special_instruction,
+    def put_rule(self, height, width):
+        self._move()
+        self.encoder.put_rule(height, width)
 
-                       get_preamble_instruction,
-                       get_postamble_instruction,
-                       get_post_postamble_instruction,
-                       )
-from .dvi_spec import EncodedOperation, EncodedInteger, EncodedString, OpCode
+    def set_rule(self, height, width):
+        self._move()
+        self.encoder.set_rule(height, width)
+
+
+def get_char_widths(font_registry, font_nr):
+    """Get the width of each character of a font, indexed by character code,
+    with None for characters the font lacks."""
+    font = font_registry.get_font(font_nr)
+    return [font.width(code) if font.has_char(code) else None
+            for code in range(nr_char_codes)]
 
-numerator = int(254e5)
-denominator = int(7227 * 2 ** 16)
-dvi_format = 2
 
+class DVIDocument(PageWriter):
+    """A DVI document, written to a stream as it is made.
 
-class DVIDocument:
+    Instructions are gathered for the current page, and encoded and written
+    out when the page ends. The byte offset of the output is tracked as it is
+    written, so the pointers that DVI needs to the start of each page, and to
+    the postamble, are recorded directly.
 
-    def __init__(self, magnification):
+    Pages may be written in turn, starting each with `begin_new_page`, or
+    encoded by separate page writers and added with `add_encoded_page`.
+
+    Instructions are encoded straight to bytes. To keep them as objects for
+    inspection, as `pretty_print` does, pass `keep_instructions=True`.
+    """
+
+    def __init__(self, magnification, font_registry=None, stream=None,
+                 keep_instructions=False):
+        # Holds instructions not yet written out.
+        if keep_instructions:
+            encoder = InstructionEncoder()
+        else:
+            encoder = BytesEncoder()
+        super().__init__(encoder)
         self.magnification = magnification
+        # Something to get font metrics from by font number, so fonts need
+        # not be parsed again. If not given, fonts are read from their paths.
+        self.font_registry = font_registry
+
+        # Allow passing a filename. If no stream is given, the document is
+        # kept in memory until it is written.
+        self._owns_stream = isinstance(stream, str)
+        if self._owns_stream:
+            stream = open(stream, 'wb')
+        self.stream = stream
+        self._buffer = io.BytesIO() if stream is None else None
+        # Number of bytes written out so far.
+        self.nr_bytes_written = 0
+        # Byte offsets of each page's begin_page instruction.
+        self.begin_page_pointers = []
+        self.postamble_pointer = None
+        self._in_page = False
 
         self.preamble = get_preamble_instruction(dvi_format=dvi_format,
                                                  numerator=numerator,
                                                  denominator=denominator,
                                                  magnification=self.magnification,
                                                  comment='')
-        self.mundane_instructions = []
+        self.encoder.instruction(self.preamble)
         self.defined_fonts_info = {}
-        self.stack_depth = 0
-        self.max_stack_depth = self.stack_depth
-        self.current_font_nr = None
 
     @property
     def instructions(self):
-        return [self.preamble] + self.mundane_instructions
-
-    @property
-    def flat_instruction_parts(self):
-        return [p for inst in self.instructions for p in inst.op_and_args]
-
-    def op_code_pointers(self, op_code):
-        byte_pointer = 0
-        op_code_pointers = []
-        for part in self.flat_instruction_parts:
-            byte_pointer += part.nr_bytes()
-            if (isinstance(part, EncodedOperation)
-                    and part.op_code == op_code):
-                op_code_pointers.append(byte_pointer - 1)
-        return op_code_pointers
-
-    @property
-    def _begin_page_pointers(self):
-        return self.op_code_pointers(OpCode.begin_page)
+        """The instructions not yet written out."""
+        if not isinstance(self.encoder, InstructionEncoder):
+            raise AttributeError('Instructions are only kept by documents '
+                                 'made with keep_instructions=True')
+        return self.encoder.instructions
 
     @property
     def last_begin_page_pointer(self):
-        pointers = self._begin_page_pointers
+        pointers = self.begin_page_pointers
         return pointers[-1] if pointers else -1
 
     @property
     def nr_begin_page_pointers(self):
-        return len(self._begin_page_pointers)
+        return len(self.begin_page_pointers)
+
+    def _flush(self):
+        """Encode and write out the instructions not yet written."""
+        data = self.encoder.take()
+        stream = self.stream if self._buffer is None else self._buffer
+        stream.write(data)
+        self.nr_bytes_written += len(data)
+
+    def _begin_page(self):
+        # Write out anything before the page, such as the preamble, so that
+        # the page begins at the current offset.
+        self._flush()
+        counts = list(range(10))
+        self.encoder.begin_page(counts, self.last_begin_page_pointer)
+        self.begin_page_pointers.append(self.nr_bytes_written)
+        self._reset_page()
 
     def begin_new_page(self):
         # If we have any previous pages, need to end the last one.
-        if self._begin_page_pointers:
+        if self._in_page:
             self._end_page()
-        bop_args = list(range(10)) + [self.last_begin_page_pointer]
-        bop = get_begin_page_instruction(*bop_args)
-        self.mundane_instructions.append(bop)
-        if self.current_font_nr is not None:
-            self.select_font(self.current_font_nr)
+        self._begin_page()
+        self._in_page = True
 
     def _end_page(self):
-        eop = get_end_page_instruction()
-        self.mundane_instructions.append(eop)
+        # Movements at the end of the page have no effect.
+        self._drop_movements()
+        self.encoder.end_page()
+        self._flush()
+        self._in_page = False
+
+    def add_encoded_page(self, page):
+        """Add a page encoded by a separate page writer. It is written out
+        straight away."""
+        if self._in_page:
+            self._end_page()
+        # The page's fonts must be defined before it selects them.
+        for font_nr in page.font_nrs:
+            font = self.font_registry.get_font(font_nr)
+            self.define_font(font_nr, font.font_name, font.file_name)
+        self._begin_page()
+        self.encoder.data += page.data
+        self._flush()
+        self.max_stack_depth = max(self.max_stack_depth, page.max_stack_depth)
+
+    def _select_current_font(self):
+        # A font whose definition was never written, because it was made
+        # before the document, as by a format file, or on a page that was
+        # skipped, is defined when it is first selected.
+        font_nr = self.current_font_nr
+        if (font_nr != self.selected_font_nr
+                and font_nr not in self.defined_fonts_info
+                and self.font_registry is not None):
+            font = self.font_registry.get_font(font_nr)
+            self.define_font(font_nr, font.font_name, font.file_name)
+        super()._select_current_font()
+
+    def _get_char_widths(self, font_nr):
+        widths = self.char_widths.get(font_nr)
+        if widths is None and self.font_registry is not None:
+            widths = get_char_widths(self.font_registry, font_nr)
+            self.char_widths[font_nr] = widths
+        return widths
 
     def define_font(self, font_nr, font_name, font_path,
                     scale_factor_ratio=1.0):
-        font_info = TfmParser.parse(font_name, font_path)
-        design_size = int(pt2sp(font_info.design_font_size))
-        scale_factor = int(design_size * scale_factor_ratio)
-        font_path = font_info.font_name
+        # A font need only be defined once.
+        if font_nr in self.defined_fonts_info:
+            return
+        if self.font_registry is not None:
+            font = self.font_registry.get_font(font_nr)
+            checksum = font.font_info.checksum
+            design_size = int(pt2sp(font.design_size))
+            # The font's metrics are already scaled to its size.
+            scale_factor = font.at_size
+        else:
+            font_info = TfmParser.parse(font_name, font_path)
+            checksum = font_info.checksum
+            design_size = int(pt2sp(font_info.design_font_size))
+            scale_factor = int(design_size * scale_factor_ratio)
+            font_name = font_info.font_name
         define_font_nr_instr = get_define_font_nr_instruction(font_nr,
-                                                              font_info.checksum,
+                                                              checksum,
                                                               scale_factor,
                                                               design_size,
-                                                              font_path)
+                                                              font_name)
         self._define_font(define_font_nr_instr)
         self.defined_fonts_info[font_nr] = {
-            'font_info': font_info,
             'define_instruction': define_font_nr_instr
         }
 
     def _define_font(self, define_font_nr_instr):
-        self.mundane_instructions.append(define_font_nr_instr)
-
-    def select_font(self, font_nr):
-        inst = get_select_font_nr_instruction(font_nr)
-        self.mundane_instructions.append(inst)
-        # TODO: Could actually get this from instructions dynamically.
-        self.current_font_nr = font_nr
-
-    @property
-    def current_font_info(self):
-        return self.defined_fonts_info[self.current_font_nr]['font_info']
+        self.encoder.instruction(define_font_nr_instr)
 
     def _end_document(self):
         self._do_postamble()
@@ -139,8 +403,12 @@ class DVIDocument:
         for font_nr, font_details in self.defined_fonts_info.items():
             self._define_font(font_details['define_instruction'])
         self._do_post_postamble()
+        self._flush()
 
     def _do_postamble(self):
+        # Write out everything before the postamble, to know where it begins.
+        self._flush()
+        self.postamble_pointer = self.nr_bytes_written
         # I am told these are often ignored, so leave them un-implemented for
         # now.
         max_page_height_plus_depth = 1
@@ -154,44 +422,16 @@ class DVIDocument:
                                          self.max_stack_depth,
                                          self.nr_begin_page_pointers
                                          )
-        self.mundane_instructions.append(post)
+        self.encoder.instruction(post)
 
     def _do_post_postamble(self):
-        postamble_pointers = self.op_code_pointers(OpCode.postamble)
-        assert len(postamble_pointers) == 1
-        postamble_pointer = postamble_pointers[-1]
-
-        post_post = get_post_postamble_instruction(postamble_pointer,
+        post_post = get_post_postamble_instruction(self.postamble_pointer,
                                                    dvi_format)
-        self.mundane_instructions.append(post_post)
-
-    def push(self):
-        # House-keeping to track maximum stack depth for postamble.
-        self.stack_depth += 1
-        self.max_stack_depth = max(self.stack_depth, self.max_stack_depth)
-        self.mundane_instructions.append(get_push_instruction())
-
-    def pop(self):
-        self.stack_depth -= 1
-        self.mundane_instructions.append(get_pop_instruction())
-
-    def down(self, a):
-        self.mundane_instructions.append(get_down_instruction(a))
-
-    def right(self, a):
-        self.mundane_instructions.append(get_right_instruction(a))
-
-    def _encode(self):
-        return b''.join(inst.encode() for inst in self.instructions)
-
-    def set_char(self, char):
-        self.mundane_instructions.append(get_set_char_instruction(char))
-
-    def put_char(self, char):
-        self.mundane_instructions.append(get_put_char_instruction(char))
+        self.encoder.instruction(post_post)
 
     def pretty_print(self):
-        """Print document instructions in a human-readable manner."""
+        """Print the instructions not yet written out in a human-readable
+        manner."""
 
         def bps(bp):
             """Format a byte pointer."""
@@ -202,7 +442,7 @@ class DVIDocument:
             return f'[{nb:3n} bytes]'
 
         # Byte pointer (index of byte number in document).
-        bp = 0
+        bp = self.nr_bytes_written
         # A gap.
         g = '    '
         # Count boring instructions to be skipped
@@ -254,19 +494,21 @@ class DVIDocument:
                 bp += arg.nr_bytes()
             print(')')
 
-    def write(self, stream):
-        self._end_page()
+    def write(self, stream=None):
+        """End the document and write out the rest of it. If the document
+        was kept in memory, it is written to the given stream."""
+        if self._in_page:
+            self._end_page()
         self._end_document()
 
-        # Allow passing a filename.
-        if isinstance(stream, str):
-            stream = open(stream, 'wb')
-        stream.write(self._encode())
-
-    def put_rule(self, height, width):
-        inst = get_put_rule_instruction(height, width)
-        self.mundane_instructions.append(inst)
-
-    def set_rule(self, height, width):
-        inst = get_set_rule_instruction(height, width)
-        self.mundane_instructions.append(inst)
+        if self._buffer is not None and stream is not None:
+            # Allow passing a filename.
+            if isinstance(stream, str):
+                with open(stream, 'wb') as f:
+                    f.write(self._buffer.getvalue())
+            else:
+                stream.write(self._buffer.getvalue())
+        if self._owns_stream:
+            self.stream.close()
+        elif self.stream is not None:
+            self.stream.flush()
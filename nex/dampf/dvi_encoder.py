@@ -0,0 +1,268 @@
+"""
+Encoders that turn DVI instructions into bytes.
+
+`BytesEncoder` writes op-codes and their arguments straight into a growing
+bytearray, with a precompiled struct format for each kind of instruction and
+size of argument. `InstructionEncoder` also builds the `EncodedInstruction`
+objects of `dvi_spec`, which are handy for inspecting output when debugging;
+it produces the same bytes, more slowly.
+
+Rarer instructions, such as font definitions and the preamble, are given to
+either encoder as `EncodedInstruction` objects.
+"""
+import struct
+
+from .dvi_spec import (OpCode,
+                       get_set_char_instruction,
+                       get_put_char_instruction,
+                       get_set_rule_instruction,
+                       get_put_rule_instruction,
+                       get_push_instruction,
+                       get_pop_instruction,
+                       get_right_instruction,
+                       get_right_w_instruction,
+                       get_set_w_then_right_w_instruction,
+                       get_right_x_instruction,
+                       get_set_x_then_right_x_instruction,
+                       get_down_instruction,
+                       get_down_y_instruction,
+                       get_set_y_then_down_y_instruction,
+                       get_down_z_instruction,
+                       get_set_z_then_down_z_instruction,
+                       get_select_font_nr_instruction,
+                       get_begin_page_instruction,
+                       get_end_page_instruction,
+                       )
+
+# An op-code followed by an integer argument of each size. There is no
+# struct format for three-byte integers, so they are packed in four bytes,
+# and the most significant byte dropped.
+_signed_formats = {
+    1: struct.Struct('>Bb'),
+    2: struct.Struct('>Bh'),
+    3: struct.Struct('>Bi'),
+    4: struct.Struct('>Bi'),
+}
+# Four-byte arguments are always signed in DVI.
+_unsigned_formats = {
+    1: struct.Struct('>BB'),
+    2: struct.Struct('>BH'),
+    3: struct.Struct('>Bi'),
+    4: struct.Struct('>Bi'),
+}
+_rule_format = struct.Struct('>Bii')
+_begin_page_format = struct.Struct('>B11i')
+
+# Op-code numbers, looked up once, as getting an enum member's value is
+# slow.
+_begin_page = OpCode.begin_page.value
+_down_1_byte = OpCode.down_1_byte.value
+_down_y = OpCode.down_y.value
+_down_z = OpCode.down_z.value
+_end_page = OpCode.end_page.value
+_pop = OpCode.pop.value
+_push = OpCode.push.value
+_put_1_byte_char = OpCode.put_1_byte_char.value
+_put_rule = OpCode.put_rule.value
+_right_1_byte = OpCode.right_1_byte.value
+_right_w = OpCode.right_w.value
+_right_x = OpCode.right_x.value
+_select_1_byte_font_nr = OpCode.select_1_byte_font_nr.value
+_select_font_nr_0 = OpCode.select_font_nr_0.value
+_set_1_byte_char = OpCode.set_1_byte_char.value
+_set_1_byte_w_then_right_w = OpCode.set_1_byte_w_then_right_w.value
+_set_1_byte_x_then_right_x = OpCode.set_1_byte_x_then_right_x.value
+_set_1_byte_y_then_down_y = OpCode.set_1_byte_y_then_down_y.value
+_set_1_byte_z_then_down_z = OpCode.set_1_byte_z_then_down_z.value
+_set_rule = OpCode.set_rule.value
+
+_nr_small_chars = 128
+_nr_small_font_nrs = 64
+
+
+def _get_nr_bytes(value, signed):
+    """The number of bytes needed for an integer argument; an inlined
+    equivalent of `utils.get_bytes_needed`."""
+    if signed:
+        if -0x80 <= value < 0x80:
+            return 1
+        elif -0x8000 <= value < 0x8000:
+            return 2
+        elif -0x800000 <= value < 0x800000:
+            return 3
+    elif value < 0:
+        raise ValueError(f'Cannot encode negative number {value} as unsigned')
+    elif value < 0x100:
+        return 1
+    elif value < 0x10000:
+        return 2
+    elif value < 0x1000000:
+        return 3
+    return 4
+
+
+class BytesEncoder:
+    """Encodes DVI instructions into a bytearray, as they are given."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def __len__(self):
+        return len(self.data)
+
+    def take(self):
+        """Get the bytes encoded so far, and start afresh."""
+        data, self.data = self.data, bytearray()
+        return data
+
+    def instruction(self, instr):
+        self.data += instr.encode()
+
+    def _integer_instruction(self, first_op_code, value, signed):
+        """Encode one of a family of instructions with an integer argument,
+        whose op-codes go up with the size of the argument."""
+        nr_bytes = _get_nr_bytes(value, signed)
+        formats = _signed_formats if signed else _unsigned_formats
+        packed = formats[nr_bytes].pack(first_op_code + nr_bytes - 1, value)
+        if nr_bytes == 3:
+            packed = packed[:1] + packed[2:]
+        self.data += packed
+
+    def set_char(self, char):
+        if 0 <= char < _nr_small_chars:
+            self.data.append(char)
+        else:
+            self._integer_instruction(_set_1_byte_char, char, signed=False)
+
+    def put_char(self, char):
+        self._integer_instruction(_put_1_byte_char, char, signed=False)
+
+    def set_rule(self, height, width):
+        self.data += _rule_format.pack(_set_rule, height, width)
+
+    def put_rule(self, height, width):
+        self.data += _rule_format.pack(_put_rule, height, width)
+
+    def push(self):
+        self.data.append(_push)
+
+    def pop(self):
+        self.data.append(_pop)
+
+    def right(self, a):
+        self._integer_instruction(_right_1_byte, a, signed=True)
+
+    def down(self, a):
+        self._integer_instruction(_down_1_byte, a, signed=True)
+
+    # Movements by the w, x, y and z registers. If an amount is given, the
+    # register is set to it first.
+
+    def w(self, a=None):
+        if a is None:
+            self.data.append(_right_w)
+        else:
+            self._integer_instruction(_set_1_byte_w_then_right_w, a,
+                                      signed=True)
+
+    def x(self, a=None):
+        if a is None:
+            self.data.append(_right_x)
+        else:
+            self._integer_instruction(_set_1_byte_x_then_right_x, a,
+                                      signed=True)
+
+    def y(self, a=None):
+        if a is None:
+            self.data.append(_down_y)
+        else:
+            self._integer_instruction(_set_1_byte_y_then_down_y, a,
+                                      signed=True)
+
+    def z(self, a=None):
+        if a is None:
+            self.data.append(_down_z)
+        else:
+            self._integer_instruction(_set_1_byte_z_then_down_z, a,
+                                      signed=True)
+
+    def select_font(self, font_nr):
+        if 0 <= font_nr < _nr_small_font_nrs:
+            self.data.append(_select_font_nr_0 + font_nr)
+        else:
+            self._integer_instruction(_select_1_byte_font_nr, font_nr,
+                                      signed=False)
+
+    def begin_page(self, counts, previous_begin_page_pointer):
+        self.data += _begin_page_format.pack(_begin_page, *counts,
+                                             previous_begin_page_pointer)
+
+    def end_page(self):
+        self.data.append(_end_page)
+
+
+class InstructionEncoder(BytesEncoder):
+    """Encodes DVI instructions by way of `EncodedInstruction` objects, and
+    keeps the objects not yet taken."""
+
+    def __init__(self):
+        super().__init__()
+        self.instructions = []
+
+    def take(self):
+        self.instructions = []
+        return super().take()
+
+    def instruction(self, instr):
+        self.instructions.append(instr)
+        super().instruction(instr)
+
+    def set_char(self, char):
+        self.instruction(get_set_char_instruction(char))
+
+    def put_char(self, char):
+        self.instruction(get_put_char_instruction(char))
+
+    def set_rule(self, height, width):
+        self.instruction(get_set_rule_instruction(height, width))
+
+    def put_rule(self, height, width):
+        self.instruction(get_put_rule_instruction(height, width))
+
+    def push(self):
+        self.instruction(get_push_instruction())
+
+    def pop(self):
+        self.instruction(get_pop_instruction())
+
+    def right(self, a):
+        self.instruction(get_right_instruction(a))
+
+    def down(self, a):
+        self.instruction(get_down_instruction(a))
+
+    def w(self, a=None):
+        self.instruction(get_right_w_instruction() if a is None
+                         else get_set_w_then_right_w_instruction(a))
+
+    def x(self, a=None):
+        self.instruction(get_right_x_instruction() if a is None
+                         else get_set_x_then_right_x_instruction(a))
+
+    def y(self, a=None):
+        self.instruction(get_down_y_instruction() if a is None
+                         else get_set_y_then_down_y_instruction(a))
+
+    def z(self, a=None):
+        self.instruction(get_down_z_instruction() if a is None
+                         else get_set_z_then_down_z_instruction(a))
+
+    def select_font(self, font_nr):
+        self.instruction(get_select_font_nr_instruction(font_nr))
+
+    def begin_page(self, counts, previous_begin_page_pointer):
+        self.instruction(get_begin_page_instruction(
+            *counts, previous_begin_page_pointer))
+
+    def end_page(self):
+        self.instruction(get_end_page_instruction())
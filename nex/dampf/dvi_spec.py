@@ -388,7 +388,7 @@ class OpCode(Enum):
 no_arg_char_op_codes = [OpCode[f'set_char_{i}']
                         for i in range(128)]
 no_arg_select_font_nr_op_codes = [OpCode[f'select_font_nr_{i}']
-                                  for i in range(63)]
+                                  for i in range(64)]
 
 
 def get_simple_instruction_func(op_code, *string_getters):
@@ -715,7 +715,7 @@ def _scatter_instruction(signed, get_instruction_funcs):
 
 
 def get_set_char_instruction(char):
-    if char in no_arg_char_op_codes:
+    if 0 <= char < len(no_arg_char_op_codes):
         return get_small_set_char_instruction_func(char)
     else:
         base_get_instruction_func = _get_func_on_bytes(char,
@@ -725,7 +725,7 @@ def get_set_char_instruction(char):
 
 
 def get_select_font_nr_instruction(font_nr):
-    if font_nr in no_arg_select_font_nr_op_codes:
+    if 0 <= font_nr < len(no_arg_select_font_nr_op_codes):
         return get_small_select_font_nr_instruction(font_nr)
     else:
         base_get_instruction_func = _get_func_on_bytes(font_nr,
@@ -0,0 +1,156 @@
+"""
+Display lists: the marks on a page, at absolute positions.
+
+A shipped-out page is a tree of boxes, in which each item's position is
+relative to the items before it and the boxes around it. Output backends want
+to know where each mark goes on the page, so here the tree is walked once,
+and flattened into arrays of the glyphs and rules it contains, with their
+positions measured from the page's origin. Positions follow DVI conventions:
+`h` increases to the right, and `v` increases downwards.
+"""
+import weakref
+
+import numpy as np
+
+from . import box
+from .utils import LogicError
+
+glyph_dtype = np.dtype([
+    ('font_nr', np.int32),
+    ('code', np.int32),
+    ('h', np.int64),
+    ('v', np.int64),
+])
+
+rule_dtype = np.dtype([
+    ('h', np.int64),
+    ('v', np.int64),
+    ('width', np.int64),
+    ('height', np.int64),
+])
+
+
+class DisplayList:
+    """The glyphs and rules on a page, in the order they were placed, and
+    the definitions of the fonts made on the page, as tuples of font number,
+    font name and file name. The font selected at the end of the page is
+    kept too, as the next page starts with it."""
+
+    def __init__(self, glyphs, rules, font_definitions=(), end_font_nr=None):
+        self.glyphs = glyphs
+        self.rules = rules
+        self.font_definitions = list(font_definitions)
+        self.end_font_nr = end_font_nr
+
+    def __repr__(self):
+        return (f'DisplayList({len(self.glyphs)} glyphs, '
+                f'{len(self.rules)} rules)')
+
+    @property
+    def font_nrs(self):
+        """The fonts used on the page, in order of first use."""
+        font_nrs, first_indices = np.unique(self.glyphs['font_nr'],
+                                            return_index=True)
+        return font_nrs[np.argsort(first_indices)].tolist()
+
+    def glyph_runs(self):
+        """Get runs of consecutive glyphs in the same font on the same
+        baseline, as slices into the glyph array."""
+        glyphs = self.glyphs
+        is_run_start = np.ones(len(glyphs), dtype=bool)
+        is_run_start[1:] = ((glyphs['font_nr'][1:] != glyphs['font_nr'][:-1])
+                            | (glyphs['v'][1:] != glyphs['v'][:-1]))
+        starts = np.flatnonzero(is_run_start).tolist()
+        stops = starts[1:] + [len(glyphs)]
+        return [slice(start, stop) for start, stop in zip(starts, stops)]
+
+
+class _Flattener:
+
+    def __init__(self, font_nr):
+        self.font_nr = font_nr
+        self.glyphs = []
+        self.rules = []
+        self.font_definitions = []
+
+    def visit_contents(self, a_box, h, v):
+        """Add the marks of the items in a set box, starting at a position.
+        The box decides the lengths of the glue inside it."""
+        horizontal = isinstance(a_box, box.HBox)
+        for item in a_box.contents:
+            if isinstance(item, box.Glue):
+                advance = a_box.get_length(item)
+                if horizontal:
+                    h += advance
+                else:
+                    v += advance
+            else:
+                h, v = self.visit(item, h, v, horizontal)
+
+    def visit(self, item, h, v, horizontal):
+        """Add an item's marks, and return the position after it."""
+        if isinstance(item, box.AbstractBox):
+            if isinstance(item, box.VBox):
+                self.visit_contents(item, h + item.offset, v)
+            else:
+                self.visit_contents(item, h, v - item.offset)
+            if horizontal:
+                return h + item.width, v
+            else:
+                return h, v + item.height
+        elif isinstance(item, box.Character):
+            if self.font_nr is None:
+                raise LogicError('Found character with no font selected')
+            self.glyphs.append((self.font_nr, item.code, h, v))
+            advance = item.width
+        elif isinstance(item, box.Glue):
+            raise LogicError('Found glue outside a box while flattening page')
+        elif isinstance(item, box.Kern):
+            advance = item.length
+        elif isinstance(item, box.Rule):
+            self.rules.append((h, v, item.width, item.height))
+            advance = item.width if horizontal else item.height
+        elif isinstance(item, box.FontSelection):
+            self.font_nr = item.font_nr
+            advance = 0
+        elif isinstance(item, box.FontDefinition):
+            self.font_definitions.append((item.font_nr, item.font_name,
+                                          item.file_name))
+            advance = 0
+        elif isinstance(item, box.Penalty):
+            advance = 0
+        else:
+            raise NotImplementedError
+        if horizontal:
+            return h + advance, v
+        else:
+            return h, v + advance
+
+
+def flatten_page(main_v_box, font_nr=None):
+    """Make the display list of a page, given the font selected at its
+    start."""
+    flattener = _Flattener(font_nr)
+    flattener.visit_contents(main_v_box, 0, 0)
+    return DisplayList(glyphs=np.array(flattener.glyphs, dtype=glyph_dtype),
+                       rules=np.array(flattener.rules, dtype=rule_dtype),
+                       font_definitions=flattener.font_definitions,
+                       end_font_nr=flattener.font_nr)
+
+
+_display_lists = weakref.WeakKeyDictionary()
+
+
+def get_display_list(main_v_box, font_nr=None):
+    """Get the display list of a shipped-out page, which must not change
+    afterwards, making it on first request."""
+    try:
+        display_list, cached_font_nr = _display_lists[main_v_box]
+    except KeyError:
+        pass
+    else:
+        if cached_font_nr == font_nr:
+            return display_list
+    display_list = flatten_page(main_v_box, font_nr)
+    _display_lists[main_v_box] = display_list, font_nr
+    return display_list
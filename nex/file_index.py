@@ -0,0 +1,141 @@
+"""
+An index of the files in search directories, in the manner of kpathsea's
+ls-R databases.
+
+Looking for a file by testing for it in each search directory in turn costs a
+system call per directory per lookup. Instead, each directory is listed once,
+and lookups check the listings. The listings can be saved to a database file
+and loaded again in later runs; a directory is only listed again if it has
+been modified since the database was written.
+"""
+import logging
+import os
+from os import path as opath
+
+logger = logging.getLogger(__name__)
+
+db_comment = '% ls-R -- nex file index.'
+
+
+def read_db(db_path):
+    """Read a database of directory listings, in ls-R format: each directory
+    path followed by a colon on its own line, then the names of the files in
+    it, one per line, then a blank line."""
+    listings = {}
+    directory = None
+    with open(db_path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line or line.startswith('%'):
+                continue
+            if line.endswith(':'):
+                directory = line[:-1]
+                listings[directory] = set()
+            elif directory is not None:
+                listings[directory].add(line)
+    return listings
+
+
+def write_db(db_path, listings):
+    lines = [db_comment]
+    for directory, names in sorted(listings.items()):
+        lines.append('')
+        lines.append(f'{directory}:')
+        lines.extend(sorted(names))
+    temp_path = f'{db_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(temp_path, db_path)
+
+
+class FileIndex:
+    """Finds files in search directories by looking in listings of those
+    directories, made once each.
+
+    Counts of lookups that were answered by the listings (hits) and that were
+    not (misses) are kept for reporting.
+    """
+
+    def __init__(self, db_path=None):
+        # Names of the files in each directory, keyed by absolute path.
+        self._listings = {}
+        self.db_path = db_path
+        self._db_mtime = None
+        self._db_changed = False
+        self.hits = 0
+        self.misses = 0
+        if db_path is not None and opath.exists(db_path):
+            self._db_mtime = os.stat(db_path).st_mtime
+            self._listings = read_db(db_path)
+            self._checked = set()
+        else:
+            self._checked = None
+
+    def _list_directory(self, directory):
+        try:
+            with os.scandir(directory) as entries:
+                names = {entry.name for entry in entries
+                         if not entry.is_dir()}
+        except OSError:
+            names = set()
+        self._listings[directory] = names
+        self._db_changed = True
+        return names
+
+    def _get_listing(self, directory):
+        try:
+            names = self._listings[directory]
+        except KeyError:
+            return self._list_directory(directory)
+        # A listing loaded from the database is checked against the
+        # directory's modification time, once per run.
+        if self._checked is not None and directory not in self._checked:
+            self._checked.add(directory)
+            try:
+                is_stale = os.stat(directory).st_mtime > self._db_mtime
+            except OSError:
+                is_stale = True
+            if is_stale:
+                return self._list_directory(directory)
+        return names
+
+    def find(self, file_name, search_paths):
+        """Resolve a file name or path to an absolute path, searching a
+        sequence of directories."""
+        # If file_name is already a full path, just use that.
+        if opath.dirname(file_name) != '':
+            return file_name
+        for search_path in search_paths:
+            directory = opath.abspath(search_path)
+            if file_name in self._get_listing(directory):
+                self.hits += 1
+                return opath.join(directory, file_name)
+        # The file may have been made since its directory was listed. If so,
+        # list the directory again.
+        self.misses += 1
+        for search_path in search_paths:
+            directory = opath.abspath(search_path)
+            if opath.exists(opath.join(directory, file_name)):
+                self._list_directory(directory)
+                return opath.join(directory, file_name)
+        raise FileNotFoundError(file_name)
+
+    def save(self):
+        """Write the listings to the database file, if there is one and the
+        listings have changed."""
+        if self.db_path is None or not self._db_changed:
+            return
+        try:
+            write_db(self.db_path, self._listings)
+        except OSError as e:
+            logger.warning(f'Could not write file index {self.db_path}: {e}')
+        else:
+            self._db_changed = False
+
+    @property
+    def stats(self):
+        return {
+            'directories': len(self._listings),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
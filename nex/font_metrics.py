@@ -0,0 +1,399 @@
+"""
+Decoded font metrics, and a persistent cache of them.
+
+Parsing a TFM file means many small reads and a Python object per character
+and per lig/kern step. The metrics a typesetter needs are few and regular, so
+here they are held in flat NumPy arrays, which can be written to a compact
+binary file and read back in one go, or mapped into memory so that processes
+using the same fonts share them. A cache file records the path, size and
+modification time of the TFM file it was made from, and is only used if they
+still agree.
+"""
+import hashlib
+import logging
+import mmap
+import os
+from os import path as opath
+import struct
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+cache_extension = 'nfm'
+cache_magic = b'NXFM'
+cache_version = 2
+
+# Magic, version, source size, source modification time in nanoseconds,
+# checksum, design size, and the number of characters, parameters and lig/kern
+# steps, then the lengths of the source path, font name and coding scheme.
+_header = struct.Struct('<4sHQqIdIIIHHH')
+
+# A lig/kern step for a pair of adjacent characters. For a kern step, 'kern'
+# is the kern in design-size units; for a ligature step, the remaining fields
+# describe the ligature, as in `fonts.LigatureStep`.
+lig_kern_dtype = np.dtype([
+    ('left', '<i4'),
+    ('right', '<i4'),
+    ('is_kern', '?'),
+    ('kern', '<f8'),
+    ('char_code', '<i4'),
+    ('nr_to_pass_over', '<i4'),
+    ('keep_current', '?'),
+    ('keep_next', '?'),
+])
+
+# Names of the font parameters, in order, per character coding scheme. See
+# TeXbook Appendix F.
+text_parameter_names = ('slant', 'spacing', 'space_stretch', 'space_shrink',
+                        'x_height', 'quad', 'extra_space')
+math_symbols_parameter_names = text_parameter_names + (
+    'num1', 'num2', 'num3', 'denom1', 'denom2', 'sup1', 'sup2', 'sup3',
+    'sub1', 'sub2', 'supdrop', 'subdrop', 'delim1', 'delim2', 'axis_height',
+)
+math_extension_parameter_names = text_parameter_names + (
+    'default_rule_thickness', 'big_op_spacing1', 'big_op_spacing2',
+    'big_op_spacing3', 'big_op_spacing4', 'big_op_spacing5',
+)
+
+
+def get_parameter_names(coding_scheme):
+    if coding_scheme == 'TeX math symbols':
+        return math_symbols_parameter_names
+    elif coding_scheme in ('TeX math extension', 'euler substitutions only'):
+        return math_extension_parameter_names
+    else:
+        return text_parameter_names
+
+
+def _read_bcpl(data, offset, max_length):
+    """Read a string stored as a length byte followed by its characters."""
+    length = min(data[offset], max_length - 1)
+    return bytes(data[offset + 1:offset + 1 + length]).decode('ascii',
+                                                             'replace')
+
+
+def _fix_words(words):
+    """Convert big-endian fix words to numbers of design-size units."""
+    return words.astype(np.float64) / 2 ** 20
+
+
+def _decode_lig_kern_programs(lig_kern, kerns, lig_kern_starts):
+    """Decode the lig/kern programs of characters into rows for a
+    `lig_kern_dtype` array. See the description of lig/kern programs in
+    TfmParser."""
+    steps = []
+    for code, start in lig_kern_starts:
+        i = start
+        skip_byte, _, op_byte, remainder = lig_kern[i]
+        # A first step with a large skip byte points to the real start.
+        if skip_byte > 128:
+            i = 256 * op_byte + remainder
+        while True:
+            skip_byte, next_char, op_byte, remainder = lig_kern[i]
+            # Any later such step is an unconditional halt.
+            if skip_byte > 128:
+                break
+            if op_byte >= 128:
+                kern = kerns[256 * (op_byte - 128) + remainder]
+                steps.append((code, next_char, True, kern,
+                              0, 0, False, False))
+            else:
+                steps.append((code, next_char, False, 0.0,
+                              remainder, op_byte >> 2,
+                              bool(op_byte & 0x02), bool(op_byte & 0x01)))
+            if skip_byte == 128:
+                break
+            i += skip_byte + 1
+    return steps
+
+
+def decode_tfm(data, font_name, file_path):
+    """Decode the contents of a TFM file, reading each table in one go."""
+    # The file starts with twelve 16-bit lengths, which give the layout of
+    # the rest of the file, in 32-bit words. See TfmParser._read_lengths.
+    (lf, lh, bc, ec, nw, nh, nd, ni, nl, nk, ne,
+     nr_params) = struct.unpack_from('>12H', data)
+    nc = ec - bc + 1
+    if (len(data) < 4 * lf
+            or lf != 6 + lh + nc + nw + nh + nd + ni + nl + nk + ne
+            + nr_params):
+        raise ValueError(f'Bad TFM file: {file_path}')
+    words = np.frombuffer(data, dtype='>i4', count=lf)
+    word_bytes = np.frombuffer(data, dtype=np.uint8,
+                               count=4 * lf).reshape(lf, 4)
+
+    table_starts = {}
+    position = 6
+    for table, length in (('header', lh), ('char_info', nc), ('width', nw),
+                          ('height', nh), ('depth', nd), ('italic', ni),
+                          ('lig_kern', nl), ('kern', nk), ('exten', ne),
+                          ('param', nr_params)):
+        table_starts[table] = (position, position + length)
+        position += length
+
+    def table_words(table):
+        return words[slice(*table_starts[table])]
+
+    # The header holds the checksum and the design size, then, if there is
+    # room, the character coding scheme.
+    header_start = 4 * table_starts['header'][0]
+    checksum, = struct.unpack_from('>I', data, header_start)
+    design_size = float(_fix_words(table_words('header')[1:2])[0])
+    if lh >= 12:
+        coding_scheme = _read_bcpl(data, header_start + 8, 40)
+    else:
+        coding_scheme = ''
+
+    char_info = word_bytes[slice(*table_starts['char_info'])]
+    width_index = char_info[:, 0]
+    height_index = char_info[:, 1] >> 4
+    depth_index = char_info[:, 1] & 0xF
+    italic_index = char_info[:, 2] >> 2
+    tag = char_info[:, 2] & 0x3
+    remainder = char_info[:, 3]
+    # A character exists if it has a non-zero width index.
+    exists = width_index != 0
+    codes = (bc + np.flatnonzero(exists)).astype(np.int32)
+
+    def char_metric(table, index):
+        return _fix_words(table_words(table))[index[exists]]
+
+    lig_tag = 1
+    has_program = exists & (tag == lig_tag)
+    lig_kern_starts = zip((bc + np.flatnonzero(has_program)).tolist(),
+                          remainder[has_program].tolist())
+    lig_kerns = _decode_lig_kern_programs(
+        word_bytes[slice(*table_starts['lig_kern'])].tolist(),
+        _fix_words(table_words('kern')).tolist(),
+        lig_kern_starts)
+
+    return FontMetrics(font_name=font_name,
+                       file_path=file_path,
+                       checksum=checksum,
+                       design_size=design_size,
+                       coding_scheme=coding_scheme,
+                       codes=codes,
+                       widths=char_metric('width', width_index),
+                       heights=char_metric('height', height_index),
+                       depths=char_metric('depth', depth_index),
+                       italics=char_metric('italic', italic_index),
+                       parameters=_fix_words(table_words('param')),
+                       lig_kerns=np.array(lig_kerns, dtype=lig_kern_dtype))
+
+
+def _padding(n):
+    """Number of bytes to add to a length of n bytes to keep arrays that
+    follow it aligned."""
+    return -n % 8
+
+
+class FontMetrics:
+    """The metrics of a font, in design-size units.
+
+    Character metrics are stored in arrays with one entry per character code,
+    in the order of `codes`.
+    """
+
+    def __init__(self, font_name, file_path, checksum, design_size,
+                 coding_scheme, codes, widths, heights, depths, italics,
+                 parameters, lig_kerns):
+        self.font_name = font_name
+        self.file_path = file_path
+        self.checksum = checksum
+        # In points.
+        self.design_size = design_size
+        self.coding_scheme = coding_scheme
+        self.codes = codes
+        self.widths = widths
+        self.heights = heights
+        self.depths = depths
+        self.italics = italics
+        self.parameters = parameters
+        self.lig_kerns = lig_kerns
+        self.index = {code: i for i, code in enumerate(codes.tolist())}
+
+    @classmethod
+    def from_tfm(cls, font_name, file_path):
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        return decode_tfm(data, font_name=font_name, file_path=file_path)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.index
+
+    def get_parameter(self, name):
+        try:
+            i = get_parameter_names(self.coding_scheme).index(name)
+            return float(self.parameters[i])
+        except (ValueError, IndexError):
+            raise AttributeError(f'Font has no parameter {name}')
+
+    def to_bytes(self, source_size=0, source_mtime_ns=0):
+        """Encode the metrics, noting the size and modification time of the
+        file they came from."""
+        strings = [s.encode('utf-8') for s in (self.file_path, self.font_name,
+                                               self.coding_scheme)]
+        header = _header.pack(cache_magic, cache_version,
+                              source_size, source_mtime_ns,
+                              self.checksum, self.design_size,
+                              len(self.codes), len(self.parameters),
+                              len(self.lig_kerns),
+                              *(len(s) for s in strings))
+        header += b''.join(strings)
+        header += bytes(_padding(len(header)))
+        char_metrics = np.stack([self.widths, self.heights, self.depths,
+                                 self.italics])
+        arrays = [self.codes.astype('<i4'), char_metrics.astype('<f8'),
+                  self.parameters.astype('<f8'),
+                  self.lig_kerns.astype(lig_kern_dtype)]
+        parts = [header]
+        for a in arrays:
+            b = a.tobytes()
+            parts.append(b + bytes(_padding(len(b))))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Decode metrics encoded by `to_bytes`, returning them with the size
+        and modification time of the file they came from. The arrays are
+        views of `data`, not copies."""
+        (magic, version, source_size, source_mtime_ns, checksum, design_size,
+         nr_chars, nr_params, nr_lig_kerns,
+         *string_lengths) = _header.unpack_from(data)
+        if magic != cache_magic or version != cache_version:
+            raise ValueError('Not a font metrics cache of this version')
+        offset = _header.size
+        strings = []
+        for n in string_lengths:
+            strings.append(bytes(data[offset:offset + n]).decode('utf-8'))
+            offset += n
+        offset += _padding(offset)
+        file_path, font_name, coding_scheme = strings
+
+        def read_array(dtype, count):
+            nonlocal offset
+            a = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += a.nbytes + _padding(a.nbytes)
+            return a
+
+        codes = read_array('<i4', nr_chars)
+        widths, heights, depths, italics = read_array(
+            '<f8', 4 * nr_chars).reshape(4, nr_chars)
+        parameters = read_array('<f8', nr_params)
+        lig_kerns = read_array(lig_kern_dtype, nr_lig_kerns)
+        metrics = cls(font_name=font_name, file_path=file_path,
+                      checksum=checksum, design_size=design_size,
+                      coding_scheme=coding_scheme,
+                      codes=codes, widths=widths, heights=heights,
+                      depths=depths, italics=italics,
+                      parameters=parameters, lig_kerns=lig_kerns)
+        return metrics, source_size, source_mtime_ns
+
+    def __reduce__(self):
+        # Pickle metrics in their compact encoding, as format files do.
+        return _metrics_from_bytes, (self.to_bytes(),)
+
+
+def _metrics_from_bytes(data):
+    metrics, _, _ = FontMetrics.from_bytes(data)
+    return metrics
+
+
+def get_cache_path(file_path, cache_dir=None):
+    """Get the path of the cache file for a TFM file: next to it, or in a
+    cache directory, if one is given."""
+    file_path = opath.abspath(file_path)
+    root, _ = opath.splitext(file_path)
+    if cache_dir is None:
+        return f'{root}.{cache_extension}'
+    # Files of the same name may be in different directories, so qualify the
+    # name with a digest of the full path.
+    digest = hashlib.sha1(file_path.encode('utf-8')).hexdigest()[:16]
+    return opath.join(cache_dir,
+                      f'{opath.basename(root)}-{digest}.{cache_extension}')
+
+
+def _map_file(file_path):
+    """Map a file into memory, read-only. The mapping stays alive for as long
+    as anything refers to it, such as arrays viewing it."""
+    with open(file_path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _read_cache(cache_path, file_path, stat, use_mmap=False):
+    try:
+        if use_mmap:
+            data = _map_file(cache_path)
+        else:
+            with open(cache_path, 'rb') as f:
+                data = f.read()
+        metrics, size, mtime_ns = FontMetrics.from_bytes(data)
+    except (OSError, ValueError, struct.error):
+        return None
+    if (metrics.file_path != file_path
+            or size != stat.st_size
+            or mtime_ns != stat.st_mtime_ns):
+        return None
+    return metrics
+
+
+def _write_cache(cache_path, metrics, stat):
+    """Write metrics to a cache file, returning whether this succeeded."""
+    data = metrics.to_bytes(source_size=stat.st_size,
+                            source_mtime_ns=stat.st_mtime_ns)
+    # Write to a temporary file and move it into place, so that concurrent
+    # readers never see a partial file. Replacing the file, rather than
+    # writing over it, also leaves any existing mappings of it intact.
+    temp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        cache_dir = opath.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logger.info(f'Could not write font metrics cache {cache_path}: {e}')
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def load_font_metrics(font_name, file_path, cache_dir=None, use_cache=True,
+                      use_mmap=False):
+    """Get the metrics of a TFM file, from the cache if it is valid, or by
+    parsing the file and updating the cache otherwise.
+
+    If `use_mmap` is true, the metric arrays are read-only views of the
+    memory-mapped cache file. Processes that map the same file then share one
+    copy of the metrics in memory.
+    """
+    if not use_cache:
+        return FontMetrics.from_tfm(font_name, file_path)
+    file_path = opath.abspath(file_path)
+    stat = os.stat(file_path)
+    cache_path = get_cache_path(file_path, cache_dir)
+    metrics = _read_cache(cache_path, file_path, stat, use_mmap=use_mmap)
+    if metrics is None:
+        logger.debug(f'Font metrics cache miss for {file_path}')
+        metrics = FontMetrics.from_tfm(font_name, file_path)
+        written = _write_cache(cache_path, metrics, stat)
+        # Use the file we just wrote, so that we share it too.
+        if written and use_mmap:
+            metrics = (_read_cache(cache_path, file_path, stat,
+                                   use_mmap=True)
+                       or metrics)
+    else:
+        logger.debug(f'Font metrics cache hit for {file_path}')
+    # The font name is how the font was asked for, which may differ between
+    # uses of the same file.
+    metrics.font_name = font_name
+    return metrics
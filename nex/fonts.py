@@ -1,32 +1,89 @@
 import os
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from functools import lru_cache
+
+import numpy as np
 
 from .pydvi.TeXUnit import pt2sp
-from .pydvi.Font.TfmParser import TfmParser
 
 from .constants.instructions import Instructions
-from .utils import ensure_extension, find_file
+from .utils import ensure_extension, UserError
+from .file_index import FileIndex
+from .box import Character
+from .font_metrics import FontMetrics, load_font_metrics
 from .accessors import NotInScopeError
 from .feedback import drep
+from .pmap import pmap
+
+logger = logging.getLogger(__name__)
+
+
+# Number of possible character codes in a font.
+nr_char_codes = 256
+
+
+def scale(size, d):
+    """Convert a length in design-size units to scaled points, for a font at
+    a size given in scaled points."""
+    return round(d * size)
 
 
-@lru_cache(maxsize=512)
-def scale(design_size, d):
-    return round(pt2sp(d * design_size))
+def get_at_size(design_size, at_clause):
+    """Get the size at which to load a font, in scaled points, given its
+    design size in points, and an evaluated at clause: None, or a pair like
+    ('at_dimen', size) or ('scaled_number', n)."""
+    design_size = round(pt2sp(design_size))
+    if at_clause is None:
+        return design_size
+    clause_type, value = at_clause
+    if clause_type == 'at_dimen':
+        # TeXbook page 16: "the at size must be positive and less than
+        # 2048pt".
+        if not 0 < value < pt2sp(2048):
+            raise UserError(f'Improper at size: {value}sp')
+        return value
+    elif clause_type == 'scaled_number':
+        if not 0 < value <= 32768:
+            raise UserError(f'Illegal magnification: {value}')
+        return round(design_size * value / 1000)
+    else:
+        raise ValueError(f'Unknown at clause type: {clause_type}')
+
+
+# Actions to take when one character follows another in a font. See TeXbook
+# page 76, and the description of lig/kern programs in TfmParser.
+KernStep = namedtuple('KernStep', ('kern',))
+LigatureStep = namedtuple('LigatureStep', ('char_code', 'nr_to_pass_over',
+                                           'keep_current', 'keep_next'))
 
 
 class FontInfo:
+    """A font at a particular size.
+
+    Fonts loaded from the same file share one set of unscaled metrics. Each
+    instance has its own size, and scales the metrics to it when they are
+    first needed.
+    """
 
-    def __init__(self, file_name, file_path, at_clause):
+    def __init__(self, file_name, file_path, at_clause, metrics=None):
         if file_name is None:
             self._font_info = None
+            self.at_size = None
+            self._lig_kern_table = {}
         else:
-            self._font_info = TfmParser.parse(font_name=file_name,
-                                              filename=file_path)
+            if metrics is None:
+                metrics = FontMetrics.from_tfm(file_name, file_path)
+            self._font_info = metrics
+            self.at_size = get_at_size(metrics.design_size, at_clause)
+            self._lig_kern_table = None
         self.at_clause = at_clause
+        # Character metrics in scaled points, indexed by character code.
+        self._widths = None
+        self._heights = None
+        self._depths = None
 
-        self.at_size = None
         self.name = None
         self.area = None
         self.glue = None
@@ -42,64 +99,116 @@ class FontInfo:
 
     @property
     def file_name(self):
-        return self.font_info.filename
+        return self.font_info.file_path
 
     @property
     def font_name(self):
         return self.font_info.font_name
 
-    def char_info(self, code):
-        return self.font_info[code]
+    @property
+    def char_codes(self):
+        return self.font_info.codes.tolist()
+
+    @property
+    def lig_kern_table(self):
+        if self._lig_kern_table is None:
+            self._lig_kern_table = self._compile_lig_kern_table()
+        return self._lig_kern_table
+
+    @lig_kern_table.setter
+    def lig_kern_table(self, table):
+        self._lig_kern_table = table
+
+    def _compile_lig_kern_table(self):
+        """Compile the font's lig/kern programs into a map from a pair of
+        character codes to the step to take when they are adjacent."""
+        table = {}
+        for step in self.font_info.lig_kerns.tolist():
+            (left, right, is_kern, kern, char_code, nr_to_pass_over,
+             keep_current, keep_next) = step
+            key = (left, right)
+            # The first step for a pair is the one that applies.
+            if key in table:
+                continue
+            if is_kern:
+                table[key] = KernStep(kern=self.scale(kern))
+            else:
+                table[key] = LigatureStep(char_code=char_code,
+                                          nr_to_pass_over=nr_to_pass_over,
+                                          keep_current=keep_current,
+                                          keep_next=keep_next)
+        return table
 
     @property
     def design_size(self):
-        return self.font_info.design_font_size
+        return self.font_info.design_size
 
     def scale(self, d):
-        return scale(self.design_size, d)
+        return scale(self.at_size, d)
+
+    def _scale_char_metrics(self, values):
+        table = np.zeros(nr_char_codes, dtype=np.int64)
+        # Rounding half to even, as `round` does in `scale`.
+        table[self.font_info.codes] = np.rint(values * self.at_size)
+        return table.tolist()
+
+    def _scaled_parameter(self, name):
+        return self.scale(self.font_info.get_parameter(name))
 
     @property
     def slant(self):
         # 'Slant per point'. See TeXbook page 375.
         # Disable until I understand what it means and its units.
         raise NotImplementedError
-        return self.font_info.slant
+        return self.font_info.get_parameter('slant')
 
     @property
     def extra_space(self):
-        return self.scale(self.font_info.extra_space)
+        return self._scaled_parameter('extra_space')
 
     @property
     def quad(self):
-        return self.scale(self.font_info.quad)
+        return self._scaled_parameter('quad')
 
     @property
     def space_shrink(self):
-        return self.scale(self.font_info.space_shrink)
+        return self._scaled_parameter('space_shrink')
 
     @property
     def space_stretch(self):
-        return self.scale(self.font_info.space_stretch)
+        return self._scaled_parameter('space_stretch')
 
     @property
     def spacing(self):
-        return self.scale(self.font_info.spacing)
+        return self._scaled_parameter('spacing')
 
     @property
     def x_height(self):
-        return self.scale(self.font_info.x_height)
+        return self._scaled_parameter('x_height')
+
+    def has_char(self, code):
+        return code in self.font_info
+
+    def _scale_all_char_metrics(self):
+        metrics = self.font_info
+        self._widths = self._scale_char_metrics(metrics.widths)
+        self._heights = self._scale_char_metrics(metrics.heights)
+        self._depths = self._scale_char_metrics(metrics.depths)
 
-    @lru_cache(maxsize=512)
     def width(self, code):
-        return self.scale(self.char_info(code).width)
+        if self._widths is None:
+            self._scale_all_char_metrics()
+        return self._widths[code]
 
-    @lru_cache(maxsize=512)
     def height(self, code):
-        return self.scale(self.char_info(code).height)
+        if self._heights is None:
+            self._scale_all_char_metrics()
+        return self._heights[code]
 
-    @lru_cache(maxsize=512)
     def depth(self, code):
-        return self.scale(self.char_info(code).depth)
+        if self._depths is None:
+            self._scale_all_char_metrics()
+        return self._depths[code]
 
     def __repr__(self):
         a = [
@@ -127,13 +236,16 @@ class FontState:
 
     def __init__(self, font_families):
         self._current_font_id = None
-        self.font_families = font_families
+        # Persistent maps of family numbers to families, and of font ranges to
+        # font IDs.
+        self.font_families = pmap({nr: pmap(family)
+                                   for nr, family in font_families.items()})
 
     @staticmethod
     def default_initial_font_families():
-        def get_empty_font_family():
-            return {font_range: None for font_range in FontRange}
-        font_families = {i: get_empty_font_family() for i in range(16)}
+        empty_font_family = pmap({font_range: None
+                                  for font_range in FontRange})
+        font_families = {i: empty_font_family for i in range(16)}
         return font_families
 
     @classmethod
@@ -155,7 +267,8 @@ class FontState:
         return drep(self, a)
 
     def set_font_family(self, family_nr, font_range, font_id):
-        self.font_families[family_nr][font_range] = font_id
+        family = self.font_families[family_nr].set(font_range, font_id)
+        self.font_families = self.font_families.set(family_nr, family)
 
     # TODO: make font_family getter, but raise KeyError if entry is None.
 
@@ -173,18 +286,62 @@ class FontState:
 
 
 class GlobalFontState:
+    """The registry of loaded fonts.
+
+    Each font file is parsed at most once, and its metrics are shared by all
+    fonts that use it. Loading the same file at the same size again gives back
+    the existing font ID, as in TeX.
+    """
 
     null_font_id = 0
     FontInfo = FontInfo
 
-    def __init__(self, search_paths=None):
+    def __init__(self, search_paths=None, cache_dir=None, use_cache=True,
+                 file_index=None, max_prefetch_workers=4, use_mmap=False):
         null_font = self.FontInfo(file_name=None, file_path=None,
                                   at_clause=None)
         self.fonts = {self.null_font_id: null_font}
+        self._next_font_id = self.null_font_id + 1
+        # Font IDs, keyed by resolved file path and at size.
+        self._font_ids = {}
+        # Font metrics, keyed by resolved file path.
+        self._metrics = {}
+        # Shared character items, keyed by font ID and character code, made
+        # when first used.
+        self.characters = {}
         # TODO: Avoid multiple entries.
         self.search_paths = [os.getcwd()]
         if search_paths is not None:
             self.search_paths.extend(search_paths)
+        if file_index is None:
+            file_index = FileIndex()
+        self.file_index = file_index
+        # Font metrics being loaded in the background, keyed by resolved file
+        # path.
+        self._metrics_futures = {}
+        self._executor = None
+        self.max_prefetch_workers = max_prefetch_workers
+        # Decoded font metrics are cached next to each font file, or in
+        # `cache_dir` if it is given.
+        self.cache_dir = cache_dir
+        self.use_cache = use_cache
+        # Whether to map cached metrics into memory, sharing them with other
+        # processes, rather than read them.
+        self.use_mmap = use_mmap
+
+    def snapshot_font_chars(self):
+        """Get the hyphen and skew characters of the loaded fonts, to give
+        back to `restore_font_chars`."""
+        return {font_id: (font_info.hyphen_char, font_info.skew_char)
+                for font_id, font_info in self.fonts.items()}
+
+    def restore_font_chars(self, snapshot):
+        """Set the hyphen and skew characters of fonts back to those in a
+        snapshot. Fonts loaded since are left alone."""
+        for font_id, (hyphen_char, skew_char) in snapshot.items():
+            font_info = self.fonts[font_id]
+            font_info.hyphen_char = hyphen_char
+            font_info.skew_char = skew_char
 
     def set_skew_char(self, font_id, number):
         self.fonts[font_id].skew_char = number
@@ -199,12 +356,122 @@ class GlobalFontState:
     def get_font(self, font_id):
         return self.fonts[font_id]
 
-    def define_new_font(self, file_name, at_clause):
-        file_path = find_file(ensure_extension(file_name, 'tfm'),
-                              search_paths=self.search_paths)
-        # TODO: do this properly.
-        font_info = FontInfo(file_name, file_path, at_clause)
-        font_id = max(self.fonts.keys()) + 1
+    def get_metrics(self, font_id):
+        return self.fonts[font_id].font_info
+
+    def _make_character(self, font_id, code):
+        font_info = self.fonts[font_id]
+        if not font_info.has_char(code):
+            raise KeyError(f'Font {font_id} has no character {code}')
+        return Character(code,
+                         width=font_info.width(code),
+                         height=font_info.height(code),
+                         depth=font_info.depth(code),
+                         font_id=font_id)
+
+    def get_character(self, font_id, code):
+        try:
+            return self.characters[font_id, code]
+        except KeyError:
+            character = self._make_character(font_id, code)
+            self.characters[font_id, code] = character
+            return character
+
+    def dump_fonts(self):
+        """Get the loaded fonts, to give to `restore_fonts`, in another
+        registry, perhaps in another process."""
+        return {
+            'fonts': self.fonts,
+            'next_font_id': self._next_font_id,
+            'font_ids': self._font_ids,
+            'metrics': self._metrics,
+        }
+
+    def restore_fonts(self, dump):
+        """Load the fonts from `dump_fonts`, in place of those loaded. They
+        keep their IDs, and their metrics are not read again."""
+        self.fonts = dump['fonts']
+        self._next_font_id = dump['next_font_id']
+        self._font_ids = dump['font_ids']
+        self._metrics = dump['metrics']
+        self.characters = {}
+
+    def _add_font(self, font_info):
+        font_id = self._next_font_id
+        self._next_font_id += 1
         self.fonts[font_id] = font_info
+        return font_id
+
+    def _resolve_font_path(self, file_name):
+        file_path = self.file_index.find(ensure_extension(file_name, 'tfm'),
+                                         self.search_paths)
+        return os.path.realpath(file_path)
+
+    def _read_metrics(self, file_name, file_path):
+        return load_font_metrics(file_name, file_path,
+                                 cache_dir=self.cache_dir,
+                                 use_cache=self.use_cache,
+                                 use_mmap=self.use_mmap)
+
+    def prefetch(self, file_name):
+        """Start loading a font's metrics in the background, so they are
+        ready, or nearly, when the font is defined."""
+        try:
+            file_path = self._resolve_font_path(file_name)
+        except FileNotFoundError:
+            # Any error will be reported if the font is actually defined.
+            return
+        if file_path in self._metrics or file_path in self._metrics_futures:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_prefetch_workers)
+        logger.debug(f'Prefetching font {file_path}')
+        self._metrics_futures[file_path] = self._executor.submit(
+            self._read_metrics, file_name, file_path)
+
+    def prefetch_all(self, file_names):
+        for file_name in file_names:
+            self.prefetch(file_name)
+
+    def finish_prefetching(self):
+        """Wait for fonts being loaded in the background, and stop the
+        threads loading them. Threads do not survive a fork, so this must be
+        done before forking."""
+        for file_path, future in self._metrics_futures.items():
+            try:
+                self._metrics[file_path] = future.result()
+            except Exception:
+                # Any error will be reported if the font is actually defined.
+                pass
+        self._metrics_futures = {}
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _load_metrics(self, file_name, file_path):
+        try:
+            return self._metrics[file_path]
+        except KeyError:
+            pass
+        future = self._metrics_futures.pop(file_path, None)
+        if future is not None:
+            metrics = future.result()
+        else:
+            metrics = self._read_metrics(file_name, file_path)
+        self._metrics[file_path] = metrics
+        return metrics
+
+    def define_new_font(self, file_name, at_clause):
+        file_path = self._resolve_font_path(file_name)
+        metrics = self._load_metrics(file_name, file_path)
+        at_size = get_at_size(metrics.design_size, at_clause)
+        key = (file_path, at_size)
+        if key in self._font_ids:
+            return self._font_ids[key]
+        font_info = FontInfo(file_name, file_path, at_clause,
+                             metrics=metrics)
+        font_id = self._add_font(font_info)
+        self._font_ids[key] = font_id
         # Return new font id.
         return font_id
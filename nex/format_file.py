@@ -0,0 +1,61 @@
+"""
+Format files: the state left by a preamble, saved to be loaded quickly.
+
+When run with `--ini`, `\\dump` ends the job and writes the macros, codes,
+registers, parameters, hyphenation patterns and loaded fonts to a format
+file. A later run given the file with `--fmt` starts from that state, without
+reading the preamble again or parsing its fonts.
+
+A format file is a short header, giving its magic number and version, then a
+pickle of the state. The persistent maps of the state are pickled as plain
+dicts, and font metrics in their compact cache encoding. Format files are
+only read by the version of nex that wrote them; the version number must be
+bumped whenever the classes they hold change.
+"""
+import logging
+import pickle
+import struct
+
+from .utils import UserError
+
+logger = logging.getLogger(__name__)
+
+format_extension = 'fmt'
+format_magic = b'NXFT'
+format_version = 2
+
+# Magic and version.
+_header = struct.Struct('<4sH')
+
+
+def dump_format(state, file_path):
+    """Write a state to a format file. There must be no open groups, so
+    each scoped accessor has only its global scope."""
+    dump = {
+        'specials': state.specials,
+        'codes': state.codes,
+        'registers': state.registers,
+        'scoped_font_state': state.scoped_font_state,
+        'router': state.router,
+        'parameters': state.parameters,
+        'hyphenator': state.hyphenator,
+        'fonts': state.global_font_state.dump_fonts(),
+    }
+    with open(file_path, 'wb') as f:
+        f.write(_header.pack(format_magic, format_version))
+        pickle.dump(dump, f, protocol=pickle.HIGHEST_PROTOCOL)
+    logger.info(f'Wrote format file {file_path}')
+
+
+def read_format(file_path):
+    """Read the contents of a format file, as `dump_format` gathers them."""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if len(data) < _header.size:
+        magic, version = None, None
+    else:
+        magic, version = _header.unpack_from(data)
+    if magic != format_magic or version != format_version:
+        raise UserError(f'{file_path} is not a format file of this version; '
+                        'make it again with --ini')
+    return pickle.loads(memoryview(data)[_header.size:])
@@ -0,0 +1,253 @@
+"""
+Hyphenation by Liang's algorithm, as described in Appendix H of the TeXbook.
+
+Patterns like 'a1b' say that a hyphen is allowed between 'a' and 'b', at a
+priority given by the digit; odd digits allow hyphens, even digits forbid
+them, and higher digits override lower ones. The patterns matching each
+substring of a word are looked up in a trie, and the maximum digit at each
+position is taken.
+"""
+import re
+from array import array
+from functools import lru_cache
+
+from .utils import UserError
+from .pmap import pmap
+
+# The character used to mark the start and end of a word in patterns.
+word_edge = '.'
+
+
+def parse_pattern(pattern):
+    """Split a pattern like '.ab1c' into its letters and digits, like
+    ('.abc', (0, 0, 0, 1, 0)). There is one more digit than letter, for the
+    positions between and around the letters."""
+    letters = []
+    digits = [0]
+    for c in pattern:
+        if c.isdigit():
+            digits[-1] = int(c)
+        else:
+            letters.append(c)
+            digits.append(0)
+    return ''.join(letters), tuple(digits)
+
+
+def parse_exception(word):
+    """Split a hyphenation exception like 'ta-ble' into its letters and
+    the positions of its hyphens, like ('table', (2,))."""
+    letters = word.replace('-', '')
+    positions = []
+    nr_letters = 0
+    for c in word:
+        if c == '-':
+            positions.append(nr_letters)
+        else:
+            nr_letters += 1
+    return letters, tuple(positions)
+
+
+class PatternTrie:
+    """A trie of hyphenation patterns, packed into flat arrays.
+
+    Each node owns a base index. The child of a node for a character is in
+    the slot at base + (the character's index in the alphabet), provided the
+    character stored in that slot agrees. The packing is done as in TeX, by
+    placing each node at the first base where its children fit, and no other
+    node has the same base.
+    """
+
+    def __init__(self, patterns=()):
+        # Build an unpacked trie first: each node is a pair of a map of
+        # children, and the digits of a pattern ending there, if any.
+        root = [{}, None]
+        alphabet = {}
+        for pattern in patterns:
+            letters, digits = parse_pattern(pattern)
+            node = root
+            for c in letters:
+                if c not in alphabet:
+                    alphabet[c] = len(alphabet) + 1
+                node = node[0].setdefault(c, [{}, None])
+            if node[1] is not None and node[1] != digits:
+                raise UserError(f'Duplicate pattern: {pattern}')
+            node[1] = digits
+        self.alphabet = alphabet
+        self.digits = []
+        self.chars = array('l')
+        self.links = array('l')
+        self.ops = array('l')
+        self.root_base = self._pack(root)
+
+    def _pack(self, root):
+        taken_bases = set()
+        # Which slots are occupied, for fast searching for free slots.
+        occupied = bytearray()
+
+        def ensure_size(n):
+            extra = n - len(self.chars)
+            if extra > 0:
+                occupied.extend(bytes(extra))
+                self.chars.extend([0] * extra)
+                self.links.extend([-1] * extra)
+                self.ops.extend([-1] * extra)
+
+        # Pack children before their parents, so links are known when a slot
+        # is filled.
+        def pack_node(node):
+            children, _ = node
+            if not children:
+                return -1
+            child_bases = {c: pack_node(child)
+                           for c, child in children.items()}
+            codes = sorted(self.alphabet[c] for c in children)
+            # Try bases that put the first child in a free slot, until the
+            # other children fit too.
+            slot = codes[0]
+            while True:
+                ensure_size(slot + 1)
+                slot = occupied.find(0, slot)
+                if slot < 0:
+                    slot = len(occupied)
+                    continue
+                base = slot - codes[0]
+                ensure_size(base + codes[-1] + 1)
+                if (base not in taken_bases
+                        and not any(occupied[base + code]
+                                    for code in codes[1:])):
+                    break
+                slot += 1
+            taken_bases.add(base)
+            for c, child in children.items():
+                slot = base + self.alphabet[c]
+                occupied[slot] = 1
+                self.chars[slot] = self.alphabet[c]
+                self.links[slot] = child_bases[c]
+                _, digits = child
+                if digits is not None:
+                    self.ops[slot] = len(self.digits)
+                    self.digits.append(digits)
+            return base
+
+        return pack_node(root)
+
+    def __len__(self):
+        return len(self.digits)
+
+    def word_digits(self, word):
+        """Get the maximum pattern digit at each position of a word, including
+        the positions before and after its edge markers."""
+        word = f'{word_edge}{word}{word_edge}'
+        codes = [self.alphabet.get(c, 0) for c in word]
+        points = [0] * (len(word) + 1)
+        chars, links, ops, all_digits = (self.chars, self.links, self.ops,
+                                         self.digits)
+        nr_slots = len(chars)
+        for i in range(len(word)):
+            base = self.root_base
+            for j in range(i, len(word)):
+                code = codes[j]
+                if base < 0 or code == 0:
+                    break
+                slot = base + code
+                if slot >= nr_slots or chars[slot] != code:
+                    break
+                op = ops[slot]
+                if op >= 0:
+                    for k, d in enumerate(all_digits[op]):
+                        if d > points[i + k]:
+                            points[i + k] = d
+                base = links[slot]
+        return points
+
+
+class Hyphenator:
+    """Hyphenation patterns and exceptions, with a cache of hyphenated
+    words."""
+
+    def __init__(self, cache_size=4096):
+        # The patterns and exceptions are replaced, rather than changed, when
+        # added to, so that a snapshot can just refer to them.
+        self.patterns = ()
+        self.exceptions = pmap()
+        self._trie = None
+        self.cache_size = cache_size
+        self._hyphenate_cached = lru_cache(maxsize=cache_size)(
+            self._hyphenate)
+
+    def __getstate__(self):
+        # The cache is not kept, but the packed trie is, as it is slow to
+        # make.
+        state = dict(vars(self))
+        del state['_hyphenate_cached']
+        state['_trie'] = self.trie if self.patterns else None
+        return state
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        self._hyphenate_cached = lru_cache(maxsize=self.cache_size)(
+            self._hyphenate)
+
+    @classmethod
+    def from_tex_file(cls, file_path):
+        """Read the patterns and exceptions from a file like hyphen.tex,
+        that contains \\patterns{...} and \\hyphenation{...}."""
+        with open(file_path, encoding='ascii', errors='ignore') as f:
+            text = f.read()
+        text = re.sub(r'%.*', '', text)
+        hyphenator = cls()
+        for command, content in re.findall(r'\\(patterns|hyphenation)'
+                                           r'\s*\{([^}]*)\}', text):
+            if command == 'patterns':
+                hyphenator.add_patterns(content.split())
+            else:
+                hyphenator.add_exceptions(content.split())
+        return hyphenator
+
+    def _changed(self):
+        self._hyphenate_cached.cache_clear()
+
+    @property
+    def trie(self):
+        if self._trie is None:
+            self._trie = PatternTrie(self.patterns)
+        return self._trie
+
+    def snapshot(self):
+        """Get the patterns and exceptions, to give back to `restore`."""
+        return self.patterns, self.exceptions, self._trie
+
+    def restore(self, snapshot):
+        self.patterns, self.exceptions, self._trie = snapshot
+        self._changed()
+
+    def add_patterns(self, patterns):
+        self.patterns += tuple(patterns)
+        self._trie = None
+        self._changed()
+
+    def add_exceptions(self, words):
+        for word in words:
+            letters, positions = parse_exception(word.lower())
+            self.exceptions = self.exceptions.set(letters, positions)
+        self._changed()
+
+    def _hyphenate(self, word, left_min, right_min):
+        try:
+            positions = self.exceptions[word]
+        except KeyError:
+            if not self.patterns:
+                return ()
+            points = self.trie.word_digits(word)
+            # The digits are offset by the leading edge marker.
+            positions = tuple(i for i in range(1, len(word))
+                              if points[i + 1] % 2 == 1)
+        return tuple(i for i in positions
+                     if left_min <= i <= len(word) - right_min)
+
+    def hyphenate(self, word, left_min=2, right_min=3):
+        """Get the positions in a lower-case word where hyphens may go. A
+        position i means a hyphen may go between word[i - 1] and word[i]."""
+        if len(word) < left_min + right_min:
+            return ()
+        return self._hyphenate_cached(word, left_min, right_min)
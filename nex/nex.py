@@ -1,5 +1,7 @@
 import logging
 import argparse
+import functools
+import os
 import os.path as opath
 import sys
 
@@ -13,8 +15,12 @@ from .parsing.utils import (logger as chunk_logger,
 from .parsing.parsing import command_parser
 from .state import logger as state_logger, GlobalState, TidyEnd
 from .tokens import BuiltToken
-from .box_writer import write_to_dvi_file
+from .box_writer import DVIPageSink, PageRangeSink, convert_to_pdf
+from .format_file import dump_format, format_extension
+from .zygote import serve
 from .glog import DAGLog
+from .file_index import FileIndex
+from .constants.parameters import Parameters
 
 dir_path = opath.dirname(opath.realpath(__file__))
 
@@ -26,7 +32,8 @@ default_font_search_paths = get_default_font_paths() + [
 
 
 def make_input_chain(state):
-    reader = Reader()
+    # Share the font state's file index, so directories are listed once.
+    reader = Reader(file_index=state.global_font_state.file_index)
     lexer = Lexer(reader, get_cat_code_func=state.codes.get_cat_code)
     instructioner = Instructioner(
         lexer=lexer,
@@ -66,18 +73,144 @@ def run_state(state, input_paths):
         state.execute_command_tokens(command_grabber, banisher)
 
 
-def run_files(font_search_paths, input_paths):
-    state = GlobalState.from_defaults(font_search_paths)
+def report_stats(state):
+    file_index = state.global_font_state.file_index
+    stats = file_index.stats
+    print(f"File index: {stats['directories']} directories, "
+          f"{stats['hits']} hits, {stats['misses']} misses")
+
+
+def read_font_manifest(manifest_path):
+    """Read the names of fonts to load, one per line. Blank lines, and text
+    after a '%', are ignored."""
+    with open(manifest_path, encoding='utf-8') as f:
+        lines = [line.split('%', 1)[0].strip() for line in f]
+    return [line for line in lines if line]
+
+
+def make_state(font_search_paths, font_cache_dir=None, file_db_path=None,
+               font_manifest_path=None, mmap_font_metrics=False,
+               page_sink=None, format_path=None):
+    """Make a state to run a job from, starting from the state in a format
+    file if one is given."""
+    file_index = FileIndex(db_path=file_db_path)
+    state_kwargs = dict(font_search_paths=font_search_paths,
+                        font_cache_dir=font_cache_dir,
+                        file_index=file_index,
+                        mmap_font_metrics=mmap_font_metrics,
+                        page_sink=page_sink)
+    if format_path is None:
+        state = GlobalState.from_defaults(**state_kwargs)
+    else:
+        state = GlobalState.from_format(format_path, **state_kwargs)
+    # Start loading the fonts we expect to need, while reading begins.
+    if font_manifest_path is not None:
+        state.global_font_state.prefetch_all(
+            read_font_manifest(font_manifest_path))
+    return state
+
+
+def run_job(state, input_paths, dump_path=None):
+    """Run input files until the job ends. If a dump path is given, and the
+    job ends with \\dump, write the final state there as a format file."""
     try:
         run_state(state, input_paths)
     except TidyEnd:
+        state.close_page_sink()
+        # Without --ini, \dump just ends the job, as in TeX.
+        if dump_path is not None and state.dump_requested:
+            dump_format(state, dump_path)
+        state.global_font_state.file_index.save()
+        if state.parameters.get(Parameters.tracing_stats) > 0:
+            report_stats(state)
         return state
     raise Exception('Left run_state without a tidy end occurring.')
 
 
-def run_and_write(font_search_paths, input_paths, dvi_path, write_pdf):
-    state = run_files(font_search_paths, input_paths)
-    write_to_dvi_file(state, dvi_path, write_pdf=write_pdf)
+def run_preamble(state, input_paths):
+    """Run input files to their ends, rather than to an \\end, to set up a
+    state for jobs to start from."""
+    for input_path in input_paths:
+        banisher, reader = make_input_chain(state)
+        reader.insert_file(input_path)
+        command_grabber = chunk_iter(banisher, command_parser)
+        try:
+            state.execute_command_tokens(command_grabber, banisher)
+        except EOFError:
+            pass
+
+
+def run_files(font_search_paths, input_paths, font_cache_dir=None,
+              file_db_path=None, font_manifest_path=None,
+              mmap_font_metrics=False, page_sink=None, format_path=None,
+              dump_path=None):
+    """Run input files as a job, from a new state."""
+    state = make_state(font_search_paths,
+                       font_cache_dir=font_cache_dir,
+                       file_db_path=file_db_path,
+                       font_manifest_path=font_manifest_path,
+                       mmap_font_metrics=mmap_font_metrics,
+                       page_sink=page_sink,
+                       format_path=format_path)
+    return run_job(state, input_paths, dump_path=dump_path)
+
+
+def make_page_sink(dvi_path, dvi_workers=1, page_range=None):
+    # Pages are written as they are shipped out, rather than at the end.
+    page_sink = DVIPageSink(dvi_path, nr_workers=dvi_workers)
+    if page_range is not None:
+        page_sink = PageRangeSink(page_sink, *page_range)
+    return page_sink
+
+
+def run_and_write(font_search_paths, input_paths, dvi_path, write_pdf,
+                  font_cache_dir=None, file_db_path=None,
+                  font_manifest_path=None, mmap_font_metrics=False,
+                  dvi_workers=1, page_range=None, format_path=None,
+                  dump_path=None):
+    page_sink = make_page_sink(dvi_path, dvi_workers, page_range)
+    run_files(font_search_paths, input_paths,
+              font_cache_dir=font_cache_dir,
+              file_db_path=file_db_path,
+              font_manifest_path=font_manifest_path,
+              mmap_font_metrics=mmap_font_metrics,
+              page_sink=page_sink,
+              format_path=format_path,
+              dump_path=dump_path)
+    if write_pdf:
+        convert_to_pdf(dvi_path)
+
+
+def run_zygote_job(state, request):
+    """Run a job sent to a zygote, in a child forked from it, starting from
+    the state the zygote set up."""
+    # Relative paths are relative to where the job was sent from.
+    os.chdir(request['cwd'])
+    # Fonts are first looked for in the working directory, which was the
+    # zygote's when its state was made.
+    search_paths = state.global_font_state.search_paths
+    search_paths[0] = request['cwd']
+    search_paths.extend(request['font_search_paths'])
+    dvi_path = request['dvi_path']
+    pages = request['pages']
+    state.page_sink = make_page_sink(dvi_path, request['dvi_workers'],
+                                     pages and page_range(pages))
+    run_job(state, request['input_paths'])
+    if request['write_pdf']:
+        convert_to_pdf(dvi_path)
+    return {'dvi_path': dvi_path}
+
+
+def page_range(v):
+    try:
+        first, _, last = v.partition('-')
+        first = int(first)
+        last = int(last) if last else first
+    except ValueError:
+        raise argparse.ArgumentTypeError('Page range must be like 10-12')
+    if not 1 <= first <= last:
+        raise argparse.ArgumentTypeError('Invalid page range')
+    return first, last
 
 
 def log_level(v):
@@ -101,6 +234,32 @@ def main():
     parser.add_argument('inputs', nargs='*')
     parser.add_argument('--pdf', action='store_true')
     parser.add_argument('-f', '--fonts', nargs='*')
+    parser.add_argument('--font-cache',
+                        help='Directory in which to cache font metrics, '
+                             'rather than next to each font')
+    parser.add_argument('--mmap-font-metrics', action='store_true',
+                        help='Map cached font metrics into memory, to share '
+                             'them between processes')
+    parser.add_argument('--font-manifest',
+                        help='File naming fonts to start loading at once, '
+                             'one per line')
+    parser.add_argument('--file-db',
+                        help='Database of search directory listings, in '
+                             'ls-R format, to read and update')
+    parser.add_argument('--dvi-workers', type=int, default=1,
+                        help='Number of processes to encode DVI pages with')
+    parser.add_argument('--pages', type=page_range,
+                        help='Only write pages in a range, like 10-12, and '
+                             'stop after the last one')
+    parser.add_argument('--ini', action='store_true',
+                        help='Let \\dump write the final state to a format '
+                             'file, named after the last input')
+    parser.add_argument('--fmt',
+                        help='Format file to start from, made with --ini')
+    parser.add_argument('--zygote', metavar='SOCKET',
+                        help='Run the inputs as a preamble, then listen on a '
+                             'Unix socket, and run each job sent there, as '
+                             'by nex-connect, in a forked process')
 
     out_group = parser.add_mutually_exclusive_group()
     out_group.add_argument('-o', '--output')
@@ -142,6 +301,18 @@ def main():
         in_dir_path = opath.dirname(input_path)
         font_search_paths += [in_dir_path, opath.join(in_dir_path, 'fonts')]
 
+    if args.zygote:
+        state = make_state(font_search_paths,
+                           font_cache_dir=args.font_cache,
+                           file_db_path=args.file_db,
+                           font_manifest_path=args.font_manifest,
+                           mmap_font_metrics=args.mmap_font_metrics,
+                           format_path=args.fmt)
+        run_preamble(state, args.inputs)
+        state.global_font_state.finish_prefetching()
+        print(f'Zygote listening on {args.zygote}')
+        serve(args.zygote, functools.partial(run_zygote_job, state))
+
     if args.test:
         dvi_path = None
     elif args.stdout:
@@ -154,12 +325,26 @@ def main():
     else:
         dvi_path = 'nexput.dvi'
 
+    if args.ini:
+        if args.inputs:
+            job_name = opath.splitext(opath.basename(args.inputs[-1]))[0]
+        else:
+            job_name = 'nexput'
+        dump_path = ensure_extension(job_name, format_extension)
+    else:
+        dump_path = None
+
     if args.test:
         print('Not writing output in test mode')
     else:
         print(f'Writing DVI to {dvi_path}')
 
-    run_and_write(font_search_paths, args.inputs, dvi_path, args.pdf)
+    run_and_write(font_search_paths, args.inputs, dvi_path, args.pdf,
+                  font_cache_dir=args.font_cache, file_db_path=args.file_db,
+                  font_manifest_path=args.font_manifest,
+                  mmap_font_metrics=args.mmap_font_metrics,
+                  dvi_workers=args.dvi_workers, page_range=args.pages,
+                  format_path=args.fmt, dump_path=dump_path)
 
 
 if __name__ == '__main__':
@@ -1,10 +1,17 @@
 from collections import namedtuple
 
+import numpy as np
+
 from . import box
+from .columnar import ColumnarHList, ItemKind
 
 
 HListRoute = namedtuple('HListRoute', ('sequence', 'demerit'))
 
+# Paragraphs with at least this many items are broken using the columnar
+# representation, which avoids re-measuring material for each candidate line.
+columnar_min_length = 32
+
 
 def break_at(h_list, i):
     break_item = h_list[i]
@@ -12,10 +19,17 @@ def break_at(h_list, i):
     # otherwise, it is. This is why the break item is returned separately.
     if isinstance(break_item, box.Glue):
         h_list_got = h_list[: i]
+    # If it is a discretionary break, its pre-break material is put at the
+    # end of the line, and its post-break material starts the next.
+    elif isinstance(break_item, box.DiscretionaryBreak):
+        h_list_got = h_list[: i] + list(break_item.pre_break)
     else:
         h_list_got = h_list[: i+1]
+    if (isinstance(break_item, box.DiscretionaryBreak)
+            and break_item.post_break):
+        h_list_after = list(break_item.post_break) + h_list[i + 1:]
     # If the break item is the last item in the list, no h_list after.
-    if i == len(h_list) - 1:
+    elif i == len(h_list) - 1:
         h_list_after = []
     # Otherwise, discard tokens until seeing something.
     else:
@@ -60,8 +74,122 @@ def get_best_route(h_list, h_size, tolerance, line_penalty):
         return None
 
 
+def _line_demerits(badness, penalties, line_penalty):
+    """Vectorized equivalent of `box.HBox.demerit`."""
+    ten_k = 10000
+    d = (line_penalty + badness) ** 2
+    p = penalties.astype(np.float64)
+    return np.where((0 <= p) & (p < ten_k), d + p ** 2,
+                    np.where((-ten_k < p) & (p < 0), d - p ** 2, d))
+
+
+def get_best_route_columnar(h_list, h_size, tolerance, line_penalty):
+    """Find the same route as `get_best_route`, but using a columnar
+    representation of the list.
+
+    The best route after a break depends only on where the list resumes, so
+    each resumption point is solved once, working backwards from the end of
+    the list.
+    """
+    cols = ColumnarHList.from_items(h_list)
+    n = len(cols)
+    if n == 0:
+        return HListRoute(sequence=[], demerit=0)
+    is_break = cols.break_point_mask()
+    is_glue = cols.kinds == ItemKind.glue
+    is_discretionary = cols.kinds == ItemKind.discretionary
+    if any(h_list[i].post_break for i in np.flatnonzero(is_discretionary)):
+        raise NotImplementedError('Cannot break discretionaries with '
+                                  'post-break material in columnar form')
+    # Where the line got by breaking at each item ends. Glue break items are
+    # not included in the line, and discretionary break items are replaced
+    # by their pre-break material.
+    line_ends = np.arange(n) + ~(is_glue | is_discretionary)
+    # Where the list resumes after breaking at each item: items are discarded
+    # until seeing something not discardable, or a break-point. If we run
+    # out, the last item is kept.
+    stops = np.flatnonzero(~cols.discardable | is_break)
+    i_stop = np.searchsorted(stops, np.arange(1, n + 1))
+    resumes = np.where(i_stop < len(stops),
+                       stops[np.minimum(i_stop, len(stops) - 1)], n - 1)
+    resumes[n - 1] = n
+
+    # Penalties of 10000 or more forbid breaking.
+    candidates = np.flatnonzero(is_break & (cols.penalties < 10000))
+    starts = np.unique(np.concatenate([[0], resumes[candidates]]))
+    best_demerits = np.full(n + 1, np.inf)
+    best_demerits[n] = 0
+    # The index of the break item, or -1 for no break.
+    best_breaks = np.full(n + 1, -1, dtype=np.int64)
+    for start in starts[::-1]:
+        if start == n:
+            continue
+        # Glue at the start of a list cannot be a break-point, because
+        # nothing precedes it.
+        side = 'right' if is_glue[start] else 'left'
+        cands = candidates[np.searchsorted(candidates, start, side=side):]
+        cand_ends = line_ends[cands]
+        badness = cols.segment_badness(start, cand_ends, h_size,
+                                       extra_widths=cols.break_widths[cands])
+        considerable = badness <= tolerance
+        cands = cands[considerable]
+        demerits = (_line_demerits(badness[considerable],
+                                   cols.penalties[cands], line_penalty)
+                    + best_demerits[resumes[cands]])
+        no_break_badness = cols.segment_badness(start, [n], h_size)[0]
+        no_break_demerit = (line_penalty + no_break_badness) ** 2
+        # Like `min`, prefer the earliest of equally good routes, and consider
+        # not breaking last.
+        if len(cands) and demerits.min() <= no_break_demerit:
+            i_best = np.argmin(demerits)
+            best_demerits[start] = demerits[i_best]
+            best_breaks[start] = cands[i_best]
+        else:
+            best_demerits[start] = no_break_demerit
+            best_breaks[start] = -1
+
+    sequence = []
+    start = 0
+    while start < n:
+        i_break = best_breaks[start]
+        if i_break < 0:
+            sequence.append(h_list[start:])
+            break
+        line = h_list[start:line_ends[i_break]]
+        if is_discretionary[i_break]:
+            line.extend(h_list[i_break].pre_break)
+        sequence.append(line)
+        start = resumes[i_break]
+    return HListRoute(sequence=sequence, demerit=best_demerits[0])
+
+
+def is_feasible_route(sequence, h_size, tolerance):
+    """Whether every line of a route is within the tolerance."""
+    return all(box.HBox(h_list, to=h_size, set_glue=False).badness()
+               <= tolerance
+               for h_list in sequence)
+
+
+def expand_discretionaries(h_list):
+    """Replace discretionary breaks that were not broken at by their
+    no-break material."""
+    expanded = []
+    for item in h_list:
+        if isinstance(item, box.DiscretionaryBreak):
+            expanded.extend(item.no_break)
+        else:
+            expanded.append(item)
+    return expanded
+
+
 def get_best_h_lists(h_list, h_size, tolerance, line_penalty):
-    best_route = get_best_route(h_list, h_size, tolerance, line_penalty)
+    has_post_break = any(isinstance(item, box.DiscretionaryBreak)
+                         and item.post_break for item in h_list)
+    if len(h_list) >= columnar_min_length and not has_post_break:
+        get_route = get_best_route_columnar
+    else:
+        get_route = get_best_route
+    best_route = get_route(h_list, h_size, tolerance, line_penalty)
     if best_route is None:
         raise Exception('Could not break lines')
     else:
@@ -125,11 +125,13 @@ def add_assignment_rules(pg):
 
     # Start of 'arithmetic', a simple assignment.
 
+    @pg.production('arithmetic : ADVANCE mu_glue_variable optional_by mu_glue')
+    @pg.production('arithmetic : ADVANCE glue_variable optional_by glue')
+    @pg.production('arithmetic : ADVANCE dimen_variable optional_by dimen')
     @pg.production('arithmetic : ADVANCE integer_variable optional_by number')
     def arithmetic_integer_variable(p):
         # TODO: Allow arithmetic on parameters.
         # TODO: Allow multiply and divide operations.
-        # TODO: Allow arithmetic on dimen, glue and muglue.
         return BuiltToken(type_='advance',
                           value={'variable': p[1], 'value': p[3]},
                           parents=p)
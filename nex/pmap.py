@@ -0,0 +1,311 @@
+"""
+Persistent maps: immutable mappings that share structure between versions.
+
+A `PMap` is a hash array mapped trie. Setting or deleting a key gives a new
+map, copying only the nodes on the path to the key, of which there are about
+log32(n); everything else is shared with the old map, which is unchanged.
+This makes keeping old versions of a map, as state snapshots do, free.
+"""
+from collections.abc import Mapping
+
+_bits_per_level = 5
+_branch_mask = (1 << _bits_per_level) - 1
+_hash_mask = (1 << 64) - 1
+_nr_hash_bits = 64
+
+
+def _hash(key):
+    return hash(key) & _hash_mask
+
+
+def _index(bitmap, bit):
+    """The position in a node's entries of the entry for a bit."""
+    return bin(bitmap & (bit - 1)).count('1')
+
+
+class _Leaf:
+    """A key and its value, and the key's hash."""
+
+    __slots__ = ('key', 'value', 'hash')
+
+    def __init__(self, key, value, hash_):
+        self.key = key
+        self.value = value
+        self.hash = hash_
+
+
+class _Collision:
+    """Leaves whose keys have the same hash."""
+
+    __slots__ = ('hash', 'leaves')
+
+    def __init__(self, hash_, leaves):
+        self.hash = hash_
+        self.leaves = leaves
+
+    def find(self, key):
+        for i, leaf in enumerate(self.leaves):
+            if leaf.key is key or leaf.key == key:
+                return i
+        return None
+
+
+class _Node:
+    """A node with an entry for each set bit of its bitmap. Each entry is a
+    leaf, a collision or a child node."""
+
+    __slots__ = ('bitmap', 'entries')
+
+    def __init__(self, bitmap, entries):
+        self.bitmap = bitmap
+        self.entries = entries
+
+
+_empty_node = _Node(0, ())
+
+
+def _merge(entry_1, entry_2, hash_2, shift):
+    """Make a node holding two entries, which are leaves or collisions."""
+    hash_1 = entry_1.hash
+    if hash_1 == hash_2:
+        leaves_1 = (entry_1.leaves if isinstance(entry_1, _Collision)
+                    else (entry_1,))
+        return _Collision(hash_1, leaves_1 + (entry_2,))
+    bit_1 = 1 << ((hash_1 >> shift) & _branch_mask)
+    bit_2 = 1 << ((hash_2 >> shift) & _branch_mask)
+    if bit_1 == bit_2:
+        child = _merge(entry_1, entry_2, hash_2, shift + _bits_per_level)
+        return _Node(bit_1, (child,))
+    entries = (entry_1, entry_2) if bit_1 < bit_2 else (entry_2, entry_1)
+    return _Node(bit_1 | bit_2, entries)
+
+
+def _set(node, shift, hash_, key, value):
+    """Get the node with a key set, and whether the key is new."""
+    bit = 1 << ((hash_ >> shift) & _branch_mask)
+    i = _index(node.bitmap, bit)
+    entries = node.entries
+    if not node.bitmap & bit:
+        new_entries = entries[:i] + (_Leaf(key, value, hash_),) + entries[i:]
+        return _Node(node.bitmap | bit, new_entries), True
+    entry = entries[i]
+    if isinstance(entry, _Node):
+        new_entry, is_new = _set(entry, shift + _bits_per_level, hash_, key,
+                                 value)
+        if new_entry is entry:
+            return node, False
+    elif isinstance(entry, _Leaf):
+        if entry.key is key or entry.key == key:
+            if entry.value is value:
+                return node, False
+            new_entry, is_new = _Leaf(key, value, hash_), False
+        else:
+            new_entry = _merge(entry, _Leaf(key, value, hash_), hash_,
+                               shift + _bits_per_level)
+            is_new = True
+    else:
+        j = entry.find(key) if entry.hash == hash_ else None
+        if j is None:
+            new_entry = _merge(entry, _Leaf(key, value, hash_), hash_,
+                               shift + _bits_per_level)
+            is_new = True
+        else:
+            if entry.leaves[j].value is value:
+                return node, False
+            leaves = (entry.leaves[:j] + (_Leaf(key, value, hash_),)
+                      + entry.leaves[j + 1:])
+            new_entry, is_new = _Collision(hash_, leaves), False
+    new_entries = entries[:i] + (new_entry,) + entries[i + 1:]
+    return _Node(node.bitmap, new_entries), is_new
+
+
+def _delete(node, shift, hash_, key):
+    """Get the node without a key, or the same node if the key is absent.
+    A node left with a single leaf is replaced by the leaf, and an empty
+    node by None."""
+    bit = 1 << ((hash_ >> shift) & _branch_mask)
+    if not node.bitmap & bit:
+        return node
+    i = _index(node.bitmap, bit)
+    entries = node.entries
+    entry = entries[i]
+    if isinstance(entry, _Node):
+        new_entry = _delete(entry, shift + _bits_per_level, hash_, key)
+        if new_entry is entry:
+            return node
+    elif isinstance(entry, _Leaf):
+        if not (entry.key is key or entry.key == key):
+            return node
+        new_entry = None
+    else:
+        j = entry.find(key) if entry.hash == hash_ else None
+        if j is None:
+            return node
+        leaves = entry.leaves[:j] + entry.leaves[j + 1:]
+        new_entry = leaves[0] if len(leaves) == 1 else _Collision(hash_,
+                                                                  leaves)
+    if new_entry is None:
+        bitmap = node.bitmap & ~bit
+        new_entries = entries[:i] + entries[i + 1:]
+    else:
+        bitmap = node.bitmap
+        new_entries = entries[:i] + (new_entry,) + entries[i + 1:]
+    if not new_entries:
+        return None
+    if len(new_entries) == 1 and not isinstance(new_entries[0], _Node):
+        return new_entries[0]
+    return _Node(bitmap, new_entries)
+
+
+def _build(leaves, shift):
+    """Make a node holding leaves with distinct keys, whose hashes agree in
+    the bits below a shift, in one go."""
+    buckets = {}
+    for leaf in leaves:
+        index = (leaf.hash >> shift) & _branch_mask
+        buckets.setdefault(index, []).append(leaf)
+    bitmap = 0
+    entries = []
+    for index in sorted(buckets):
+        bucket = buckets[index]
+        bitmap |= 1 << index
+        if len(bucket) == 1:
+            entries.append(bucket[0])
+        elif len(bucket) == 2:
+            entries.append(_merge(bucket[0], bucket[1], bucket[1].hash,
+                                  shift + _bits_per_level))
+        elif all(leaf.hash == bucket[0].hash for leaf in bucket):
+            entries.append(_Collision(bucket[0].hash, tuple(bucket)))
+        else:
+            entries.append(_build(bucket, shift + _bits_per_level))
+    return _Node(bitmap, tuple(entries))
+
+
+def _iter_leaves(node):
+    for entry in node.entries:
+        if isinstance(entry, _Leaf):
+            yield entry
+        elif isinstance(entry, _Collision):
+            yield from entry.leaves
+        else:
+            yield from _iter_leaves(entry)
+
+
+_missing = object()
+
+
+class PMap(Mapping):
+    """An immutable mapping, changed by making new versions with `set`,
+    `delete` and `update`, which share structure with the old version."""
+
+    __slots__ = ('_root', '_len')
+
+    def __init__(self, root=_empty_node, len_=0):
+        self._root = root
+        self._len = len_
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for leaf in _iter_leaves(self._root):
+            yield leaf.key
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def get(self, key, default=None):
+        hash_ = hash(key) & _hash_mask
+        node = self._root
+        shift = 0
+        while True:
+            bit = 1 << ((hash_ >> shift) & _branch_mask)
+            bitmap = node.bitmap
+            if not bitmap & bit:
+                return default
+            entry = node.entries[bin(bitmap & (bit - 1)).count('1')]
+            if isinstance(entry, _Node):
+                node = entry
+                shift += _bits_per_level
+            elif isinstance(entry, _Leaf):
+                if entry.key is key or entry.key == key:
+                    return entry.value
+                return default
+            else:
+                j = entry.find(key) if entry.hash == hash_ else None
+                return default if j is None else entry.leaves[j].value
+
+    def items(self):
+        return [(leaf.key, leaf.value) for leaf in _iter_leaves(self._root)]
+
+    def values(self):
+        return [leaf.value for leaf in _iter_leaves(self._root)]
+
+    def set(self, key, value):
+        """Get a map with a key set to a value."""
+        root, is_new = _set(self._root, 0, _hash(key), key, value)
+        if root is self._root:
+            return self
+        return PMap(root, self._len + 1 if is_new else self._len)
+
+    def delete(self, key):
+        """Get a map without a key, raising a KeyError if it is absent."""
+        root = _delete(self._root, 0, _hash(key), key)
+        if root is self._root:
+            raise KeyError(key)
+        if root is None:
+            root = _empty_node
+        elif not isinstance(root, _Node):
+            # A lone leaf or collision must still hang from a node.
+            root = _merge_into_empty(root)
+        return PMap(root, self._len - 1)
+
+    def discard(self, key):
+        """Like `delete`, but give back the same map if the key is absent."""
+        try:
+            return self.delete(key)
+        except KeyError:
+            return self
+
+    def update(self, *args, **kwargs):
+        """Get a map with the keys of a mapping, or an iterable of pairs,
+        and keyword arguments, set."""
+        if not self:
+            return pmap(dict(*args, **kwargs))
+        pmap_ = self
+        for key, value in dict(*args, **kwargs).items():
+            pmap_ = pmap_.set(key, value)
+        return pmap_
+
+    def __repr__(self):
+        return f'pmap({dict(self.items())!r})'
+
+    def __reduce__(self):
+        return pmap, (dict(self.items()),)
+
+
+def _merge_into_empty(entry):
+    bit = 1 << (entry.hash & _branch_mask)
+    return _Node(bit, (entry,))
+
+
+_empty_pmap = PMap()
+
+
+def pmap(initial=None):
+    """Make a persistent map, optionally with the contents of a mapping or
+    iterable of pairs."""
+    if isinstance(initial, PMap):
+        return initial
+    if not initial:
+        return _empty_pmap
+    # Building the trie in one go is much quicker than setting each key.
+    leaves = [_Leaf(key, value, _hash(key))
+              for key, value in dict(initial).items()]
+    return PMap(_build(leaves, 0), len(leaves))
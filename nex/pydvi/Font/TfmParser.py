@@ -586,7 +586,7 @@ class TfmParser(object):
         width_index = bytes[0]
         height_index = bytes[1] >> 4
         depth_index = bytes[1] & 0xF
-        italic_index = bytes[2] >> 6
+        italic_index = bytes[2] >> 2
         tag = bytes[2] & 0x3
         remainder = bytes[3]
 
@@ -2,8 +2,8 @@ import os
 from os import path as opath
 import logging
 
-from .utils import (get_unique_id,
-                    ensure_extension, find_file, file_path_to_chars)
+from .utils import get_unique_id, ensure_extension, file_path_to_chars
+from .file_index import FileIndex
 from .tokens import get_position_str, BaseToken, AncestryToken
 from .feedback import drep
 logger = logging.getLogger(__name__)
@@ -104,7 +104,7 @@ class Reader:
     """
     reader_token = BaseToken(type_='root', value=None)
 
-    def __init__(self, search_paths=None):
+    def __init__(self, search_paths=None, file_index=None):
         # This implementation is a bit lazy: there's a big map of hashes to
         # reader buffers, and a stack to hold hashes representing the active
         # buffers. I think the true structure is an ordered tree, but I can't
@@ -113,10 +113,18 @@ class Reader:
         self.active_buffer_hash_stack = []
         self.buffer_map = {}
         self.buffer_token_map = {}
-        # TODO: Avoid multiple entries.
-        self.search_paths = [os.getcwd()]
-        if search_paths is not None:
-            self.search_paths.extend(search_paths)
+        self.search_paths = []
+        self._search_path_set = set()
+        for search_path in [os.getcwd()] + list(search_paths or []):
+            self._add_search_path(search_path)
+        if file_index is None:
+            file_index = FileIndex()
+        self.file_index = file_index
+
+    def _add_search_path(self, search_path):
+        if search_path not in self._search_path_set:
+            self._search_path_set.add(search_path)
+            self.search_paths.append(search_path)
 
     def get_buffer(self, buffer_hash):
         """Access a buffer by its hash."""
@@ -154,10 +162,8 @@ class Reader:
         # Add '.tex' part if necessary.
         file_name = ensure_extension(file_name, 'tex')
         # TODO: This probably doesn't search in the correct path order.
-        file_path = find_file(file_name, search_paths=self.search_paths)
-        file_dir_path = opath.dirname(file_path)
-        if file_dir_path not in self.search_paths:
-            self.search_paths.append(file_dir_path)
+        file_path = self.file_index.find(file_name, self.search_paths)
+        self._add_search_path(opath.dirname(file_path))
         chars = file_path_to_chars(file_path)
         self.insert_chars(chars, name=file_name)
 
@@ -257,6 +263,16 @@ class Reader:
             raise EOFError
         return self.current_buffer.increment_loc()
 
+    def peek_text(self, max_length):
+        """Get up to `max_length` characters after the current position in
+        the current buffer, without changing the reader's position.
+        Unlike `peek_ahead`, this may look far ahead, so the result is only a
+        hint of what is to come: the characters' meanings might change before
+        they are read."""
+        buff = self.current_buffer
+        start = max(buff.i + 1, 0)
+        return ''.join(buff.chars[start:start + max_length])
+
     def advance_loc(self, n=1):
         """Advance the reader's position by `n` places, changing the current
         buffer if necessary, and return the new current character, for
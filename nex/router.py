@@ -13,6 +13,7 @@ from .utils import get_unique_id, LogicError
 from .lexer import (Lexer,
                     control_sequence_lex_type, char_cat_lex_type)
 from .macro import parse_replacement_text, parse_parameter_text
+from .pmap import pmap
 
 
 logger = logging.getLogger(__name__)
@@ -267,13 +268,15 @@ class CSRouter:
                  special_control_sequences,
                  primitive_control_sequences,
                  enclosing_scope=None):
-        self.control_sequences = {}
-        self.macros = {}
-        self.let_chars = {}
-        self.parameters = {}
-        self.specials = {}
-        self.primitives = {}
-        self.font_ids = {}
+        # Persistent maps, so that the router's state can be kept cheaply; see
+        # `GlobalState.snapshot`.
+        self.control_sequences = pmap()
+        self.macros = pmap()
+        self.let_chars = pmap()
+        self.parameters = pmap()
+        self.specials = pmap()
+        self.primitives = pmap()
+        self.font_ids = pmap()
         self.enclosing_scope = enclosing_scope
 
         for name, tpl in param_control_sequences.items():
@@ -365,7 +368,7 @@ class CSRouter:
                                        parameter_text=parameter_text,
                                        def_type=def_type, prefixes=prefixes,
                                        parents=parents)
-        self.macros[route_id] = macro_token
+        self.macros = self.macros.set(route_id, macro_token)
 
     def do_short_hand_definition(self, name, def_type, code,
                                  target_parents, cmd_parents):
@@ -409,7 +412,7 @@ class CSRouter:
         # Make that route resolve to the instruction token.
         token = make_primitive_control_sequence_instruction(
             name=name, instruction=instruction)
-        self.primitives[route_id] = token
+        self.primitives = self.primitives.set(route_id, token)
 
     def _set_parameter(self, name, parameter, instr):
         # Get a route from the name to a parameter.
@@ -418,7 +421,7 @@ class CSRouter:
         # Make that route resolve to the parameter token.
         token = make_parameter_control_sequence_instruction(
             name=name, parameter=parameter, instruction=instr)
-        self.parameters[route_id] = token
+        self.parameters = self.parameters.set(route_id, token)
 
     def _set_special(self, name, special, instr):
         # Get a route from the name to a special.
@@ -427,23 +430,25 @@ class CSRouter:
         # Make that route resolve to the special token.
         token = make_special_control_sequence_instruction(
             name=name, special=special, instruction=instr)
-        self.specials[route_id] = token
+        self.specials = self.specials.set(route_id, token)
 
     def _copy_control_sequence(self, target_name, new_name):
         # Make a new control sequence that is routed to the same spot as the
         # current one.
         target_route_token = self._lookup_route_token(target_name)
-        self.control_sequences[new_name] = target_route_token
+        self.control_sequences = self.control_sequences.set(
+            new_name, target_route_token)
 
     def _set_let_character(self, name, char_cat_token):
         route_id = self._set_route_token(name,
                                          ControlSequenceType.let_character)
-        self.let_chars[route_id] = char_cat_token
+        self.let_chars = self.let_chars.set(route_id, char_cat_token)
 
     def _set_route_token(self, name, cs_type):
         route_id = get_unique_id()
         route_token = RouteToken(cs_type, route_id)
-        self.control_sequences[name] = route_token
+        self.control_sequences = self.control_sequences.set(name,
+                                                            route_token)
         return route_id
 
     def _lookup_route_token(self, name):
@@ -33,6 +33,20 @@ class ScopedAccessor:
     def pop_scope(self):
         self.scopes.pop()
 
+    def snapshot(self):
+        """Get the state of all scopes, to give back to `restore`. A scope's
+        attributes are persistent maps or immutable values, so this is
+        a reference to each of them, and later changes do not affect it."""
+        return tuple((scope, dict(vars(scope))) for scope in self.scopes)
+
+    def restore(self, snapshot):
+        """Go back to the state of a snapshot."""
+        self.scopes = []
+        for scope, attrs in snapshot:
+            vars(scope).clear()
+            vars(scope).update(attrs)
+            self.scopes.append(scope)
+
     @property
     def scope(self):
         return self.scopes[-1]
@@ -238,6 +252,12 @@ class ScopedRouter(ScopedAccessor):
 
 class ScopedParameters(ScopedAccessor):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Incremented whenever a parameter might have changed value, so that
+        # values derived from parameters can be cached until it changes.
+        self.epoch = 0
+
     @classmethod
     def from_defaults(cls):
         return cls(ParametersAccessor.default_initial(),
@@ -246,8 +266,19 @@ class ScopedParameters(ScopedAccessor):
     def get(self, *args, **kwargs):
         return self.try_scope_func_until_success('get', *args, **kwargs)
 
+    def pop_scope(self):
+        super().pop_scope()
+        self.epoch += 1
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        # The epoch is not restored, but moved on, as values may differ from
+        # those cached since the snapshot.
+        self.epoch += 1
+
     def set_parameter(self, is_global, *args, **kwargs):
         self.apply_scope_func(is_global, 'set', *args, **kwargs)
+        self.epoch += 1
 
     def modify_parameter_value(self, is_global, parameter, by_operand,
                                operation):
@@ -15,19 +15,24 @@ from .constants.specials import Specials
 from .constants.codes import CatCode
 from .constants.units import (Unit, MuUnit, InternalUnit,
                               units_in_sp, MAX_DIMEN)
-from .utils import UserError, LogicError, pt_to_sp, InfiniteDimension
+from .utils import (UserError, LogicError, pt_to_sp, InfiniteDimension,
+                    GlueSpec)
 from .router import (make_primitive_control_sequence_instruction,
                      make_unexpanded_control_sequence_instruction)
-from .accessors import is_register_type, SpecialsAccessor
+from .accessors import (is_register_type, SpecialsAccessor,
+                        get_date_and_time_values)
 from . import box
 from .box import (HBox, VBox, Rule, Glue, Character, FontDefinition,
-                  FontSelection, Kern, Penalty)
-from .paragraphs import get_best_h_lists
+                  FontSelection, Kern, Penalty, DiscretionaryBreak)
+from .paragraphs import (get_best_h_lists, is_feasible_route,
+                         expand_discretionaries)
+from .hyphenation import Hyphenator
 from . import evaluator as evaler
-from .fonts import GlobalFontState
+from .fonts import GlobalFontState, KernStep
 from .scopes import (ScopedCodes, ScopedRegisters, ScopedRouter,
                      ScopedParameters, ScopedFontState, Operation)
 from .tokens import BuiltToken, InstructionToken
+from .format_file import read_format
 
 logger = logging.getLogger(__name__)
 
@@ -190,7 +195,8 @@ class GlobalState:
 
     def __init__(self, global_font_state,
                  specials,
-                 codes, registers, scoped_font_state, router, parameters):
+                 codes, registers, scoped_font_state, router, parameters,
+                 page_sink=None):
         self.global_font_state = global_font_state
         self.specials = specials
 
@@ -199,6 +205,15 @@ class GlobalState:
         self.scoped_font_state = scoped_font_state
         self.router = router
         self.parameters = parameters
+        # The current font ID and font, cached until the font is selected or
+        # a scope ends.
+        self._current_font = None
+        # Interword glue dimensions, and the parameter epoch they are valid
+        # for.
+        self._space_glue_cache = {}
+        self._space_glue_epoch = None
+
+        self.hyphenator = Hyphenator()
 
         # At the beginning, TeX is in vertical mode, ready to construct pages.
         self.modes = []
@@ -207,10 +222,18 @@ class GlobalState:
         self.push_group(Group.outside)
 
         self.current_page = []
+        # Something to give each page to as soon as it is completed: an
+        # object with methods `ship_out(state, page)` and `close(state)`,
+        # such as `box_writer.DVIPageSink`. Without one, pages are kept in
+        # `completed_pages`.
+        self.page_sink = page_sink
         self.completed_pages = []
         self.start_new_page()
 
         self.after_assignment_token = None
+        # Whether the job was ended by \dump, so that whoever runs it
+        # should write a format file.
+        self.dump_requested = False
 
         self.command_to_method_map = {
             Commands.assign: self.tok_assign,
@@ -274,11 +297,16 @@ class GlobalState:
         }
 
     @classmethod
-    def from_defaults(cls, font_search_paths=None, global_font_state=None):
+    def from_defaults(cls, font_search_paths=None, global_font_state=None,
+                      font_cache_dir=None, file_index=None,
+                      mmap_font_metrics=False, page_sink=None):
         # We allow passing this in for testing purposes, because it touches the
         # outside world (the file system, to search for fonts).
         if global_font_state is None:
-            global_font_state = GlobalFontState(font_search_paths)
+            global_font_state = GlobalFontState(font_search_paths,
+                                                cache_dir=font_cache_dir,
+                                                file_index=file_index,
+                                                use_mmap=mmap_font_metrics)
         specials = SpecialsAccessor.from_defaults()
         codes = ScopedCodes.from_defaults()
         registers = ScopedRegisters.from_defaults()
@@ -286,7 +314,91 @@ class GlobalState:
         router = ScopedRouter.from_defaults()
         parameters = ScopedParameters.from_defaults()
         return cls(global_font_state, specials,
-                   codes, registers, scoped_font_state, router, parameters)
+                   codes, registers, scoped_font_state, router, parameters,
+                   page_sink=page_sink)
+
+    @classmethod
+    def from_format(cls, format_path, font_search_paths=None,
+                    global_font_state=None, font_cache_dir=None,
+                    file_index=None, mmap_font_metrics=False,
+                    page_sink=None):
+        """Make a state from a format file written by \\dump, rather than
+        from defaults."""
+        dump = read_format(format_path)
+        if global_font_state is None:
+            global_font_state = GlobalFontState(font_search_paths,
+                                                cache_dir=font_cache_dir,
+                                                file_index=file_index,
+                                                use_mmap=mmap_font_metrics)
+        global_font_state.restore_fonts(dump['fonts'])
+        state = cls(global_font_state, dump['specials'],
+                    dump['codes'], dump['registers'],
+                    dump['scoped_font_state'], dump['router'],
+                    dump['parameters'],
+                    page_sink=page_sink)
+        state.hyphenator = dump['hyphenator']
+        # As in TeX, the date and time are those of the run, not the dump.
+        for parameter, value in get_date_and_time_values().items():
+            state.parameters.set_parameter(True, parameter, value)
+        return state
+
+    # Snapshots.
+
+    def snapshot(self):
+        """Get the interpreter's state, to give back to `restore`.
+
+        Definitions, codes, registers, parameters and font state live in
+        persistent maps, so taking them costs nothing. The modes' lists,
+        group queues and current page are copied, which costs time in their
+        length. So are the fonts' hyphen and skew characters, which costs
+        time in the number of fonts. Fonts loaded since a snapshot stay
+        loaded on restore, as they are only ever added to, and font IDs are
+        never reused. Pages that were given to a page sink cannot be taken
+        back."""
+        return {
+            'codes': self.codes.snapshot(),
+            'registers': self.registers.snapshot(),
+            'scoped_font_state': self.scoped_font_state.snapshot(),
+            'router': self.router.snapshot(),
+            'parameters': self.parameters.snapshot(),
+            'specials': self.specials.names_to_values,
+            'hyphenator': self.hyphenator.snapshot(),
+            'font_chars': self.global_font_state.snapshot_font_chars(),
+            'modes': [(mode, deque(layout_list))
+                      for mode, layout_list in self.modes],
+            'groups': [(group, deque(after_group_queue))
+                       for group, after_group_queue in self.groups],
+            'current_page': list(self.current_page),
+            'completed_pages': list(self.completed_pages),
+            'best_page_break_so_far': self.best_page_break_so_far,
+            'best_page_break_cost_so_far': self.best_page_break_cost_so_far,
+            'seen_box_or_insertion': self.seen_box_or_insertion,
+            'seen_box': self.seen_box,
+            'after_assignment_token': self.after_assignment_token,
+        }
+
+    def restore(self, snapshot):
+        """Go back to the state of a snapshot. A snapshot may be restored any
+        number of times."""
+        for name in ('codes', 'registers', 'scoped_font_state', 'router',
+                     'parameters'):
+            getattr(self, name).restore(snapshot[name])
+        self.specials.names_to_values = snapshot['specials']
+        self.hyphenator.restore(snapshot['hyphenator'])
+        self.global_font_state.restore_font_chars(snapshot['font_chars'])
+        # Copy the lists again, so the snapshot stays as it was.
+        self.modes = [(mode, deque(layout_list))
+                      for mode, layout_list in snapshot['modes']]
+        self.groups = [(group, deque(after_group_queue))
+                       for group, after_group_queue in snapshot['groups']]
+        self.current_page = list(snapshot['current_page'])
+        self.completed_pages = list(snapshot['completed_pages'])
+        for name in ('best_page_break_so_far', 'best_page_break_cost_so_far',
+                     'seen_box_or_insertion', 'seen_box',
+                     'after_assignment_token'):
+            setattr(self, name, snapshot[name])
+        self._current_font = None
+        self._space_glue_epoch = None
 
     # Mode.
 
@@ -356,7 +468,7 @@ class GlobalState:
             if isinstance(item, (HBox, VBox, Rule)):
                 self.specials.set(Specials.space_factor, 1000)
             elif isinstance(item, (FontDefinition, FontSelection,
-                                   Glue, Kern, Penalty)):
+                                   Glue, Kern, Penalty, DiscretionaryBreak)):
                 pass
             # TODO: Ligatures? TeXbook page 76
             # "When ligatures are formed, or when a special character is
@@ -421,7 +533,7 @@ class GlobalState:
                 el = self.parameters.get(Parameters.line_skip_limit)
                 # "and \baselineskip = b plus y minus z."
                 b_skip = self.parameters.get(Parameters.base_line_skip)
-                b, y, z = b_skip['dimen'], b_skip['stretch'], b_skip['shrink']
+                b, y, z = b_skip
                 # "If p <= -1000pt, no interline glue is added."
                 base_dimen = b - p - h
                 if p <= pt_to_sp(-1000):
@@ -434,7 +546,7 @@ class GlobalState:
                 # "Otherwise the \lineskip glue will be appended."
                 else:
                     line_skip = self.parameters.get(Parameters.line_skip)
-                    g = Glue(**line_skip)
+                    g = Glue(*line_skip)
                     self._layout_list.append(g)
                 self._layout_list.append(item)
                 # "Finally, \prevdepth is set to the depth of the new box."
@@ -547,10 +659,23 @@ class GlobalState:
                                                       self.current_page[i_break:])
                     completed_box = box.VBox(completed_page, to=page_goal,
                                              set_glue=True)
-                    self.completed_pages.append(completed_box)
+                    self.ship_out(completed_box)
                     self._layout_list.extendleft(reversed(remainder_page))
                     self.start_new_page()
 
+    def ship_out(self, page):
+        """Send a completed page to the page sink, if any, which takes it
+        away, or otherwise keep it."""
+        if self.page_sink is None:
+            self.completed_pages.append(page)
+        else:
+            self.page_sink.ship_out(self, page)
+
+    def close_page_sink(self):
+        """Tell the page sink, if any, that no more pages will come."""
+        if self.page_sink is not None:
+            self.page_sink.close(self)
+
     def extend_list(self, items):
         for item in items:
             self.append_to_list(item)
@@ -590,6 +715,8 @@ class GlobalState:
     def pop_scope(self):
         for acc in self._scoped_accessors:
             acc.pop_scope()
+        # The current font may have been local to the scope.
+        self._current_font = None
         if self.current_font_id != GlobalFontState.null_font_id:
             self._select_font(is_global=False, font_id=self.current_font_id)
 
@@ -614,13 +741,19 @@ class GlobalState:
         self.append_to_list(font_define_item)
         return new_font_id
 
+    def _cache_current_font(self):
+        font_id = self.scoped_font_state.current_font_id
+        font_info = self.global_font_state.get_font(font_id)
+        self._current_font = (font_id, font_info)
+        return self._current_font
+
     @property
     def current_font_id(self):
-        return self.scoped_font_state.current_font_id
+        return (self._current_font or self._cache_current_font())[0]
 
     @property
     def current_font(self):
-        return self.global_font_state.get_font(self.current_font_id)
+        return (self._current_font or self._cache_current_font())[1]
 
     # Evaluate quantities.
 
@@ -755,36 +888,202 @@ class GlobalState:
             self.do_un_skip()
             # Do \hskip\parfillskip.
             par_fill_glue = self.parameters.get(Parameters.par_fill_skip)
-            self.add_h_glue(**par_fill_glue)
+            self.add_h_glue(*par_fill_glue)
             line_penalty = self.parameters.get(Parameters.line_penalty)
             self.add_penalty(line_penalty)
             # Get the horizontal list
-            horizontal_list = deque(self.pop_mode())
+            horizontal_list = list(self.pop_mode())
             h_size = self.parameters.get(Parameters.h_size)
-            # TODO: This is temporary; not correct
-            tolerance = self.parameters.get(Parameters.tolerance)
 
-            # It's a deque for some reason I haven't sussed.
-            h_lists = get_best_h_lists(list(horizontal_list),
-                                       h_size, tolerance, line_penalty)
+            # TeXbook page 96: "TeX first tries to break the paragraph into
+            # lines without hyphenating any words. This first pass succeeds if
+            # it is possible to find breakpoints such that the badness of each
+            # line is at most \pretolerance. [...] If the first pass fails,
+            # TeX tries again, this time hyphenating words and using
+            # \tolerance instead of \pretolerance."
+            # Setting \pretolerance to -1 skips the first pass.
+            h_lists = None
+            pre_tolerance = self.parameters.get(Parameters.pre_tolerance)
+            if pre_tolerance >= 0:
+                h_lists = get_best_h_lists(horizontal_list, h_size,
+                                           pre_tolerance, line_penalty)
+                if not is_feasible_route(h_lists, h_size, pre_tolerance):
+                    h_lists = None
+            if h_lists is None:
+                tolerance = self.parameters.get(Parameters.tolerance)
+                horizontal_list = self._hyphenate_h_list(horizontal_list)
+                h_lists = get_best_h_lists(horizontal_list,
+                                           h_size, tolerance, line_penalty)
 
-            # for best_route in all_routes:
             for h_list in h_lists:
-                h_box = HBox(h_list, to=h_size)
+                h_box = HBox(expand_discretionaries(h_list), to=h_size)
                 # Add it to the enclosing vertical list.
                 self.append_to_list(h_box)
         else:
             raise NotImplementedError
 
     def _get_character_item(self, code):
-        return Character(code,
-                         width=self.current_font.width(code),
-                         height=self.current_font.height(code),
-                         depth=self.current_font.depth(code))
+        return self.global_font_state.get_character(self.current_font_id,
+                                                    code)
+
+    # Hyphenation.
+
+    def _get_hyphen_character(self, font_id):
+        hyphen_code = self.global_font_state.get_font(font_id).hyphen_char
+        if hyphen_code is None:
+            hyphen_code = self.parameters.get(Parameters.default_hyphen_char)
+        # TeXbook page 454: "If the hyphen character is not in the range
+        # 0-255, or if it is not in the font, no hyphenation is done."
+        if not 0 <= hyphen_code <= 255:
+            return None
+        try:
+            return self.global_font_state.get_character(font_id, hyphen_code)
+        except KeyError:
+            return None
+
+    def _get_lower_case_letter(self, item):
+        """Get the lower-case form of a character item, if it is a
+        letter."""
+        if not (isinstance(item, Character) and 0 <= item.code <= 127):
+            return None
+        lower = self.codes.get_lower_case_code(chr(item.code))
+        if lower == chr(0):
+            return None
+        return lower
+
+    def _hyphenate_h_list(self, h_list):
+        """Insert discretionary hyphens into the words of a horizontal list,
+        as found by the current hyphenation patterns and exceptions."""
+        # TeXbook page 454-455, roughly: a word starts at the first letter
+        # after glue, and continues over letters in the same font, and
+        # kerns between them.
+        if not (self.hyphenator.patterns or self.hyphenator.exceptions):
+            return h_list
+        left_min = max(self.parameters.get(Parameters.left_hyphen_min), 1)
+        right_min = max(self.parameters.get(Parameters.right_hyphen_min), 1)
+        uc_hyph = self.parameters.get(Parameters.uc_hyph)
+        hyphen_penalty = self.parameters.get(Parameters.hyphen_penalty)
+        hyphenated = []
+        i = 0
+        n = len(h_list)
+        while i < n:
+            item = h_list[i]
+            hyphenated.append(item)
+            i += 1
+            if not isinstance(item, Glue):
+                continue
+            # Skip to the first letter.
+            while i < n and isinstance(h_list[i], Character):
+                if self._get_lower_case_letter(h_list[i]) is not None:
+                    break
+                hyphenated.append(h_list[i])
+                i += 1
+            # Gather the word, noting the index of each letter.
+            letters = []
+            letter_indices = []
+            j = i
+            while j < n:
+                letter_item = h_list[j]
+                lower = self._get_lower_case_letter(letter_item)
+                if lower is not None:
+                    if (letters and letter_item.font_id
+                            != h_list[letter_indices[0]].font_id):
+                        break
+                    letters.append(lower)
+                    letter_indices.append(j)
+                elif not isinstance(letter_item, Kern):
+                    break
+                j += 1
+            if not letters:
+                continue
+            word = ''.join(letters)
+            # The word may start after kerns, so look at its first letter.
+            first_letter = h_list[letter_indices[0]]
+            first_is_upper = chr(first_letter.code) != word[0]
+            hyphen_item = self._get_hyphen_character(first_letter.font_id)
+            if hyphen_item is None or (first_is_upper and uc_hyph <= 0):
+                positions = ()
+            else:
+                positions = self.hyphenator.hyphenate(word, left_min,
+                                                      right_min)
+            # Add the word, with discretionary hyphens after the letters
+            # before which a hyphen may go.
+            break_after = {letter_indices[p - 1] for p in positions}
+            end = letter_indices[-1] + 1
+            for k in range(i, end):
+                hyphenated.append(h_list[k])
+                if k in break_after:
+                    hyphenated.append(DiscretionaryBreak(
+                        pre_break=[hyphen_item], post_break=[], no_break=[],
+                        penalty=hyphen_penalty))
+            i = end
+        return hyphenated
+
+    @after_assignment
+    def add_hyphenation_patterns(self, token_source, patterns):
+        logger.info(f'Adding {len(patterns)} hyphenation patterns')
+        self.hyphenator.add_patterns(patterns)
+
+    @after_assignment
+    def add_hyphenation_exceptions(self, token_source, words):
+        logger.info(f'Adding {len(words)} hyphenation exceptions')
+        self.hyphenator.add_exceptions(words)
+
+    def _lig_kern_left_character(self, right):
+        """Get the character that a lig/kern program should consider to the
+        left of a character, if any."""
+        if not self._layout_list:
+            return None
+        left = self._layout_list[-1]
+        if isinstance(left, Character) and left.font_id == right.font_id:
+            return left
+        return None
+
+    def _add_character_item(self, item):
+        """Add a character to the list, applying the current font's kerns
+        and ligatures between it and the preceding character."""
+        lig_kern_table = self.current_font.lig_kern_table
+        # Characters to add, and whether to consider their left neighbours.
+        pending = deque([(item, True)])
+        while pending:
+            right, check_left = pending.popleft()
+            step = None
+            if check_left:
+                left = self._lig_kern_left_character(right)
+                if left is not None:
+                    step = lig_kern_table.get((left.code, right.code))
+            if step is None:
+                self.append_to_list(right)
+            elif isinstance(step, KernStep):
+                self.append_to_list(Kern(step.kern))
+                self.append_to_list(right)
+            else:
+                # The ligature character is inserted between the current
+                # character and the next. Then the current character is
+                # deleted unless we should keep it, and the same for the next
+                # character. Then we pass over some characters to reach the
+                # new current character.
+                lig_item = self._get_character_item(step.char_code)
+                if not step.keep_current:
+                    self._layout_list.pop()
+                sequence = [lig_item]
+                if step.keep_next:
+                    sequence.append(right)
+                nr_to_pass_over = step.nr_to_pass_over
+                if step.keep_current:
+                    # The current character is already on the list.
+                    nr_to_pass_over -= 1
+                # Characters passed over are added without their left
+                # neighbours being considered. The rest might combine with
+                # whatever is to their left.
+                for c in sequence[:nr_to_pass_over + 1]:
+                    self.append_to_list(c)
+                to_check = sequence[nr_to_pass_over + 1:]
+                pending.extendleft((c, True) for c in reversed(to_check))
 
     @check_not_vertical
     def add_character_code(self, code):
-        self.append_to_list(self._get_character_item(code))
+        self._add_character_item(self._get_character_item(code))
 
     def add_character_char(self, char):
         return self.add_character_code(ord(char))
@@ -920,6 +1219,50 @@ class GlobalState:
     def add_v_neg_fil_glue(self):
         return self._add_neg_fil_glue()
 
+    def _compute_space_glue(self, f):
+        extra_space_skip = self.parameters.get(Parameters.x_space_skip)
+        space_skip = self.parameters.get(Parameters.space_skip)
+        if f > 2000 and extra_space_skip.dimen != 0:
+            dimen, stretch, shrink = extra_space_skip
+        elif space_skip.dimen != 0:
+            dimen, stretch, shrink = extra_space_skip
+
+            stretch *= round(f / 1000)
+            shrink *= round(1000 / f)
+        else:
+            dimen = self.current_font.spacing
+            stretch = self.current_font.space_stretch
+            shrink = self.current_font.space_shrink
+            if f > 2000:
+                dimen += self.current_font.extra_space
+
+            stretch *= round(f / 1000)
+            shrink *= round(1000 / f)
+
+        return dimen, stretch, shrink
+
+    def _get_space_glue(self):
+        """Get the interword glue dimensions for the current state.
+
+        These only depend on the current font, the space factor, and the
+        \\spaceskip and \\xspaceskip parameters, so are cached per font and
+        space factor, until any parameter changes.
+        """
+        f = self.specials.get(Specials.space_factor)
+        epoch = self.parameters.epoch
+        if epoch != self._space_glue_epoch:
+            self._space_glue_cache.clear()
+            self._space_glue_epoch = epoch
+        # The glue only depends on the space factor through these quantities.
+        key = (self.current_font_id, f > 2000, round(f / 1000),
+               round(1000 / f))
+        try:
+            return self._space_glue_cache[key]
+        except KeyError:
+            space_glue = self._compute_space_glue(f)
+            self._space_glue_cache[key] = space_glue
+            return space_glue
+
     def do_space(self):
         if self.mode in vertical_modes:
             # "Spaces have no effects in vertical modes".
@@ -946,32 +1289,7 @@ class GlobalState:
             # multiplied by f / 1000 and 1000 / f. For example, the
             # \raggedright macro of plain TeX\ uses \spaceskip and \xspaceskip
             # to suppress all stretching and shrinking of interword spaces.
-            extra_space_skip = self.parameters.get(Parameters.x_space_skip)
-            space_skip = self.parameters.get(Parameters.space_skip)
-            f = self.specials.get(Specials.space_factor)
-
-            if f > 2000 and extra_space_skip['dimen'] != 0:
-                dimen = extra_space_skip['dimen']
-                stretch = extra_space_skip['stretch']
-                shrink = extra_space_skip['shrink']
-            elif space_skip['dimen'] != 0:
-                dimen = extra_space_skip['dimen']
-                stretch = extra_space_skip['stretch']
-                shrink = extra_space_skip['shrink']
-
-                stretch *= round(f / 1000)
-                shrink *= round(1000 / f)
-            else:
-                dimen = self.current_font.spacing
-                stretch = self.current_font.space_stretch
-                shrink = self.current_font.space_shrink
-                if f > 2000:
-                    dimen += self.current_font.extra_space
-
-                stretch *= round(f / 1000)
-                shrink *= round(1000 / f)
-
-            space_glue_item = Glue(dimen, stretch, shrink)
+            space_glue_item = Glue(*self._get_space_glue())
             self.append_to_list(space_glue_item)
         else:
             raise NotImplementedError
@@ -1020,7 +1338,7 @@ class GlobalState:
             # input. The page builder is exercised."
             if self.mode != Mode.internal_vertical:
                 par_skip_glue = self.parameters.get(Parameters.par_skip)
-                par_skip_glue_item = Glue(**par_skip_glue)
+                par_skip_glue_item = Glue(*par_skip_glue)
                 self.append_to_list(par_skip_glue_item)
             self.push_mode(Mode.horizontal)
             # An empty box of width \parindent is appended to the current
@@ -1036,10 +1354,14 @@ class GlobalState:
 
     def get_register_box(self, i, copy):
         if copy:
-            get_func = self.registers.get
+            box_item = self.registers.get(Instructions.set_box.value, i)
+            # The copy shares the stored box's contents until one of them
+            # changes, so copying a big box is cheap.
+            if box_item is not None:
+                box_item = box_item.copy()
+            return box_item
         else:
-            get_func = self.registers.pop
-        return get_func(Instructions.set_box.value, i)
+            return self.registers.pop(Instructions.set_box.value, i)
 
     def get_unboxed_register_box(self, i, copy, horizontal):
         # See TeXbook page 120.
@@ -1073,9 +1395,8 @@ class GlobalState:
         # This makes \box6 five percent wider than \box5; the glue between A
         # and \hbox{B C} stretches to make the difference, but the glue inside
         # the inner hbox does not change.
-        for item in unwrapped_box_contents:
-            if isinstance(item, Glue):
-                item.unset()
+        # Glue lengths are kept by the box that sets them, not by the glue,
+        # so the glue is un-set just by taking it out of the box.
         return unwrapped_box_contents
 
     @check_not_vertical
@@ -1236,6 +1557,7 @@ class GlobalState:
 
     def _select_font(self, is_global, font_id):
         self.scoped_font_state.set_current_font(is_global, font_id)
+        self._current_font = None
         font_select_item = FontSelection(font_nr=font_id)
         # Commands like font commands aren't exactly boxes, but they go through
         # as DVI commands. Just put them in the box for now to deal with later.
@@ -1409,29 +1731,20 @@ class GlobalState:
             size_token = number_value['size']
             size = self.eval_size_token(size_token)
             sign = evaler.evaluate_signs(number_value['signs'])
-            if isinstance(size, InfiniteDimension):
-                size.factor *= sign
-            else:
-                size *= sign
-            return size
+            return size * sign
         else:
             raise ValueError
 
-    def eval_glue_token(self, glue_token) -> dict:
+    def eval_glue_token(self, glue_token) -> GlueSpec:
         v = glue_token.value
         if isinstance(v, BuiltToken) and v.type == 'explicit':
             # Should contain a dict specifying three dimens (in the general sense
             # of 'physical length'), a 'dimen' (in the narrow sense), 'shrink' and
             # 'stretch'.
             dimens = v.value
-            evaluated_glue = {}
-            for dimen_name, dimen_tok in dimens.items():
-                if dimen_tok is None:
-                    evaluated_dimen = None
-                else:
-                    evaluated_dimen = self.eval_number_token(dimen_tok)
-                evaluated_glue[dimen_name] = evaluated_dimen
-            return evaluated_glue
+            return GlueSpec(**{dimen_name: self.eval_number_token(dimen_tok)
+                               for dimen_name, dimen_tok in dimens.items()
+                               if dimen_tok is not None})
         # If the size is the contents of a glue or mu glue register.
         elif isinstance(v, BuiltToken) and v.type in (Instructions.skip.value,
                                                       Instructions.mu_skip.value):
@@ -1591,7 +1904,12 @@ class GlobalState:
         elif assign_type == 'advance':
             variable, value = v['variable'], v['value']
             # See 'variable_assignment' case.
-            evaled_value = self.eval_number_token(value)
+            value_evaluate_map = {
+                'number': self.eval_number_token,
+                'dimen': self.eval_number_token,
+                'glue': self.eval_glue_token,
+            }
+            evaled_value = value_evaluate_map[value.type](value)
             kwargs = {'is_global': v['global'],
                       'by_operand': evaled_value,
                       'operation': Operation.advance}
@@ -1607,7 +1925,7 @@ class GlobalState:
                 parameter = variable.value['parameter']
                 self.modify_parameter(
                     token_source=banisher,
-                    name=parameter,
+                    parameter=parameter,
                     **kwargs
                 )
             else:
@@ -1632,9 +1950,13 @@ class GlobalState:
         elif assign_type == 'font_selection':
             self.select_font(banisher, v['global'], v['font_id'])
         elif assign_type == 'font_definition':
+            at_clause = v['at_clause']
+            if at_clause is not None:
+                at_clause = (at_clause.type,
+                             self.eval_number_token(at_clause.value))
             self.define_new_font(
                 banisher,
-                v['file_name'].value, v['at_clause'],
+                v['file_name'].value, at_clause,
                 v['control_sequence_name'], v['global'],
                 cmd_parents=[cmd_value],
                 target_parents=[v['file_name'], v['at_clause']],
@@ -1660,12 +1982,13 @@ class GlobalState:
                 self.set_hyphen_char(banisher, font_id, code_eval)
             else:
                 raise ValueError(f'Unknown font assignment type: {assign_type}')
-        # TODO: implement this, and mark method with 'assignment' decorator.
-        elif assign_type == Instructions.hyphenation.value:
-            raise NotImplementedError
-        # TODO: implement this, and mark method with 'assignment' decorator.
-        elif assign_type == Instructions.patterns.value:
-            raise NotImplementedError
+        elif assign_type in (Instructions.hyphenation.value,
+                             Instructions.patterns.value):
+            text = ''.join(t.value['char'] for t in v['content'].value)
+            if assign_type == Instructions.hyphenation.value:
+                self.add_hyphenation_exceptions(banisher, text.split())
+            else:
+                self.add_hyphenation_patterns(banisher, text.split())
         # TODO: implement this, and mark method with 'assignment' decorator.
         elif assign_type == 'box_size_assignment':
             raise NotImplementedError
@@ -1837,7 +2160,7 @@ class GlobalState:
         glue_type = cmd_value.type
         if glue_type == Instructions.h_skip.value:
             glue = self.eval_glue_token(cmd_value)
-            self.add_h_glue(**glue)
+            self.add_h_glue(*glue)
         elif glue_type == Instructions.h_stretch_or_shrink.value:
             self.add_h_stretch_or_shrink_glue()
         elif glue_type == Instructions.h_fil.value:
@@ -1848,7 +2171,7 @@ class GlobalState:
             self.add_h_neg_fil_glue()
         elif glue_type == Instructions.v_skip.value:
             glue = self.eval_glue_token(cmd_value)
-            self.add_v_glue(**glue)
+            self.add_v_glue(*glue)
         elif glue_type == Instructions.v_stretch_or_shrink.value:
             self.add_v_stretch_or_shrink_glue()
         elif glue_type == Instructions.v_fil.value:
@@ -1889,7 +2212,11 @@ class GlobalState:
         self.do_end()
 
     def tok_dump(self, cmd_value, banisher):
-        raise NotImplementedError
+        # A format file holds only global definitions.
+        if self.group != Group.outside:
+            raise UserError("Cannot \\dump inside a group")
+        self.dump_requested = True
+        self.do_end()
 
     def tok_add_control_space(self, cmd_value, banisher):
         raise NotImplementedError
@@ -1923,8 +2250,23 @@ class GlobalState:
     def tok_add_discretionary(self, cmd_value, banisher):
         raise NotImplementedError
 
+    @check_not_vertical
+    def add_discretionary_hyphen(self):
+        # TeXbook page 95: "\- is equivalent to
+        # \discretionary{-}{}{}", where the '-' is the hyphen character of
+        # the current font.
+        hyphen_item = self._get_hyphen_character(self.current_font_id)
+        pre_break = [] if hyphen_item is None else [hyphen_item]
+        if pre_break:
+            penalty = self.parameters.get(Parameters.hyphen_penalty)
+        else:
+            penalty = self.parameters.get(Parameters.ex_hyphen_penalty)
+        self.append_to_list(DiscretionaryBreak(pre_break=pre_break,
+                                               post_break=[], no_break=[],
+                                               penalty=penalty))
+
     def tok_add_discretionary_hyphen(self, cmd_value, banisher):
-        raise NotImplementedError
+        self.add_discretionary_hyphen()
 
     def tok_do_math_shift(self, cmd_value, banisher):
         raise NotImplementedError
@@ -2,6 +2,8 @@ import os
 from os import path as opath
 import base64
 import uuid
+from collections import namedtuple
+from functools import total_ordering
 
 from .pydvi.TeXUnit import pt2sp, sp2pt
 
@@ -31,11 +33,89 @@ def get_default_font_paths():
     ]
 
 
+def _dimen_order_and_factor(d):
+    # As in TeX, a zero infinity has order zero.
+    if isinstance(d, InfiniteDimension) and d.factor != 0:
+        return d.nr_fils, d.factor
+    return 0, getattr(d, 'factor', d)
+
+
+@total_ordering
 class InfiniteDimension:
+    """A dimension of some order of infinity: `factor` fil, fill or filll for
+    `nr_fils` of one, two or three. Values are immutable and hashable, and
+    support the arithmetic TeX does on stretch and shrink components, mixed
+    with plain integer dimensions, which are of order zero."""
+
+    __slots__ = ('factor', 'nr_fils')
 
     def __init__(self, factor, nr_fils):
-        self.factor = factor
-        self.nr_fils = nr_fils
+        object.__setattr__(self, 'factor', factor)
+        object.__setattr__(self, 'nr_fils', nr_fils)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('InfiniteDimension is immutable')
+
+    def __repr__(self):
+        return f'InfiniteDimension({self.factor!r}, {self.nr_fils!r})'
+
+    def __reduce__(self):
+        return self.__class__, (self.factor, self.nr_fils)
+
+    def __eq__(self, other):
+        # A zero of any order is zero.
+        return _dimen_order_and_factor(self) == _dimen_order_and_factor(other)
+
+    def __hash__(self):
+        if self.factor == 0:
+            return hash(0)
+        return hash((self.factor, self.nr_fils))
+
+    def _sort_key(self):
+        # Any positive infinity is bigger than any finite dimension, and any
+        # negative infinity is smaller.
+        if self.factor > 0:
+            return self.nr_fils, self.factor
+        elif self.factor < 0:
+            return -self.nr_fils, self.factor
+        return 0, 0
+
+    def __lt__(self, other):
+        if not isinstance(other, InfiniteDimension):
+            other = InfiniteDimension(other, 0)
+        return self._sort_key() < other._sort_key()
+
+    def __add__(self, other):
+        # "If the orders differ, the sum has the higher order", with TeX's
+        # glue arithmetic; an infinity that cancels out leaves order zero.
+        order, factor = _dimen_order_and_factor(other)
+        self_order, self_factor = _dimen_order_and_factor(self)
+        if order > self_order:
+            return other
+        elif order < self_order:
+            return self
+        factor += self_factor
+        if factor == 0 or order == 0:
+            return factor
+        return InfiniteDimension(factor, order)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return InfiniteDimension(-self.factor, self.nr_fils)
+
+    def __sub__(self, other):
+        return self + -other
+
+    def __rsub__(self, other):
+        return -self + other
+
+    def __mul__(self, other):
+        if not isinstance(other, (int, float)):
+            return NotImplemented
+        return InfiniteDimension(self.factor * other, self.nr_fils)
+
+    __rmul__ = __mul__
 
 
 def sum_infinities(ds):
@@ -47,11 +127,48 @@ def sum_infinities(ds):
             order = d.nr_fils
             # Extend order sum list with zeros to accommodate this infinity.
             new_length_needed = order + 1 - len(order_sums)
-            order_sums.extend(0 for _ in range(new_length_needed))
+            if new_length_needed > 0:
+                order_sums.extend(0 for _ in range(new_length_needed))
             order_sums[order] += d.factor
     return order_sums
 
 
+class GlueSpec(namedtuple('GlueSpec', ('dimen', 'stretch', 'shrink'))):
+    """The value of a glue parameter or register: a natural dimension, and
+    stretch and shrink components, each either an integer dimension or an
+    `InfiniteDimension`. Specs are immutable, so one can be shared by every
+    scope and piece of glue that uses it."""
+
+    __slots__ = ()
+
+    def __new__(cls, dimen=0, stretch=0, shrink=0):
+        return super().__new__(cls, dimen, stretch, shrink)
+
+    def __add__(self, other):
+        if not isinstance(other, GlueSpec):
+            return NotImplemented
+        return GlueSpec(self.dimen + other.dimen,
+                        self.stretch + other.stretch,
+                        self.shrink + other.shrink)
+
+    def __neg__(self):
+        return GlueSpec(-self.dimen, -self.stretch, -self.shrink)
+
+    def __sub__(self, other):
+        return self + -other
+
+    def __mul__(self, other):
+        if not isinstance(other, (int, float)):
+            return NotImplemented
+        return GlueSpec(self.dimen * other, self.stretch * other,
+                        self.shrink * other)
+
+    __rmul__ = __mul__
+
+
+zero_glue = GlueSpec(0, 0, 0)
+
+
 def ensure_extension(path, extension):
     """Add a file extension if it is not already present."""
     end = opath.extsep + extension
@@ -60,23 +177,6 @@ def ensure_extension(path, extension):
     return path
 
 
-def find_file(file_name, search_paths=None):
-    """Resolve a file name or path to an absolute path, optionally searching a
-    sequence of directories."""
-    # If file_name is already a full path, just use that.
-    supplied_dirname = opath.dirname(file_name)
-    if supplied_dirname != '':
-        return file_name
-    # Otherwise, search some directories for the file name.
-    if search_paths is None:
-        search_paths = []
-    for search_path in search_paths:
-        test_path = opath.join(search_path, file_name)
-        if opath.exists(test_path):
-            return opath.abspath(test_path)
-    raise FileNotFoundError
-
-
 def file_path_to_chars(file_path):
     """Return the characters in a file at the given path."""
     with open(file_path, 'rb') as f:
@@ -0,0 +1,140 @@
+"""
+A zygote: a process that sets up once, then forks a child for each job.
+
+Starting a job means importing modules, building parsers and routers, and
+reading a preamble, which often takes longer than the document itself. A
+zygote does all that once, then listens on a Unix socket. For each request
+it forks a child, which inherits the prepared state, font metrics and parser
+tables through copy-on-write memory. The child runs the job, sends back a
+response, and exits, leaving the zygote's state as it was.
+
+Requests and responses are JSON objects, each sent as one line. Jobs are sent
+with `nex-connect`, which only needs the standard library, so that it starts
+quickly.
+"""
+import argparse
+import json
+import logging
+import os
+from os import path as opath
+import signal
+import socket
+import sys
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+def _send_message(conn, message):
+    conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def _receive_message(conn):
+    with conn.makefile('rb') as f:
+        line = f.readline()
+    if not line:
+        raise EOFError('Connection closed before a message was received')
+    return json.loads(line.decode('utf-8'))
+
+
+def _run_child(conn, run_request):
+    """Handle a request in a forked child, then exit."""
+    status = 1
+    try:
+        # The zygote ignores its children's exits, but the child must wait
+        # for its own, such as DVI workers.
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        # Jobs run unattended, so reading from the terminal ends them.
+        sys.stdin = open(os.devnull)
+        try:
+            response = run_request(_receive_message(conn))
+            response['error'] = None
+            status = 0
+        except BaseException:
+            response = {'error': traceback.format_exc()}
+        _send_message(conn, response)
+        conn.close()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Leave without running the zygote's clean-up code.
+        os._exit(status)
+
+
+def serve(socket_path, run_request):
+    """Listen on a Unix socket, and handle each request in a child forked
+    from this process, by calling `run_request` with the request. It must
+    return a response. Never returns."""
+    if opath.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(16)
+    # Children are reaped automatically.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    logger.info(f'Zygote listening on {socket_path}')
+    try:
+        while True:
+            conn, _ = server.accept()
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                _run_child(conn, run_request)
+            logger.info(f'Forked child {pid} for request')
+            conn.close()
+    finally:
+        server.close()
+        os.unlink(socket_path)
+
+
+def send_request(socket_path, request):
+    """Send a request to a zygote, and wait for its response. A request that
+    failed has its error in the response's 'error' entry."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.connect(socket_path)
+        _send_message(conn, request)
+        return _receive_message(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run a job in a zygote started with nex --zygote')
+    parser.add_argument('socket')
+    parser.add_argument('inputs', nargs='*')
+    parser.add_argument('-o', '--output')
+    parser.add_argument('--pdf', action='store_true')
+    parser.add_argument('--dvi-workers', type=int, default=1)
+    parser.add_argument('--pages',
+                        help='Only write pages in a range, like 10-12')
+    args = parser.parse_args()
+
+    if args.output:
+        dvi_path = args.output
+    elif args.inputs:
+        dvi_path = opath.splitext(opath.basename(args.inputs[-1]))[0]
+    else:
+        dvi_path = 'nexput'
+    if not dvi_path.endswith('.dvi'):
+        dvi_path += '.dvi'
+    font_search_paths = []
+    for input_path in args.inputs:
+        in_dir_path = opath.abspath(opath.dirname(input_path))
+        font_search_paths += [in_dir_path, opath.join(in_dir_path, 'fonts')]
+
+    print(f'Writing DVI to {dvi_path}')
+    response = send_request(args.socket, {
+        'cwd': os.getcwd(),
+        'input_paths': [opath.abspath(p) for p in args.inputs],
+        'font_search_paths': font_search_paths,
+        'dvi_path': opath.abspath(dvi_path),
+        'write_pdf': args.pdf,
+        'dvi_workers': args.dvi_workers,
+        'pages': args.pages,
+    })
+    if response['error'] is not None:
+        print(response['error'], file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
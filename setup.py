@@ -59,6 +59,7 @@ setup(
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=[
         'colorama>=0.3.9,<1',
+        'numpy',
     ],
 
     # List additional groups of dependencies here (e.g. development
@@ -86,6 +87,7 @@ setup(
     entry_points={
         'console_scripts': [
             'nex=nex.nex:main',
+            'nex-connect=nex.zygote:main',
         ],
     },
 )
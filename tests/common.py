@@ -1,5 +1,6 @@
 import os
 from enum import Enum
+from types import SimpleNamespace
 
 from nex.tokens import InstructionToken, BaseToken
 from nex.parsing import utils as pu
@@ -61,7 +62,19 @@ class DummyFontInfo:
         self.width = lambda code: 1
         self.height = lambda code: 1
         self.depth = lambda code: 1
+        self.has_char = lambda code: True
         self.x_height = 1
+        self.spacing = 4
+        self.space_stretch = 2
+        self.space_shrink = 1
+        self.extra_space = 1
+        self.lig_kern_table = {}
+        self.hyphen_char = None
+        self.skew_char = None
+        # What a DVI font definition needs.
+        self.font_info = SimpleNamespace(checksum=0)
+        self.design_size = 10
+        self.at_size = 10 * 2 ** 16
 
 
 class DummyGlobalFontState(GlobalFontState):
@@ -72,7 +85,142 @@ class DummyGlobalFontState(GlobalFontState):
         font_info = DummyFontInfo(file_name=file_name,
                                   file_path=f'/dummy/font/path/{file_name}',
                                   at_clause=at_clause)
-        font_id = max(self.fonts.keys()) + 1
-        self.fonts[font_id] = font_info
         # Return new font id.
-        return font_id
+        return self._add_font(font_info)
+
+
+# Fonts.
+
+
+def _fix_word(x):
+    return round(x * 2 ** 20)
+
+
+def _bcpl(s, nr_bytes):
+    b = bytes([len(s)]) + s.encode('ascii')
+    return b + bytes(nr_bytes - len(b))
+
+
+def write_test_tfm(file_path):
+    """Write a small TFM file for testing.
+
+    Characters 12 to 127 exist, except for 14 to 31. 'A' and 'V' kern
+    together, and 'f' forms ligatures with 'i' and 'l', giving characters 12
+    and 13.
+    """
+    import struct
+
+    bc, ec = 12, 127
+    widths = [0, 0.5, 0.3, 0.25, 0.6]
+    heights = [0, 0.7, 0.45]
+    depths = [0, 0.2]
+    italics = [0, 0.05]
+    lig_kerns = [
+        # 'A': kern with 'V'.
+        (128, ord('V'), 128, 0),
+        # 'V': kern with 'A'.
+        (128, ord('A'), 128, 0),
+        # 'f': ligatures with 'i' and 'l'.
+        (0, ord('i'), 0, 12),
+        (128, ord('l'), 0, 13),
+    ]
+    lig_kern_starts = {ord('A'): 0, ord('V'): 1, ord('f'): 2}
+    kerns = [-0.1]
+    params = [0, 0.333333, 0.166666, 0.111111, 0.430555, 1.0, 0.111111]
+
+    char_infos = []
+    for code in range(bc, ec + 1):
+        if 14 <= code <= 31:
+            char_infos.append((0, 0, 0, 0))
+            continue
+        width_index = 1 + code % 4
+        height_index = 1 if chr(code).isupper() else 2
+        depth_index = 1 if code in (ord('g'), ord('p')) else 0
+        italic_index = 1 if code == ord('f') else 0
+        if code in lig_kern_starts:
+            tag, remainder = 1, lig_kern_starts[code]
+        else:
+            tag, remainder = 0, 0
+        char_infos.append((width_index,
+                           (height_index << 4) | depth_index,
+                           (italic_index << 2) | tag,
+                           remainder))
+
+    header = struct.pack('>Ii', 0x12345678, _fix_word(10.0))
+    header += _bcpl('TeX text', 40) + _bcpl('TEST', 20) + bytes(4)
+    lh = len(header) // 4
+    lengths = [lh, bc, ec, len(widths), len(heights), len(depths),
+               len(italics), len(lig_kerns), len(kerns), 0, len(params)]
+    lf = 6 + lh + (ec - bc + 1) + sum(lengths[3:])
+
+    data = struct.pack('>12H', lf, *lengths)
+    data += header
+    for char_info in char_infos:
+        data += bytes(char_info)
+    for table in (widths, heights, depths, italics):
+        data += b''.join(struct.pack('>i', _fix_word(x)) for x in table)
+    for lig_kern in lig_kerns:
+        data += bytes(lig_kern)
+    for table in (kerns, params):
+        data += b''.join(struct.pack('>i', _fix_word(x)) for x in table)
+    with open(file_path, 'wb') as f:
+        f.write(data)
+
+
+def get_dvi_font_nrs(data):
+    """Walk a DVI file, and get the numbers of the fonts it selects, and of
+    those selected before they are defined or not defined in the
+    postamble."""
+    def read_uint(i, nr_bytes):
+        return int.from_bytes(data[i:i + nr_bytes], 'big')
+
+    def font_def_length(i, nr_bytes):
+        # Number, checksum, scale and design size, then the lengths of the
+        # area and name, and the area and name.
+        j = i + 1 + nr_bytes + 12
+        return j + 2 + data[j] + data[j + 1] - i
+
+    selected, defined, undefined = set(), set(), set()
+    # The preamble has a comment of variable length.
+    i = 15 + data[14]
+    while data[i] != 248:
+        op = data[i]
+        if op <= 127 or op in (138, 140, 141, 142, 147, 152, 161, 166):
+            i += 1
+        elif 128 <= op <= 131 or 133 <= op <= 136:
+            i += 1 + (op - 127 if op <= 131 else op - 132)
+        elif op in (132, 137):
+            i += 9
+        elif op == 139:
+            i += 45
+        elif 143 <= op <= 170:
+            # Movements by one to four bytes.
+            first_op = max(o for o in (143, 148, 153, 157, 162, 167)
+                           if o <= op)
+            i += 2 + op - first_op
+        elif 171 <= op <= 238:
+            if op <= 234:
+                font_nr, i = op - 171, i + 1
+            else:
+                nr_bytes = op - 234
+                font_nr, i = read_uint(i + 1, nr_bytes), i + 1 + nr_bytes
+            selected.add(font_nr)
+            if font_nr not in defined:
+                undefined.add(font_nr)
+        elif 239 <= op <= 242:
+            nr_bytes = op - 238
+            i += 1 + nr_bytes + read_uint(i + 1, nr_bytes)
+        elif 243 <= op <= 246:
+            nr_bytes = op - 242
+            defined.add(read_uint(i + 1, nr_bytes))
+            i += font_def_length(i, nr_bytes)
+        else:
+            raise ValueError(f'Unexpected op-code {op}')
+    # The postamble defines every font again.
+    i += 29
+    post_defined = set()
+    while data[i] != 249:
+        nr_bytes = data[i] - 242
+        post_defined.add(read_uint(i + 1, nr_bytes))
+        i += font_def_length(i, nr_bytes)
+    return selected, undefined | (selected - post_defined)
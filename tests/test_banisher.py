@@ -77,12 +77,22 @@ class DummyParameters:
         return self.param_map[name]
 
 
+class DummyFontState:
+
+    def __init__(self):
+        self.prefetched = []
+
+    def prefetch(self, file_name):
+        self.prefetched.append(file_name)
+
+
 class DummyState:
 
     def __init__(self, char_to_cat, cs_map, param_map=None):
         self.router = DummyRouter(cs_map)
         self.parameters = DummyParameters(param_map)
         self.codes = DummyCodes(char_to_cat)
+        self.global_font_state = DummyFontState()
 
     def evaluate_if_token_to_block(self, tok):
         if tok.type == Instructions.if_true.value:
@@ -162,6 +172,16 @@ def test_let():
     assert len(out_maximal) == 5
 
 
+def test_font_prefetch():
+    cs_map = {
+        'font': ITok(Instructions.font),
+    }
+    b = string_to_banisher('$font $tenrm = cmr10 a', cs_map)
+    out = b._iterate()
+    assert len(out) == 2
+    assert b.state.global_font_state.prefetched == ['cmr10']
+
+
 def test_toks_def_balanced():
     cs_map = {
         'bestToks': ITok(Instructions.token_parameter),
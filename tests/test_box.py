@@ -1,5 +1,16 @@
+import io
+import struct
+
+import pytest
+
 from nex.dampf.dvi_document import DVIDocument
+from nex.dampf.dvi_encoder import BytesEncoder, InstructionEncoder
+from nex.dampf.dvi_spec import OpCode
 from nex import box, box_writer
+from nex.fonts import GlobalFontState
+from nex.state import GlobalState, TidyEnd
+
+from common import get_dvi_font_nrs, write_test_tfm
 
 
 def test_glue_flex():
@@ -25,6 +36,53 @@ def test_glue_flex_set():
     assert h_box.shrink == [0]
 
 
+def test_glue_set_lazily():
+    glue = box.Glue(dimen=100, stretch=50, shrink=20)
+    other_glue = box.Glue(dimen=10, stretch=150, shrink=20)
+    h_box = box.HBox(contents=[glue, other_glue], to=160)
+    # The glue is not changed by being set, and its length is only worked
+    # out when asked for. Lengths are rounded half to even.
+    assert h_box._glue_setting is None
+    assert h_box.get_length(glue) == 112
+    assert h_box.get_length(other_glue) == 48
+    assert h_box._glue_setting is not None
+    assert h_box.width == 160
+
+    # The same glue can be set differently by another box.
+    shrunk_h_box = box.HBox(contents=[glue, other_glue], to=90)
+    assert shrunk_h_box.get_length(glue) == 100 - 10
+    assert h_box.get_length(glue) == 112
+
+    # Un-set boxes have no glue lengths.
+    un_set_h_box = box.HBox(contents=[glue], to=160, set_glue=False)
+    with pytest.raises(AttributeError):
+        un_set_h_box.get_length(glue)
+    # Copies keep whether the box is set.
+    assert h_box.copy().get_length(glue) == 112
+
+
+def test_copy_on_write():
+    inner = box.HBox([box.Glue(dimen=10, stretch=5), box.Rule(1, 1, 1)],
+                     to=20)
+    original = box.VBox([inner, box.Kern(dimen=3)])
+    copy = original.copy()
+    # Copying shares the contents, rather than copying them.
+    assert copy is not original
+    assert copy.contents is original.contents
+    assert copy.height == original.height
+
+    # Changing one box copies only its own contents list.
+    copy.append(box.Kern(dimen=4))
+    assert len(copy.contents) == 3
+    assert len(original.contents) == 2
+    assert copy.contents[0] is original.contents[0] is inner
+    assert copy.height == original.height + 4
+    # And the original can now change without affecting the copy.
+    original.extend([box.Kern(dimen=1)])
+    assert len(copy.contents) == 3
+    assert original.height == 1 + 3 + 1
+
+
 def test_box_writer():
     doc = DVIDocument(magnification=1000)
     v_box = box.VBox([
@@ -36,3 +94,362 @@ def test_box_writer():
         ]),
     ])
     box_writer.write_box_to_doc(doc, v_box)
+
+
+def test_dvi_streaming():
+    stream = io.BytesIO()
+    doc = DVIDocument(magnification=1000, stream=stream)
+    doc.begin_new_page()
+    doc.put_rule(1, 1)
+    doc.begin_new_page()
+    # The first page is written out once it ends.
+    first_page_data = stream.getvalue()
+    assert first_page_data[doc.begin_page_pointers[0]] == OpCode.begin_page.value
+    assert first_page_data[-1] == OpCode.end_page.value
+    assert doc.begin_page_pointers[1] == len(first_page_data)
+    doc.right(10)
+    doc.write()
+
+    data = stream.getvalue()
+    assert data.startswith(first_page_data)
+    # Each page points back to the one before.
+    bop_1, bop_2 = doc.begin_page_pointers
+    assert data[bop_2] == OpCode.begin_page.value
+    assert struct.unpack_from('>i', data, bop_2 + 41) == (bop_1,)
+    assert struct.unpack_from('>i', data, bop_1 + 41) == (-1,)
+    # The post-postamble points to the postamble, which points to the last
+    # page.
+    post = struct.unpack_from('>I', data, len(data) - 9)[0]
+    assert data[post] == OpCode.postamble.value
+    assert struct.unpack_from('>i', data, post + 1) == (bop_2,)
+
+
+def test_dvi_in_memory():
+    doc = DVIDocument(magnification=1000)
+    doc.begin_new_page()
+    doc.put_rule(1, 1)
+    stream = io.BytesIO()
+    doc.write(stream)
+    data = stream.getvalue()
+    assert data[doc.begin_page_pointers[0]] == OpCode.begin_page.value
+
+
+def _read_int(data, i, nr_bytes, signed=True):
+    return int.from_bytes(data[i:i + nr_bytes], 'big', signed=signed)
+
+
+def _interpret_dvi(data, font_registry, begin_page_pointer=None):
+    """Find where each character and rule goes on a page of a DVI file, by
+    default the first, and the op-codes on the page."""
+    if begin_page_pointer is None:
+        begin_page_pointer = data.index(bytes([OpCode.begin_page.value]))
+    i = begin_page_pointer + 45
+    h = v = w = x = y = z = 0
+    stack = []
+    font_nr = None
+    marks = []
+    ops = []
+
+    def char_width(code):
+        return font_registry.get_font(font_nr).width(code)
+
+    while data[i] != OpCode.end_page.value:
+        op = data[i]
+        ops.append(op)
+        i += 1
+        if op < 128:
+            marks.append(('char', op, h, v))
+            h += char_width(op)
+        elif op in (128, 133):
+            code = data[i]
+            i += 1
+            marks.append(('char', code, h, v))
+            if op == 128:
+                h += char_width(code)
+        elif op in (132, 137):
+            height, width = _read_int(data, i, 4), _read_int(data, i + 4, 4)
+            i += 8
+            marks.append(('rule', (height, width), h, v))
+            if op == 132:
+                h += width
+        elif op == 141:
+            stack.append((h, v, w, x, y, z))
+        elif op == 142:
+            h, v, w, x, y, z = stack.pop()
+        elif 143 <= op <= 146 or 157 <= op <= 160:
+            n = (op - 143) % 14 + 1
+            amount = _read_int(data, i, n)
+            i += n
+            if op <= 146:
+                h += amount
+            else:
+                v += amount
+        elif 147 <= op <= 170:
+            # One of w, x, y or z, perhaps set first.
+            register, n = divmod(op - 147, 5)
+            if register >= 2:
+                register, n = divmod(op - 161, 5)
+                register += 2
+            registers = [w, x, y, z]
+            if n:
+                registers[register] = _read_int(data, i, n)
+                i += n
+            w, x, y, z = registers
+            if register < 2:
+                h += registers[register]
+            else:
+                v += registers[register]
+        elif 171 <= op <= 234:
+            font_nr = op - 171
+        elif op == 243:
+            name_length = data[i + 13] + data[i + 14]
+            i += 15 + name_length
+        else:
+            raise ValueError(f'Unexpected op-code {op}')
+    return marks, ops
+
+
+def _layout(item, h, v, horizontal, marks):
+    """Where characters and rules go, following the box writer's rules."""
+    if isinstance(item, box.AbstractBox):
+        is_h_box = isinstance(item, box.HBox)
+        sub_h, sub_v = (h, v - item.offset) if is_h_box else (h + item.offset, v)
+        for sub_item in item.contents:
+            sub_h, sub_v = _layout(sub_item, sub_h, sub_v, is_h_box, marks)
+        advance = item.width if horizontal else item.height
+    elif isinstance(item, box.Character):
+        marks.append(('char', item.code, h, v))
+        advance = item.width
+    elif isinstance(item, box.Rule):
+        marks.append(('rule', (item.height, item.width), h, v))
+        advance = item.width if horizontal else item.height
+    elif isinstance(item, (box.Kern, box.Glue)):
+        advance = item.length
+    else:
+        advance = 0
+    return (h + advance, v) if horizontal else (h, v + advance)
+
+
+def _make_test_page(tmpdir):
+    """Make a font registry with two fonts, and a page using them."""
+    write_test_tfm(str(tmpdir.join('testfont.tfm')))
+    gfs = GlobalFontState(search_paths=[str(tmpdir)], use_cache=False)
+    font_id = gfs.define_new_font('testfont', at_clause=None)
+    other_font_id = gfs.define_new_font('testfont', ('at_dimen', 20 * 65536))
+
+    def word(font_id, text):
+        return [gfs.get_character(font_id, ord(c)) for c in text]
+
+    line_1 = box.HBox(word(font_id, 'AVA') + [box.Kern(dimen=300)]
+                      + word(font_id, 'VA') + [box.Kern(dimen=500)]
+                      + word(font_id, 'A') + [box.Kern(dimen=300)]
+                      + [box.Rule(10, 20, 0), box.Kern(dimen=500)]
+                      + word(font_id, 'V') + [box.Kern(dimen=-3)])
+    line_2 = box.HBox(word(other_font_id, 'AV') + [box.Kern(dimen=300)])
+    page = box.VBox([
+        box.FontDefinition(font_id, 'testfont', 'testfont'),
+        box.FontDefinition(other_font_id, 'testfont', 'testfont'),
+        box.FontSelection(font_id),
+        line_1,
+        box.Kern(dimen=1000),
+        box.FontSelection(other_font_id),
+        box.FontSelection(other_font_id),
+        line_2,
+        box.Kern(dimen=1000),
+        box.FontSelection(font_id),
+        line_1,
+        box.Kern(dimen=1000),
+        line_1,
+    ])
+    return gfs, page
+
+
+def test_dvi_optimization(tmpdir):
+    gfs, page = _make_test_page(tmpdir)
+    stream = io.BytesIO()
+    doc = DVIDocument(magnification=1000, font_registry=gfs, stream=stream)
+    doc.begin_new_page()
+    box_writer.write_box_to_doc(doc, page)
+    doc.write()
+    data = stream.getvalue()
+
+    expected = []
+    _layout(page, 0, 0, False, expected)
+    marks, ops = _interpret_dvi(data, gfs)
+    assert marks == expected
+
+    # Characters are set, implying their advance.
+    assert ops.count(ord('A')) == 13
+    assert OpCode.put_1_byte_char.value not in ops
+    # Repeated movements use the registers.
+    assert OpCode.right_w.value in ops
+    assert OpCode.right_x.value in ops
+    assert OpCode.down_y.value in ops
+    # Each font is selected only when it changes.
+    assert len([op for op in ops if 171 <= op <= 234]) == 3
+
+
+def test_dvi_encoders_agree():
+    # Include values at the edges of each size of argument.
+    values = [0, 1, -1]
+    for nr_bits in (7, 8, 15, 16, 23, 24, 31):
+        values += [2 ** nr_bits - 1, 2 ** nr_bits, -2 ** nr_bits,
+                   -2 ** nr_bits - 1]
+    values = [v for v in values if -2 ** 31 <= v < 2 ** 31]
+    unsigned_values = [v for v in values if v >= 0]
+
+    encoders = [BytesEncoder(), InstructionEncoder()]
+    for encoder in encoders:
+        for v in values:
+            for method in ('right', 'down', 'w', 'x', 'y', 'z'):
+                getattr(encoder, method)(v)
+            encoder.set_rule(v, 1)
+            encoder.put_rule(1, v)
+        for v in unsigned_values:
+            encoder.set_char(v)
+            encoder.put_char(v)
+            encoder.select_font(v)
+        for method in ('w', 'x', 'y', 'z', 'push', 'pop', 'end_page'):
+            getattr(encoder, method)()
+        encoder.begin_page(list(range(10)), -1)
+    fast_data, slow_data = [encoder.take() for encoder in encoders]
+    assert fast_data == slow_data
+    assert len(encoders[0]) == len(encoders[1]) == 0
+
+
+@pytest.mark.parametrize('use_threads', [True, False])
+def test_parallel_pages(tmpdir, use_threads):
+    gfs, page = _make_test_page(tmpdir)
+    font_ids = [item.font_nr for item in page.contents
+                if isinstance(item, box.FontSelection)]
+    # Pages without definitions or selections of their own, which depend on
+    # those of earlier pages.
+    bare_page = box.VBox([item for item in page.contents
+                          if not isinstance(item, (box.FontDefinition,
+                                                   box.FontSelection))])
+    pages = [page, bare_page, box.VBox([box.FontSelection(font_ids[1])]
+                                       + bare_page.contents)]
+
+    def write(parallel):
+        stream = io.BytesIO()
+        doc = DVIDocument(magnification=1000, font_registry=gfs,
+                          stream=stream)
+        if parallel:
+            box_writer._write_pages_in_parallel(doc, pages, nr_workers=2,
+                                                use_threads=use_threads)
+        else:
+            for main_v_box in pages:
+                doc.begin_new_page()
+                box_writer.write_box_contents_to_doc(doc, main_v_box)
+        doc.write()
+        return doc, stream.getvalue()
+
+    serial_doc, serial_data = write(parallel=False)
+    doc, data = write(parallel=True)
+    for bop, serial_bop in zip(doc.begin_page_pointers,
+                               serial_doc.begin_page_pointers):
+        marks, ops = _interpret_dvi(data, gfs, bop)
+        # Pages are written from display lists, in which rules come after
+        # glyphs.
+        assert (sorted(marks)
+                == sorted(_interpret_dvi(serial_data, gfs, serial_bop)[0]))
+        # Fonts are defined between pages.
+        assert OpCode.define_1_byte_font_nr.value not in ops
+
+    # Each page points back to the one before.
+    previous_bop = -1
+    for bop in doc.begin_page_pointers:
+        assert data[bop] == OpCode.begin_page.value
+        assert struct.unpack_from('>i', data, bop + 41) == (previous_bop,)
+        previous_bop = bop
+    post = struct.unpack_from('>I', data, len(data) - 9)[0]
+    assert struct.unpack_from('>i', data, post + 1) == (previous_bop,)
+    # Each font is defined once, before the first page, and again in the
+    # postamble.
+    assert data.count(b'testfont') == 4
+
+
+@pytest.mark.parametrize('nr_workers', [1, 2])
+def test_dvi_page_sink(tmpdir, nr_workers):
+    gfs, page = _make_test_page(tmpdir)
+    bare_page = box.VBox([item for item in page.contents
+                          if not isinstance(item, (box.FontDefinition,
+                                                   box.FontSelection))])
+    pages = [page, bare_page, bare_page]
+
+    stream = io.BytesIO()
+    sink = box_writer.DVIPageSink(stream, nr_workers=nr_workers,
+                                  use_threads=True)
+    state = GlobalState.from_defaults(global_font_state=gfs, page_sink=sink)
+    for main_v_box in pages:
+        state.ship_out(main_v_box)
+    # Pages go to the sink, rather than being kept.
+    assert not state.completed_pages
+    state.close_page_sink()
+    assert sink.nr_pages == len(pages)
+
+    # The same document is written as if the pages were kept until the end.
+    kept_state = GlobalState.from_defaults(global_font_state=gfs)
+    for main_v_box in pages:
+        kept_state.ship_out(main_v_box)
+    assert kept_state.completed_pages == pages
+    kept_stream = io.BytesIO()
+    box_writer.write_to_dvi_file(kept_state, kept_stream,
+                                 nr_workers=nr_workers, use_threads=True)
+    assert stream.getvalue() == kept_stream.getvalue()
+
+
+@pytest.mark.parametrize('nr_workers', [1, 2])
+def test_page_range_sink(tmpdir, nr_workers):
+    gfs, page = _make_test_page(tmpdir)
+    font_ids = [item.font_nr for item in page.contents
+                if isinstance(item, box.FontSelection)]
+    bare_page = box.VBox([item for item in page.contents
+                          if not isinstance(item, (box.FontDefinition,
+                                                   box.FontSelection))])
+    # The second page changes the font that later pages start with.
+    pages = [page, box.VBox([box.FontSelection(font_ids[1])]
+                            + bare_page.contents),
+             bare_page, bare_page]
+
+    def write(first_page, last_page, pages=pages):
+        stream = io.BytesIO()
+        sink = box_writer.DVIPageSink(stream, nr_workers=nr_workers,
+                                      use_threads=True)
+        sink = box_writer.PageRangeSink(sink, first_page, last_page)
+        state = GlobalState.from_defaults(global_font_state=gfs,
+                                          page_sink=sink)
+        for main_v_box in pages:
+            try:
+                state.ship_out(main_v_box)
+            except TidyEnd:
+                break
+        state.close_page_sink()
+        return sink, stream.getvalue()
+
+    full_sink, full_data = write(1, len(pages))
+    sink, data = write(2, 3)
+    # The job ends as soon as the last page in the range is shipped out.
+    assert sink.nr_pages_shipped == 3
+    assert sink.sink.nr_pages == 2
+    full_pointers = full_sink.sink.doc.begin_page_pointers
+    for bop, full_bop in zip(sink.sink.doc.begin_page_pointers,
+                             full_pointers[1:3]):
+        assert (sorted(_interpret_dvi(data, gfs, bop)[0])
+                == sorted(_interpret_dvi(full_data, gfs, full_bop)[0]))
+
+    # A font defined on a skipped page, but first selected on a written
+    # one, is still defined.
+    definitions = [item for item in page.contents
+                   if isinstance(item, box.FontDefinition)]
+    lines = [item for item in page.contents if isinstance(item, box.HBox)]
+    pages = [box.VBox(definitions + [box.FontSelection(font_ids[0]),
+                                     lines[0]]),
+             box.VBox([box.FontSelection(font_ids[1]), lines[1]])]
+    _, data = write(2, 2, pages)
+    assert get_dvi_font_nrs(data) == ({font_ids[1]}, set())
+
+
+def test_page_range_sink_invalid():
+    with pytest.raises(ValueError):
+        box_writer.PageRangeSink(None, 3, 2)
@@ -90,6 +90,9 @@ cs_map = {
     'lower': ITok(Instructions.lower_box),
     'showBox': ITok(Instructions.show_box),
     'showToken': ITok(Instructions.show_token),
+    'advance': ITok(Instructions.advance),
+    'dimen': ITok(Instructions.dimen),
+    'skip': ITok(Instructions.skip),
 }
 
 
@@ -285,3 +288,9 @@ def test_math_shift():
 
 def test_ignore_spaces():
     parser.parse(process('$ignoreSpaces       '))
+
+
+def test_advance():
+    parser.parse(process('$advance $dimen 2 by -3pt'))
+    parser.parse(process('$advance $skip 5 by 1pt plus 2fil'))
+    parser.parse(process('$advance $skip 5 1pt minus 1pt'))
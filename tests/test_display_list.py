@@ -0,0 +1,93 @@
+import io
+
+import pytest
+
+from nex import box, box_writer
+from nex.dampf.dvi_document import DVIDocument
+from nex.dampf.dvi_spec import OpCode
+from nex.display_list import flatten_page, get_display_list
+from nex.utils import LogicError
+
+from common import DummyGlobalFontState
+
+
+def char(code, width=10):
+    return box.Character(code, width=width, height=5, depth=0)
+
+
+def make_page():
+    return box.VBox([
+        box.FontSelection(1),
+        box.HBox([char(65), char(66, width=20), box.Kern(dimen=5),
+                  char(67), box.Rule(width=3, height=4, depth=0)]),
+        box.Glue(dimen=100),
+        box.HBox([char(68),
+                  box.VBox([box.FontSelection(2), box.HBox([char(69)])],
+                           offset=7),
+                  char(70)],
+                 offset=2),
+    ])
+
+
+def test_flatten_page():
+    page = make_page()
+    display_list = flatten_page(page)
+    g = display_list.glyphs
+    assert g['code'].tolist() == [65, 66, 67, 68, 69, 70]
+    assert g['font_nr'].tolist() == [1, 1, 1, 1, 2, 2]
+    assert g['h'].tolist() == [0, 10, 35, 0, 17, 10 + page.contents[3].contents[1].width]
+    first_line_height = page.contents[1].height
+    second_v = first_line_height + 100
+    assert g['v'].tolist() == [0, 0, 0, second_v - 2, second_v - 2,
+                               second_v - 2]
+    r = display_list.rules
+    assert r.tolist() == [(45, 0, 3, 4)]
+    assert display_list.font_nrs == [1, 2]
+    assert display_list.end_font_nr == 2
+
+    runs = display_list.glyph_runs()
+    assert [g['code'][run].tolist() for run in runs] == [[65, 66, 67], [68],
+                                                        [69, 70]]
+
+
+def test_flatten_needs_font():
+    page = box.VBox([box.HBox([char(65)])])
+    with pytest.raises(LogicError):
+        flatten_page(page)
+    # The font may be selected by an earlier page.
+    assert flatten_page(page, font_nr=3).glyphs['font_nr'].tolist() == [3]
+
+
+def test_display_list_cached():
+    page = make_page()
+    display_list = get_display_list(page)
+    assert get_display_list(page) is display_list
+    assert get_display_list(page, font_nr=2) is not display_list
+
+
+def test_display_list_to_dvi():
+    gfs = DummyGlobalFontState()
+    font_id = gfs.define_new_font('font', at_clause=None)
+    page = box.VBox([box.FontSelection(font_id),
+                     box.HBox([char(65, width=1), char(66, width=1),
+                               box.Kern(dimen=300), char(67, width=1)])])
+    stream = io.BytesIO()
+    doc = DVIDocument(magnification=1000, font_registry=gfs, stream=stream)
+    doc.begin_new_page()
+    box_writer.write_display_list_to_doc(doc, flatten_page(page))
+    doc.write()
+    page_data = stream.getvalue()[doc.begin_page_pointers[0] + 45:
+                                  doc.postamble_pointer]
+    # The font was not defined on the page, so it is defined when it is
+    # first selected.
+    font_def_length = 16 + len('font')
+    font_def = page_data[:font_def_length]
+    page_data = page_data[font_def_length:]
+    assert font_def[:2] == bytes([OpCode.define_1_byte_font_nr.value,
+                                  font_id])
+    assert font_def.endswith(b'font')
+    # Characters are set, implying their advance in the font, and only the
+    # kern needs a movement.
+    assert page_data == bytes([171 + font_id, 65, 66,
+                               OpCode.set_2_byte_w_then_right_w.value, 1, 44,
+                               67, OpCode.end_page.value])
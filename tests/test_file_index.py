@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from nex.file_index import FileIndex, read_db
+from nex.reader import Reader
+
+
+def test_find(tmpdir):
+    a, b = tmpdir.mkdir('a'), tmpdir.mkdir('b')
+    a.join('x.tex').write('x')
+    b.join('x.tex').write('x')
+    b.join('y.tex').write('y')
+    index = FileIndex()
+    search_paths = [str(a), str(b)]
+    # Earlier search paths take precedence.
+    assert index.find('x.tex', search_paths) == str(a.join('x.tex'))
+    assert index.find('y.tex', search_paths) == str(b.join('y.tex'))
+    assert index.stats == {'directories': 2, 'hits': 2, 'misses': 0}
+    with pytest.raises(FileNotFoundError):
+        index.find('z.tex', search_paths)
+    assert index.misses == 1
+
+
+def test_find_new_file(tmpdir):
+    index = FileIndex()
+    with pytest.raises(FileNotFoundError):
+        index.find('x.tex', [str(tmpdir)])
+    # A file made after its directory was listed is still found.
+    tmpdir.join('x.tex').write('x')
+    assert index.find('x.tex', [str(tmpdir)]) == str(tmpdir.join('x.tex'))
+    assert index.find('x.tex', [str(tmpdir)]) == str(tmpdir.join('x.tex'))
+    assert (index.hits, index.misses) == (1, 2)
+
+
+def test_db(tmpdir):
+    fonts = tmpdir.mkdir('fonts')
+    fonts.join('x.tfm').write('x')
+    db_path = str(tmpdir.join('ls-R'))
+    index = FileIndex(db_path=db_path)
+    index.find('x.tfm', [str(fonts)])
+    index.save()
+    assert read_db(db_path) == {str(fonts): {'x.tfm'}}
+
+    # The database's listing is used while the directory is unchanged.
+    os.utime(str(fonts), (0, 0))
+    index = FileIndex(db_path=db_path)
+    index._listings[str(fonts)].add('phantom.tfm')
+    assert index.find('phantom.tfm', [str(fonts)]) == str(
+        fonts.join('phantom.tfm'))
+
+    # A directory modified since the database was written is listed again.
+    fonts.join('y.tfm').write('y')
+    index = FileIndex(db_path=db_path)
+    index._listings[str(fonts)].add('phantom.tfm')
+    with pytest.raises(FileNotFoundError):
+        index.find('phantom.tfm', [str(fonts)])
+    assert index.find('y.tfm', [str(fonts)]) == str(fonts.join('y.tfm'))
+
+
+def test_reader_search_paths(tmpdir):
+    tmpdir.join('x.tex').write('x')
+    r = Reader(search_paths=[str(tmpdir), str(tmpdir)])
+    r.insert_file('x')
+    r.insert_file('x')
+    assert r.search_paths.count(str(tmpdir)) == 1
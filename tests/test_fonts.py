@@ -1,6 +1,14 @@
+import os
+
+import numpy as np
 import pytest
 
-from nex.fonts import GlobalFontState
+from nex.fonts import GlobalFontState, KernStep, LigatureStep
+from nex.font_metrics import FontMetrics, get_cache_path, load_font_metrics
+from nex.pydvi.Font.TfmParser import TfmParser
+from nex.utils import UserError
+
+from common import write_test_tfm
 
 
 def test_skew_char():
@@ -15,3 +23,187 @@ def test_hyphen_char():
     gfs.set_hyphen_char(0, 65)
     with pytest.raises(KeyError):
         gfs.set_hyphen_char(1, 65)
+
+
+def test_lig_kern_table(tmpdir):
+    write_test_tfm(str(tmpdir.join('testfont.tfm')))
+    gfs = GlobalFontState(search_paths=[str(tmpdir)])
+    font_id = gfs.define_new_font('testfont', at_clause=None)
+    table = gfs.get_font(font_id).lig_kern_table
+    assert table[ord('A'), ord('V')] == KernStep(kern=-65536)
+    assert table[ord('V'), ord('A')] == KernStep(kern=-65536)
+    assert table[ord('f'), ord('i')] == LigatureStep(char_code=12,
+                                                     nr_to_pass_over=0,
+                                                     keep_current=False,
+                                                     keep_next=False)
+    assert table[ord('f'), ord('l')].char_code == 13
+    assert len(table) == 4
+
+
+def test_metrics_round_trip(tmpdir):
+    file_path = str(tmpdir.join('testfont.tfm'))
+    write_test_tfm(file_path)
+    metrics = FontMetrics.from_tfm('testfont', file_path)
+    loaded, size, mtime_ns = FontMetrics.from_bytes(
+        metrics.to_bytes(source_size=12, source_mtime_ns=34))
+    assert (size, mtime_ns) == (12, 34)
+    assert loaded.design_size == metrics.design_size == 10.0
+    assert loaded.get_parameter('quad') == metrics.get_parameter('quad')
+    for attr in ('codes', 'widths', 'heights', 'depths', 'italics',
+                 'parameters', 'lig_kerns'):
+        assert np.array_equal(getattr(loaded, attr), getattr(metrics, attr))
+
+
+def test_metrics_cache(tmpdir):
+    file_path = str(tmpdir.join('testfont.tfm'))
+    write_test_tfm(file_path)
+    cache_dir = str(tmpdir.join('cache'))
+    cache_path = get_cache_path(file_path, cache_dir)
+    metrics = load_font_metrics('testfont', file_path, cache_dir=cache_dir)
+    assert os.path.exists(cache_path)
+
+    # Spoil the cached widths, to tell whether the cache is used.
+    with open(cache_path, 'rb') as f:
+        cached, size, mtime_ns = FontMetrics.from_bytes(f.read())
+    cached.widths = cached.widths * 2
+    with open(cache_path, 'wb') as f:
+        f.write(cached.to_bytes(size, mtime_ns))
+    loaded = load_font_metrics('testfont', file_path, cache_dir=cache_dir)
+    assert np.array_equal(loaded.widths, metrics.widths * 2)
+
+    # Changing the font invalidates the cache.
+    os.utime(file_path, ns=(0, 0))
+    loaded = load_font_metrics('testfont', file_path, cache_dir=cache_dir)
+    assert np.array_equal(loaded.widths, metrics.widths)
+
+
+def test_cached_font(tmpdir):
+    write_test_tfm(str(tmpdir.join('testfont.tfm')))
+    gfs = GlobalFontState(search_paths=[str(tmpdir)])
+    font_id = gfs.define_new_font('testfont', at_clause=None)
+    assert os.path.exists(get_cache_path(str(tmpdir.join('testfont.tfm'))))
+    gfs_cached = GlobalFontState(search_paths=[str(tmpdir)])
+    font_id_cached = gfs_cached.define_new_font('testfont', at_clause=None)
+    font = gfs.get_font(font_id)
+    font_cached = gfs_cached.get_font(font_id_cached)
+    assert font_cached.lig_kern_table == font.lig_kern_table
+    assert font_cached.char_codes == font.char_codes
+    assert ([font_cached.width(c) for c in font.char_codes]
+            == [font.width(c) for c in font.char_codes])
+    assert font_cached.spacing == font.spacing
+
+
+def test_font_registry(tmpdir):
+    write_test_tfm(str(tmpdir.join('testfont.tfm')))
+    gfs = GlobalFontState(search_paths=[str(tmpdir)])
+    font_id = gfs.define_new_font('testfont', at_clause=None)
+    ten_pt = 10 * 2 ** 16
+    assert gfs.get_font(font_id).at_size == ten_pt
+    # The same file at the same size is the same font.
+    assert gfs.define_new_font('testfont', at_clause=None) == font_id
+    assert gfs.define_new_font(str(tmpdir.join('testfont.tfm')),
+                               at_clause=('at_dimen', ten_pt)) == font_id
+    assert gfs.define_new_font('testfont',
+                               at_clause=('scaled_number', 1000)) == font_id
+    # At another size, it is a new font, sharing the same metrics.
+    big_id = gfs.define_new_font('testfont',
+                                 at_clause=('scaled_number', 2000))
+    assert big_id != font_id
+    assert gfs.get_font(big_id).at_size == 2 * ten_pt
+    assert gfs.get_metrics(big_id) is gfs.get_metrics(font_id)
+
+
+def test_bad_at_size(tmpdir):
+    write_test_tfm(str(tmpdir.join('testfont.tfm')))
+    gfs = GlobalFontState(search_paths=[str(tmpdir)])
+    with pytest.raises(UserError):
+        gfs.define_new_font('testfont', at_clause=('at_dimen', 0))
+    with pytest.raises(UserError):
+        gfs.define_new_font('testfont', at_clause=('scaled_number', 40000))
+
+
+def test_decode_tfm(tmpdir):
+    file_path = str(tmpdir.join('testfont.tfm'))
+    write_test_tfm(file_path)
+    metrics = FontMetrics.from_tfm('testfont', file_path)
+    tfm = TfmParser.parse('testfont', file_path)
+    # Characters with a zero width index do not exist.
+    assert metrics.codes.tolist() == [c for c in sorted(tfm._chars)
+                                      if not 14 <= c <= 31]
+    for i, code in enumerate(metrics.codes.tolist()):
+        char = tfm[code]
+        assert metrics.widths[i] == char.width
+        assert metrics.heights[i] == char.height
+        assert metrics.depths[i] == char.depth
+        assert metrics.italics[i] == char.italic_correction
+    assert metrics.italics[metrics.index[ord('f')]] > 0
+    assert metrics.checksum == tfm.checksum
+    assert metrics.design_size == tfm.design_font_size
+    assert metrics.coding_scheme == tfm.character_coding_scheme
+    assert metrics.get_parameter('spacing') == tfm.spacing
+
+
+def test_at_size_metrics(tmpdir):
+    write_test_tfm(str(tmpdir.join('testfont.tfm')))
+    gfs = GlobalFontState(search_paths=[str(tmpdir)])
+    font = gfs.get_font(gfs.define_new_font('testfont', at_clause=None))
+    big_font = gfs.get_font(gfs.define_new_font(
+        'testfont', at_clause=('at_dimen', 20 * 2 ** 16)))
+    for code in font.char_codes:
+        assert big_font.width(code) == 2 * font.width(code)
+    assert big_font.spacing == 2 * font.spacing
+    assert big_font.lig_kern_table[ord('A'), ord('V')].kern == -2 * 65536
+    assert not font.has_char(20)
+    with pytest.raises(KeyError):
+        gfs.get_character(gfs.null_font_id + 1, 20)
+
+
+def test_scaled_fonts_lazy(tmpdir):
+    write_test_tfm(str(tmpdir.join('testfont.tfm')))
+    gfs = GlobalFontState(search_paths=[str(tmpdir)])
+    font_ids = [gfs.define_new_font('testfont',
+                                    at_clause=('scaled_number', n))
+                for n in (1000, 1200, 1440)]
+    fonts = [gfs.get_font(font_id) for font_id in font_ids]
+    assert len({id(font.font_info) for font in fonts}) == 1
+    assert [font.at_size for font in fonts] == [655360, 786432, 943718]
+    # Scaled metrics are only made when needed.
+    assert all(font._widths is None for font in fonts)
+    metrics = fonts[0].font_info
+    width = metrics.widths[metrics.index[ord('A')]]
+    assert fonts[1].width(ord('A')) == round(width * 786432)
+    assert fonts[0]._widths is None
+
+
+def test_prefetch(tmpdir):
+    write_test_tfm(str(tmpdir.join('testfont.tfm')))
+    gfs = GlobalFontState(search_paths=[str(tmpdir)])
+    gfs.prefetch('testfont')
+    # Fonts that cannot be found are left to be reported when defined.
+    gfs.prefetch('nofont')
+    assert len(gfs._metrics_futures) == 1
+    future, = gfs._metrics_futures.values()
+    font_id = gfs.define_new_font('testfont', at_clause=None)
+    assert not gfs._metrics_futures
+    assert gfs.get_metrics(font_id) is future.result()
+    with pytest.raises(FileNotFoundError):
+        gfs.define_new_font('nofont', at_clause=None)
+
+
+def test_mmap_metrics(tmpdir):
+    file_path = str(tmpdir.join('testfont.tfm'))
+    write_test_tfm(file_path)
+    metrics = FontMetrics.from_tfm('testfont', file_path)
+    # The first load writes the cache, and the next maps it.
+    for _ in range(2):
+        mapped = load_font_metrics('testfont', file_path, use_mmap=True)
+        for attr in ('codes', 'widths', 'lig_kerns'):
+            a = getattr(mapped, attr)
+            assert not a.flags.writeable
+            assert not a.flags.owndata
+            assert np.array_equal(a, getattr(metrics, attr))
+
+    gfs = GlobalFontState(search_paths=[str(tmpdir)], use_mmap=True)
+    font = gfs.get_font(gfs.define_new_font('testfont', at_clause=None))
+    assert not font.font_info.widths.flags.writeable
+    assert font.width(ord('A')) > 0
@@ -0,0 +1,49 @@
+from nex.hyphenation import (Hyphenator, PatternTrie, parse_pattern,
+                             parse_exception)
+
+# The patterns that apply to 'hyphenation', from Appendix H of the TeXbook.
+patterns = ['hy3ph', 'he2n', 'hena4', 'hen5at', '1na', 'n2at', '1tio', '2io',
+            'o2n']
+
+
+def test_parse_pattern():
+    assert parse_pattern('.ab1c') == ('.abc', (0, 0, 0, 1, 0))
+    assert parse_pattern('1na') == ('na', (1, 0, 0))
+
+
+def test_parse_exception():
+    assert parse_exception('ta-ble') == ('table', (2,))
+    assert parse_exception('man-u-script') == ('manuscript', (3, 4))
+
+
+def test_trie():
+    trie = PatternTrie(patterns)
+    assert len(trie) == len(patterns)
+    digits = trie.word_digits('hyphenation')
+    # Digits between the letters of '.hyphenation.'.
+    assert digits[2:13] == [0, 3, 0, 0, 2, 5, 4, 2, 0, 2, 0]
+
+
+def test_hyphenate():
+    hyphenator = Hyphenator()
+    assert hyphenator.hyphenate('hyphenation') == ()
+    hyphenator.add_patterns(patterns)
+    assert hyphenator.hyphenate('hyphenation') == (2, 6)
+    # Check the minimum lengths before and after a hyphen are respected.
+    assert hyphenator.hyphenate('hyphenation', left_min=3) == (6,)
+    assert hyphenator.hyphenate('hyphenation', right_min=6) == (2,)
+    # Check exceptions override patterns, and the cache is cleared.
+    hyphenator.add_exceptions(['hyphen-ation'])
+    assert hyphenator.hyphenate('hyphenation') == (6,)
+
+
+def test_from_tex_file(tmpdir):
+    file_path = tmpdir.join('hyphen.tex')
+    file_path.write('% Patterns.\n'
+                    '\\patterns{ % comment\n'
+                    + '\n'.join(patterns) +
+                    '}\n'
+                    '\\hyphenation{ta-ble}\n')
+    hyphenator = Hyphenator.from_tex_file(str(file_path))
+    assert hyphenator.hyphenate('hyphenation') == (2, 6)
+    assert hyphenator.hyphenate('table', right_min=2) == (2,)
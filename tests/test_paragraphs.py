@@ -0,0 +1,89 @@
+import random
+
+from nex import box
+from nex.columnar import ColumnarHList
+from nex.paragraphs import get_best_route, get_best_route_columnar
+from nex.utils import InfiniteDimension
+
+
+def get_h_list(nr_words, seed=0):
+    rng = random.Random(seed)
+    h_list = []
+    for i in range(nr_words):
+        for _ in range(rng.randint(1, 6)):
+            h_list.append(box.Character(code=rng.randint(97, 122),
+                                        width=rng.randint(3, 8),
+                                        height=5, depth=1))
+        if rng.random() < 0.2:
+            h_list.append(box.Kern(dimen=rng.randint(-2, 2)))
+        if rng.random() < 0.2:
+            h_list.append(box.Penalty(size=rng.choice([-50, 0, 50, 10000])))
+        h_list.append(box.Glue(dimen=4, stretch=2, shrink=1))
+    h_list.append(box.Penalty(size=10000))
+    h_list.append(box.Glue(dimen=0, stretch=InfiniteDimension(1, 1)))
+    h_list.append(box.Penalty(size=-10000))
+    return h_list
+
+
+def test_columnar_round_trip():
+    h_list = get_h_list(nr_words=10)
+    cols = ColumnarHList.from_items(h_list)
+    assert len(cols) == len(h_list)
+    assert all(a is b for a, b in zip(cols.to_items(), h_list))
+    assert cols.widths.sum() == box.HBox(h_list, set_glue=False).natural_length
+
+
+def test_columnar_break_points():
+    h_list = get_h_list(nr_words=10)
+    mask = ColumnarHList.from_items(h_list).break_point_mask()
+    assert list(mask) == [box.is_break_point(h_list, i)
+                          for i in range(len(h_list))]
+
+
+def test_columnar_badness():
+    h_list = get_h_list(nr_words=10)
+    cols = ColumnarHList.from_items(h_list)
+    for stop in range(1, len(h_list) + 1):
+        h_box = box.HBox(h_list[2:stop], to=40, set_glue=False)
+        assert cols.segment_badness(2, [stop], 40)[0] == h_box.badness()
+
+
+def test_columnar_glue_set():
+    for to in (10, 60, 100):
+        h_list = get_h_list(nr_words=5)[:-3]
+        cols = ColumnarHList.from_items(h_list)
+        lengths = cols.set_glue_lengths(to)
+        h_box = box.HBox(h_list, to=to)
+        assert list(lengths) == h_box.widths
+
+
+def test_columnar_route_matches():
+    for seed in range(4):
+        h_list = get_h_list(nr_words=7, seed=seed)
+        for h_size, tolerance in ((30, 10000), (45, 200), (60, 10000)):
+            route = get_best_route(h_list, h_size, tolerance, 10)
+            route_col = get_best_route_columnar(h_list, h_size, tolerance, 10)
+            assert route_col.demerit == route.demerit
+            assert len(route_col.sequence) == len(route.sequence)
+            for line_col, line in zip(route_col.sequence, route.sequence):
+                assert all(a is b for a, b in zip(line_col, line))
+                assert len(line_col) == len(line)
+
+
+def test_columnar_route_matches_discretionaries():
+    hyphen = box.Character(code=45, width=3, height=5, depth=1)
+    for seed in range(4):
+        h_list = get_h_list(nr_words=7, seed=seed)
+        # Allow a hyphen after the first letter of each word.
+        for i in reversed(range(1, len(h_list) - 3)):
+            if (isinstance(h_list[i], box.Character)
+                    and isinstance(h_list[i - 1], box.Glue)):
+                h_list.insert(i + 1, box.DiscretionaryBreak(
+                    pre_break=[hyphen], post_break=[], no_break=[],
+                    penalty=50))
+        for h_size, tolerance in ((30, 10000), (45, 200)):
+            route = get_best_route(h_list, h_size, tolerance, 10)
+            route_col = get_best_route_columnar(h_list, h_size, tolerance, 10)
+            assert route_col.demerit == route.demerit
+            assert ([len(line) for line in route_col.sequence]
+                    == [len(line) for line in route.sequence])
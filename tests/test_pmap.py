@@ -0,0 +1,75 @@
+import pickle
+import random
+
+import pytest
+
+from nex.pmap import pmap
+
+
+class CollidingKey:
+    """A key whose hash is shared with others."""
+
+    def __init__(self, name, hash_):
+        self.name = name
+        self.hash = hash_
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return isinstance(other, CollidingKey) and self.name == other.name
+
+
+def test_pmap_matches_dict():
+    rng = random.Random(0)
+    keys = (list(range(300)) + [f'cs{i}' for i in range(300)]
+            + [CollidingKey(i, i % 3) for i in range(20)])
+    d = {}
+    m = pmap()
+    versions = []
+    for _ in range(3000):
+        key = rng.choice(keys)
+        if key in d and rng.random() < 0.3:
+            del d[key]
+            m = m.delete(key)
+        else:
+            value = rng.random()
+            d[key] = value
+            m = m.set(key, value)
+        versions.append((m, dict(d)))
+    # Each version of the map is unchanged by later changes.
+    for m, d in versions[::100]:
+        assert len(m) == len(d)
+        assert dict(m.items()) == d
+        for key in keys:
+            assert m.get(key) == d.get(key)
+            assert (key in m) == (key in d)
+
+
+def test_pmap_operations():
+    m = pmap({'a': 1, 'b': 2})
+    assert m.set('a', 1) is m
+    assert m.set('c', 3) == {'a': 1, 'b': 2, 'c': 3}
+    assert m == {'a': 1, 'b': 2}
+    assert m.discard('z') is m
+    with pytest.raises(KeyError):
+        m.delete('z')
+    with pytest.raises(KeyError):
+        m['z']
+    assert m.delete('a').delete('b') == {}
+    assert m.update({'b': 5}, c=6) == {'a': 1, 'b': 5, 'c': 6}
+    assert pickle.loads(pickle.dumps(m)) == m
+
+
+def test_pmap_from_dict():
+    d = {key: i for i, key in enumerate(
+        list(range(500)) + [CollidingKey(i, i % 3) for i in range(20)])}
+    m = pmap(d)
+    assert len(m) == len(d)
+    for key, value in d.items():
+        assert m[key] == value
+    # A map built in one go can be changed like any other.
+    for key in d:
+        m = m.delete(key)
+    assert len(m) == 0
+    assert m == {}
@@ -1,7 +1,13 @@
+import pytest
+
+from nex.constants.codes import CatCode
+from nex.constants.instructions import Instructions
 from nex.state import GlobalState
-from nex import nex
+from nex.utils import UserError
+from nex import box, nex
 
-from common import test_runnable_file_name, test_file_dir_path
+from common import (test_runnable_file_name, test_file_dir_path,
+                    write_test_tfm, get_dvi_font_nrs)
 
 
 def test_make_input_chain():
@@ -12,3 +18,77 @@ def test_make_input_chain():
 def test_run_file():
     nex.run_files(input_paths=[test_runnable_file_name],
                   font_search_paths=[test_file_dir_path])
+
+
+def test_font_at_clauses(tmpdir):
+    write_test_tfm(str(tmpdir.join('testfont.tfm')))
+    document = tmpdir.join('document.tex')
+    document.write('\n'.join([
+        r'\font\atfont=testfont at 12pt',
+        r'\font\scaledfont=testfont scaled 2000',
+        r'\font\plainfont=testfont',
+        r'\end',
+    ]))
+    state = nex.run_files(input_paths=[str(document)],
+                          font_search_paths=[str(tmpdir)])
+    fonts = state.global_font_state.fonts
+    at_font, scaled_font, plain_font = [fonts[i] for i in sorted(fonts)[1:]]
+    assert at_font.at_size == 12 * 2 ** 16
+    assert scaled_font.at_size == 2 * plain_font.at_size
+
+
+def test_dump_and_load_format(tmpdir):
+    write_test_tfm(str(tmpdir.join('testfont.tfm')))
+    preamble = tmpdir.join('preamble.tex')
+    preamble.write('\n'.join([
+        r'\catcode`\{=1',
+        r'\catcode`\}=2',
+        r'\catcode`\#=6',
+        r'\catcode`\@=11',
+        r'\def\tw@ce#1{#1#1}',
+        r'\count1=42',
+        r'\font\testfont=testfont',
+        r'\dump',
+    ]))
+    format_path = str(tmpdir.join('preamble.fmt'))
+    nex.run_files(input_paths=[str(preamble)],
+                  font_search_paths=[str(tmpdir)], dump_path=format_path)
+
+    document = tmpdir.join('document.tex')
+    document.write('\n'.join([
+        r'\count2=\count1',
+        r'\testfont\tw@ce{ab}\par',
+        r'\end',
+    ]))
+    state = nex.run_files(input_paths=[str(document)],
+                          font_search_paths=[str(tmpdir)],
+                          format_path=format_path)
+    assert state.registers.get(Instructions.count.value, 2) == 42
+    assert state.codes.get_cat_code('@') == CatCode.letter
+
+    def get_codes(item):
+        if isinstance(item, box.Character):
+            return [item.code]
+        elif isinstance(item, box.AbstractBox):
+            return [c for child in item.contents for c in get_codes(child)]
+        return []
+    page, = state.completed_pages
+    assert get_codes(page) == [ord(c) for c in 'abab']
+
+    # The fonts loaded by the preamble are defined in the DVI file, though
+    # their definitions are on no page.
+    dvi_path = str(tmpdir.join('document.dvi'))
+    nex.run_and_write(input_paths=[str(document)],
+                      font_search_paths=[str(tmpdir)], dvi_path=dvi_path,
+                      write_pdf=False, format_path=format_path)
+    with open(dvi_path, 'rb') as f:
+        selected_font_nrs, undefined_font_nrs = get_dvi_font_nrs(f.read())
+    assert selected_font_nrs
+    assert not undefined_font_nrs
+
+
+def test_load_bad_format(tmpdir):
+    format_path = tmpdir.join('bad.fmt')
+    format_path.write('not a format')
+    with pytest.raises(UserError):
+        GlobalState.from_format(str(format_path))
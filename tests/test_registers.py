@@ -3,6 +3,7 @@ import pytest
 from nex.constants.instructions import Instructions
 from nex.accessors import Registers, NotInScopeError
 from nex.box import HBox
+from nex.utils import GlueSpec
 
 
 def test_registers_empty():
@@ -52,6 +53,7 @@ def test_register_types():
     r = Registers(rmap)
     tokens = ['fake_token']
     dct = {'hihi': 3}
+    glue = GlueSpec(1, 2, 3)
     int_val = 5
     box = HBox(contents=[])
     for type_ in (Instructions.count.value, Instructions.dimen.value):
@@ -59,13 +61,15 @@ def test_register_types():
         r.set(type_, 0, int_val)
         # Bad type.
         with pytest.raises(TypeError):
-            r.set(type_, 0, dct)
+            r.set(type_, 0, glue)
         with pytest.raises(TypeError):
             r.set(type_, 0, tokens)
     for type_ in (Instructions.skip.value, Instructions.mu_skip.value):
         # Good type.
-        r.set(type_, 0, dct)
+        r.set(type_, 0, glue)
         # Bad type.
+        with pytest.raises(TypeError):
+            r.set(type_, 0, dct)
         with pytest.raises(TypeError):
             r.set(type_, 0, int_val)
         with pytest.raises(TypeError):
@@ -76,11 +80,11 @@ def test_register_types():
     with pytest.raises(TypeError):
         r.set(Instructions.toks.value, 0, int_val)
     with pytest.raises(TypeError):
-        r.set(Instructions.toks.value, 0, dct)
+        r.set(Instructions.toks.value, 0, glue)
     # Good type.
     r.set(Instructions.set_box.value, 0, box)
     # Bad type.
     with pytest.raises(TypeError):
         r.set(Instructions.set_box.value, 0, int_val)
     with pytest.raises(TypeError):
-        r.set(Instructions.set_box.value, 0, dct)
+        r.set(Instructions.set_box.value, 0, glue)
@@ -1,17 +1,25 @@
+import pickle
+
 import pytest
 
 from nex.constants.instructions import Instructions
 from nex.constants.commands import Commands
 from nex.constants.specials import Specials
+from nex.constants.parameters import Parameters
+from nex.constants.codes import CatCode
 from nex.state import Mode, GlobalState
 from nex import box
 from nex.box_writer import write_to_dvi_file
 from nex.state import ExecuteCommandError
-from nex.utils import UserError
+from nex.utils import UserError, GlueSpec, InfiniteDimension
+from nex.scopes import Operation
+from nex.router import NoSuchControlSequence
+from nex.accessors import NotInScopeError
 from nex.tokens import BuiltToken, CommandToken
-from nex.fonts import GlobalFontState
+from nex.fonts import GlobalFontState, KernStep, LigatureStep
 
-from common import DummyCommands, DummyGlobalFontState, ITok
+from common import (DummyCommands, DummyGlobalFontState, ITok,
+                    write_test_tfm)
 
 
 do_output = False
@@ -173,18 +181,35 @@ def test_unbox(state):
     assert nr_elems_after == nr_elems_before + 2
     unboxed_contents = state.get_unboxed_register_box(i=i_reg, copy=False,
                                                       horizontal=False)
-    inner_glue = unboxed_contents[0].contents[0]
+    # Glue inside inner boxes stays set by those boxes.
+    inner_box = unboxed_contents[0]
+    inner_glue = inner_box.contents[0]
     assert isinstance(inner_glue, box.Glue)
-    assert inner_glue.is_set
+    assert inner_box.set_glue
+    assert inner_box.get_length(inner_glue) == 20
 
+    # Glue at the outer level is free to be set again by a new box.
     outer_glue = unboxed_contents[1]
     assert isinstance(outer_glue, box.Glue)
-    assert not outer_glue.is_set
+    new_box = box.VBox(unboxed_contents[1:], to=150)
+    assert new_box.get_length(outer_glue) == 100
 
     # Should be empty now, because I called with copy == False just then.
     assert state.get_register_box(i=i_reg, copy=False) is None
 
 
+def test_copy_register_box(state):
+    box_item = box.HBox([box.Glue(20, stretch=10)], to=30)
+    state.set_box_register(token_source=None, i=2, item=box_item,
+                           is_global=False)
+    copies = [state.get_register_box(i=2, copy=True) for _ in range(2)]
+    # Each copy is its own box, sharing the stored box's contents.
+    assert copies[0] is not copies[1] is not box_item
+    assert copies[0].contents is box_item.contents
+    assert copies[1].width == 30
+    assert state.get_register_box(i=2, copy=False) is box_item
+
+
 def test_unbox_bad_box_type(state):
     box_item = box.HBox(contents=[box.Rule(1, 1, 1), box.Rule(2, 2, 2)])
     state.set_box_register(token_source=None, i=2, item=box_item, is_global=False)
@@ -225,6 +250,213 @@ def test_space_factor(state):
     assert state.specials.get(Specials.space_factor) == 1000
 
 
+def test_space_glue(state):
+    state.do_indent()
+
+    def add_space():
+        state.do_space()
+        g = state._layout_list[-1]
+        return g.natural_length, g.stretch, g.shrink
+
+    assert add_space() == (4, 2, 1)
+    state.specials.set(Specials.space_factor, 3000)
+    assert add_space() == (5, 6, 0)
+    # Check that changing a parameter is seen.
+    x_space_skip = GlueSpec(dimen=7, stretch=1, shrink=1)
+    state.start_local_group()
+    state.set_parameter(DummyTokenQueue(), is_global=False,
+                        name=Parameters.x_space_skip, value=x_space_skip)
+    assert add_space() == (7, 1, 1)
+    state.end_group(DummyTokenQueue())
+    assert add_space() == (5, 6, 0)
+
+
+def test_advance_glue_register(state):
+    type_ = Instructions.skip.value
+    state.set_register(DummyTokenQueue(), is_global=False, type_=type_, i=3,
+                       value=GlueSpec(10, stretch=2))
+    fil = InfiniteDimension(1, 1)
+    state.modify_register(DummyTokenQueue(), is_global=False, type_=type_,
+                          i=3, by_operand=GlueSpec(5, stretch=fil, shrink=1),
+                          operation=Operation.advance)
+    assert state.registers.get(type_, i=3) == GlueSpec(15, fil, 1)
+
+
+def test_command_token_advance_glue(state):
+    skip = Instructions.skip.value
+    state.set_register(DummyTokenQueue(), is_global=False, type_=skip, i=3,
+                       value=GlueSpec(10, stretch=2))
+    state.set_register(DummyTokenQueue(), is_global=False, type_=skip, i=4,
+                       value=GlueSpec(5, shrink=1))
+    by_skip_4 = BTok(type_='glue', value=BTok(type_=skip, value=nr_tok(4)))
+
+    def advance(variable):
+        return CTok(command=Commands.assign,
+                    value=BTok(type_='advance',
+                               value={'variable': variable,
+                                      'value': by_skip_4,
+                                      'global': False}))
+    skip_variable = BTok(type_=skip, value=nr_tok(3))
+    state.execute_command_token(advance(skip_variable), banisher=None)
+    assert state.registers.get(skip, i=3) == GlueSpec(15, 2, 1)
+
+    parameter = Parameters.base_line_skip
+    before = state.parameters.get(parameter)
+    parameter_variable = BTok(type_=Instructions.glue_parameter.value,
+                              value={'parameter': parameter})
+    state.execute_command_token(advance(parameter_variable), banisher=None)
+    assert state.parameters.get(parameter) == before + GlueSpec(5, shrink=1)
+
+
+def test_snapshot_restore(state):
+    state.do_indent()
+    state.add_character_char('a')
+    before = pickle.dumps(state.snapshot())
+    snapshot = state.snapshot()
+
+    # Change definitions, registers, parameters and codes, in a new group,
+    # and add to the lists.
+    state.start_local_group()
+    state.set_register(DummyTokenQueue(), is_global=True,
+                       type_=Instructions.count.value, i=2, value=5)
+    state.set_parameter(DummyTokenQueue(), is_global=False,
+                        name=Parameters.tolerance, value=200)
+    state.codes.set_cat_code(is_global=True, char_size=ord('@'),
+                             code_size=CatCode.letter.value)
+    state.router.set_macro(name='hi', replacement_text=[],
+                           parameter_text=[], def_type=BTok('G_DEF', None),
+                           prefixes=set(), parents=None)
+    state.add_hyphenation_exceptions(DummyTokenQueue(), ['ab-c'])
+    state.add_hyphenation_patterns(DummyTokenQueue(), ['a1b'])
+    state.set_hyphen_char(DummyTokenQueue(), state.current_font_id, 45)
+    state.add_character_char('b')
+    state.push_mode(Mode.restricted_horizontal)
+
+    state.restore(snapshot)
+    assert pickle.dumps(state.snapshot()) == before
+    assert state.mode == Mode.horizontal
+    with pytest.raises(NotInScopeError):
+        state.registers.get(Instructions.count.value, 2)
+    assert state.parameters.get(Parameters.tolerance) == 10000
+    assert state.codes.get_cat_code('@') == CatCode.other
+    with pytest.raises(NoSuchControlSequence):
+        state.router.lookup_control_sequence('hi', parents=None)
+    assert not state.hyphenator.patterns
+    assert not state.hyphenator.exceptions
+    assert state.current_font.hyphen_char is None
+
+    # The snapshot can be restored again after further changes.
+    state.add_character_char('c')
+    state.restore(snapshot)
+    assert pickle.dumps(state.snapshot()) == before
+
+
+def test_shared_characters(state):
+    state.do_indent()
+    state.add_character_char('a')
+    state.add_character_char('a')
+    a_1, a_2 = state._layout_list[-2], state._layout_list[-1]
+    assert a_1 is a_2
+
+    # Characters in another font are not shared with the first font.
+    first_font_id = state.current_font_id
+    state.start_local_group()
+    font_id = state.load_new_font(file_name='cmr10', at_clause=None)
+    state.select_font(DummyTokenQueue(), is_global=False, font_id=font_id)
+    assert state.current_font_id == font_id
+    state.add_character_char('a')
+    assert state._layout_list[-1] is not a_1
+    # Ending the group restores the outer font.
+    state.end_group(DummyTokenQueue())
+    assert state.current_font_id == first_font_id
+    state.add_character_char('a')
+    assert state._layout_list[-1] is a_1
+
+
+def get_test_font_state(tmpdir):
+    write_test_tfm(str(tmpdir.join('testfont.tfm')))
+    global_font_state = GlobalFontState(search_paths=[str(tmpdir)])
+    state = GlobalState.from_defaults(global_font_state=global_font_state)
+    font_id = state.load_new_font(file_name='testfont', at_clause=None)
+    state._select_font(is_global=True, font_id=font_id)
+    state.do_indent()
+    return state
+
+
+def test_kerning(tmpdir):
+    state = get_test_font_state(tmpdir)
+    state.add_character_char('A')
+    state.add_character_char('V')
+    a, kern, v = list(state._layout_list)[-3:]
+    assert (a.code, v.code) == (ord('A'), ord('V'))
+    assert kern.length == -65536
+
+
+def test_ligatures(tmpdir):
+    state = get_test_font_state(tmpdir)
+    for c in 'fif':
+        state.add_character_char(c)
+    assert [c.code for c in list(state._layout_list)[-2:]] == [12, ord('f')]
+
+
+def test_ligature_pass_over(state):
+    # "|=:|" with one character to pass over: keep both characters, and
+    # the ligature character becomes the current one, which then kerns with
+    # the next.
+    state.current_font.lig_kern_table = {
+        (ord('a'), ord('b')): LigatureStep(char_code=ord('x'),
+                                           nr_to_pass_over=1,
+                                           keep_current=True,
+                                           keep_next=True),
+        (ord('x'), ord('b')): KernStep(kern=5),
+    }
+    state.do_indent()
+    state.add_character_char('a')
+    state.add_character_char('b')
+    items = list(state._layout_list)[-4:]
+    assert [getattr(i, 'code', None) for i in items] == [ord('a'), ord('x'),
+                                                        None, ord('b')]
+    assert items[2].length == 5
+
+
+def test_hyphenate_h_list(tmpdir):
+    state = get_test_font_state(tmpdir)
+    state.hyphenator.add_patterns(['y1p', 'n1a'])
+    state.parameters.set_parameter(is_global=True,
+                                   name=Parameters.default_hyphen_char,
+                                   value=ord('-'))
+    state.do_space()
+    for c in 'hyphenation':
+        state.add_character_char(c)
+    h_list = state._hyphenate_h_list(list(state._layout_list))
+    discs = [i for i, item in enumerate(h_list)
+             if isinstance(item, box.DiscretionaryBreak)]
+    assert len(discs) == 2
+    assert [item.code for item in h_list[discs[0] - 2:discs[0]]] == [
+        ord('h'), ord('y')]
+    assert h_list[discs[0]].pre_break[0].code == ord('-')
+
+
+def test_hyphenate_word_after_kern(tmpdir):
+    state = get_test_font_state(tmpdir)
+    state.hyphenator.add_patterns(['a1b'])
+    state.parameters.set_parameter(is_global=True,
+                                   name=Parameters.default_hyphen_char,
+                                   value=ord('-'))
+    state.do_space()
+    state.append_to_list(box.Kern(3))
+    for c in 'abab':
+        state.add_character_char(c)
+    h_list = state._hyphenate_h_list(list(state._layout_list))
+    codes = [getattr(item, 'code', None) for item in h_list]
+    discs = [i for i, item in enumerate(h_list)
+             if isinstance(item, box.DiscretionaryBreak)]
+    # "a-ba-b", with the kern kept before the word.
+    assert [codes[i - 1] for i in discs] == [ord('a'), ord('a')]
+    assert isinstance(h_list[discs[0] - 2], box.Kern)
+    assert h_list[discs[0]].pre_break[0].code == ord('-')
+
+
 def test_after_group(state):
     # Input "{\aftergroup\space \aftergroup a}".
 
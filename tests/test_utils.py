@@ -1,4 +1,5 @@
-from nex.utils import ensure_extension, file_path_to_chars
+from nex.utils import (ensure_extension, file_path_to_chars,
+                       InfiniteDimension, GlueSpec, sum_infinities)
 
 from common import (test_file_name, test_chars)
 
@@ -20,3 +21,45 @@ def test_file_to_chars():
     Test utility to add an extension to TeX file names if it is not supplied.
     """
     assert file_path_to_chars(test_file_name) == test_chars
+
+
+def test_infinite_dimension_arithmetic():
+    fil, fill = InfiniteDimension(1, 1), InfiniteDimension(1, 2)
+    assert fil + fil == InfiniteDimension(2, 1)
+    # The higher order wins.
+    assert fil + fill == fill
+    assert 5 + fil == fil + 5 == fil
+    # Infinities that cancel out leave a finite zero.
+    assert fil - fil == 0
+    assert fil * -3 == -3 * fil == InfiniteDimension(-3, 1)
+    # Infinities are ordered above or below any finite dimension.
+    assert -fil < -100 < 0 < 100 < fil < fill
+    assert len({fil, InfiniteDimension(1, 1)}) == 1
+    assert sum_infinities([2, fil, fill, 3, fil]) == [5, 2, 1]
+
+
+def test_zero_infinities():
+    zero_fil, zero_fill = InfiniteDimension(0, 1), InfiniteDimension(0, 2)
+    fil = InfiniteDimension(1, 1)
+    # A zero infinity has order zero, so it does not beat lower orders.
+    assert zero_fil + 5 == 5 + zero_fil == 5
+    assert type(zero_fil + 5) is int
+    assert fil + zero_fill == fil
+    assert zero_fil == 0 == zero_fill
+    assert zero_fil == zero_fill
+    assert hash(zero_fil) == hash(zero_fill)
+    assert (GlueSpec(0, stretch=zero_fil) + GlueSpec(0, stretch=3)
+            == GlueSpec(0, stretch=3))
+    assert sum_infinities([True, 3]) == [4]
+
+
+def test_glue_spec():
+    fil = InfiniteDimension(1, 1)
+    a = GlueSpec(10, stretch=fil, shrink=2)
+    b = GlueSpec(5, stretch=3)
+    assert a + b == GlueSpec(15, fil, 2)
+    assert a - a == GlueSpec(0, 0, 0)
+    assert b * 2 == GlueSpec(10, 6, 0)
+    dimen, stretch, shrink = a
+    assert (dimen, stretch, shrink) == (a.dimen, a.stretch, a.shrink)
+    assert hash(a) == hash(GlueSpec(10, fil, 2))
@@ -0,0 +1,126 @@
+import functools
+import os
+import signal
+import time
+
+import pytest
+
+from nex import nex
+from nex.zygote import serve, send_request
+
+from common import write_test_tfm
+
+
+@pytest.fixture()
+def start_zygote(tmpdir):
+    """Start a zygote in a forked process, and stop it afterwards."""
+    pids = []
+    socket_path = str(tmpdir.join('zygote.sock'))
+
+    def start(run_request):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve(socket_path, run_request)
+            finally:
+                os._exit(1)
+        pids.append(pid)
+        for _ in range(500):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.01)
+        return socket_path
+
+    yield start
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+
+def test_zygote_children_share_state(start_zygote):
+    jobs = []
+
+    def run_request(request):
+        jobs.append(request['job'])
+        return {'jobs': jobs, 'pid': os.getpid()}
+
+    socket_path = start_zygote(run_request)
+    response_1 = send_request(socket_path, {'job': 1})
+    response_2 = send_request(socket_path, {'job': 2})
+    # Each job starts from the zygote's state, not the last job's.
+    assert response_1['jobs'] == [1]
+    assert response_2['jobs'] == [2]
+    assert response_1['pid'] != response_2['pid']
+    assert response_1['error'] is None
+
+
+def test_zygote_reports_errors(start_zygote):
+    def run_request(request):
+        raise ValueError('Bad job')
+
+    socket_path = start_zygote(run_request)
+    response = send_request(socket_path, {})
+    assert 'Bad job' in response['error']
+
+
+def test_zygote_job(tmpdir, start_zygote):
+    write_test_tfm(str(tmpdir.join('testfont.tfm')))
+    # A preamble is run to its end, rather than to \end.
+    preamble = tmpdir.join('preamble.tex')
+    preamble.write('\n'.join([
+        r'\catcode`\{=1',
+        r'\catcode`\}=2',
+        r'\catcode`\#=6',
+        r'\def\twice#1{#1#1}',
+        r'\font\testfont=testfont',
+    ]))
+    state = nex.make_state(font_search_paths=[str(tmpdir)])
+    nex.run_preamble(state, [str(preamble)])
+
+    socket_path = start_zygote(functools.partial(nex.run_zygote_job, state))
+    document = tmpdir.join('document.tex')
+    document.write('\n'.join([
+        r'\testfont\twice{ab}\par',
+        r'\end',
+    ]))
+    dvi_path = str(tmpdir.join('document.dvi'))
+    response = send_request(socket_path, {
+        'cwd': str(tmpdir),
+        'input_paths': [str(document)],
+        'font_search_paths': [],
+        'dvi_path': dvi_path,
+        'write_pdf': False,
+        'dvi_workers': 1,
+        'pages': None,
+    })
+    assert response['error'] is None
+    with open(dvi_path, 'rb') as f:
+        # The preamble op-code, then the DVI format.
+        assert f.read(2) == bytes([247, 2])
+
+
+def test_zygote_job_finds_fonts_in_cwd(tmpdir, start_zygote):
+    # The font is only in the job's working directory, not the zygote's.
+    write_test_tfm(str(tmpdir.join('testfont.tfm')))
+    state = nex.make_state(font_search_paths=[])
+    nex.run_preamble(state, [])
+
+    socket_path = start_zygote(functools.partial(nex.run_zygote_job, state))
+    document = tmpdir.join('document.tex')
+    document.write('\n'.join([
+        r'\font\testfont=testfont',
+        r'\testfont ab\par',
+        r'\end',
+    ]))
+    dvi_path = str(tmpdir.join('document.dvi'))
+    response = send_request(socket_path, {
+        'cwd': str(tmpdir),
+        'input_paths': [str(document)],
+        'font_search_paths': [],
+        'dvi_path': dvi_path,
+        'write_pdf': False,
+        'dvi_workers': 1,
+        'pages': None,
+    })
+    assert response['error'] is None
+    assert os.path.exists(dvi_path)